@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""Benchmark the RuleSet engine against scanning the text once per rule.
+
+Usage: python benchmarks/bench_engine.py [--lines N [N ...]] [--repeat R]
+"""
+
+from __future__ import print_function
+import sys
+import time
+import argparse
+
+from cmspubstyle.rules import normal_text
+from cmspubstyle.rules import latex
+from cmspubstyle.rules.classes import Text
+from cmspubstyle.rules.engine import RuleSet
+
+
+ALL_RULES = normal_text.RULES + latex.RULES
+
+
+def make_lines(num_lines):
+    """Make a text of num_lines lines out of the rule test fixtures"""
+    sample = []
+    for test in normal_text.TESTS + latex.TESTS:
+        sample.append(test.text.text_as_one_line)
+        sample.append("We present a search for new physics in events with jets, "
+                      "using data collected by the experiment in 2016.")
+    return (sample * (num_lines // len(sample) + 1))[:num_lines]
+
+
+def time_it(func, repeat):
+    """Return best time of repeat calls to func, and its result"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def main(in_args):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="Number of lines of text to scan")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of repeats, best time is reported")
+    args = parser.parse_args(in_args)
+
+    rule_set = RuleSet(ALL_RULES)
+    print("%d ALL() rules, %d scanned individually" % (len(rule_set.all_rules),
+                                                       len(rule_set.individual_rules)))
+    print("{0:>8} {1:>10} {2:>12} {3:>12} {4:>8}".format("lines", "matches", "per-rule [s]",
+                                                          "engine [s]", "speedup"))
+    for num_lines in args.lines:
+        text = Text(make_lines(num_lines))
+
+        def per_rule():
+            return sum(len(list(text.find_iter(rule.re_pattern))) for rule in rule_set.all_rules)
+
+        def engine():
+            return sum(len(matches) for matches in rule_set.find_matches(text).values())
+
+        time_per_rule, num_per_rule = time_it(per_rule, args.repeat)
+        time_engine, num_engine = time_it(engine, args.repeat)
+        if num_per_rule != num_engine:
+            raise RuntimeError("Engine found %d matches, per-rule loop found %d"
+                               % (num_engine, num_per_rule))
+        print("{0:>8} {1:>10} {2:>12.3f} {3:>12.3f} {4:>7.1f}x".format(
+            num_lines, num_engine, time_per_rule, time_engine, time_per_rule / time_engine))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""Benchmark the cold start of pubcheck.py, i.e. the time to import it & build the rules.
+
+Each repeat imports cmspubstyle.pubcheck in a fresh python process with -X importtime,
+and the median time for the whole import & for the rule modules is reported.
+
+Usage: python benchmarks/bench_import.py [--repeat R] [--json FILE]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+import subprocess
+from collections import OrderedDict
+
+
+MODULES = [
+    "cmspubstyle.pubcheck",
+    "cmspubstyle.rules.normal_text",
+    "cmspubstyle.rules.latex",
+    "cmspubstyle.rules.bundle",
+    "cmspubstyle.rules.engine",
+    "cmspubstyle.rules.classes",
+]
+
+
+def import_times():
+    """Import pubcheck in a new process, returning dict of {module: cumulative time in s}"""
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([package_dir, env.get('PYTHONPATH', '')])
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import cmspubstyle.pubcheck"],
+                            env=env, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if module.strip() in MODULES:
+            times[module.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.
+
+
+def main(in_args):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Number of fresh processes, median time is reported")
+    parser.add_argument("--json", help="Also save results to this JSON file")
+    args = parser.parse_args(in_args)
+
+    all_times = [import_times() for _ in range(args.repeat)]
+    results = OrderedDict((module, median([times.get(module, 0) for times in all_times]))
+                          for module in MODULES)
+    for module, duration in results.items():
+        print("{0:<35} {1:>8.1f} ms".format(module, duration * 1e3))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""Benchmark the latency of re-checking a file after a single edit.
+
+For each size & kind of file, a synthetic file is checked once with an IncrementalChecker,
+then a line somewhere in it is edited (or added) & the file re-checked, many times.
+The median & worst time per edit are compared with checking the whole file again.
+
+The kinds of file are a section of a paper ("body"), a whole paper in one main file,
+inside \begin{document} ("main"), and a section with a { that is never closed ("unclosed").
+
+Usage: python benchmarks/bench_incremental.py [--lines N [N ...]] [--kinds K [K ...]] [--edits E]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import bisect
+import random
+import shutil
+import argparse
+import tempfile
+
+from cmspubstyle import pubcheck
+from cmspubstyle.incremental import IncrementalChecker
+from cmspubstyle.rules.classes import Text
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from make_paper import make_body, make_paper  # noqa: E402
+
+
+KINDS = ["body", "main", "unclosed"]
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.
+
+
+def summary(problems, blocks):
+    """Get the problems that can be found by checking a block & its neighbours.
+
+    Problems reaching past the block after the one they start in (e.g. from a rule
+    matching from the start of the text) are only found when everything is checked
+    in one go, so are left out.
+    """
+    block_starts = [block.start for block in blocks]
+    result = []
+    for p in problems:
+        first = bisect.bisect_right(block_starts, p.lines[0].line_num - 1)
+        last = bisect.bisect_right(block_starts, p.lines[-1].line_num - 1)
+        if last - first <= 1:
+            result.append((p.rule, p.lines[0].line_num, p.match.group(0)))
+    return result
+
+
+def make_lines(kind, rng, num_lines, seed):
+    """Make list of about num_lines lines of a file of the given kind"""
+    if kind == "main":
+        directory = tempfile.mkdtemp()
+        try:
+            filename = make_paper(directory, num_lines, fan_out=0, depth=0, seed=seed)
+            with open(filename) as f:
+                return f.readlines()
+        finally:
+            shutil.rmtree(directory)
+    lines = [line + "\n" for line in make_body(rng, num_lines, 0.3, 2, "Benchmark")]
+    if kind == "unclosed":
+        lines.insert(3, "{\\bf Note: the brace here is never closed.\n")
+    return lines
+
+
+def main(in_args):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 5000, 20000],
+                        help="Number of lines in the file")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=KINDS,
+                        help="Kinds of file")
+    parser.add_argument("--edits", type=int, default=50,
+                        help="Number of single-line edits")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args(in_args)
+
+    print("{0:>8} {1:>8} {2:>8} {3:>10} {4:>12} {5:>12} {6:>12} {7:>8}".format(
+        "file", "lines", "blocks", "checked", "full [ms]", "median [ms]", "worst [ms]",
+        "speedup"))
+    for kind, num_lines in [(kind, num_lines) for kind in args.kinds for num_lines in args.lines]:
+        rng = random.Random(args.seed)
+        lines = make_lines(kind, rng, num_lines, args.seed)
+
+        start = time.time()
+        full_problems = list(pubcheck.check_text(Text(lines), False))
+        time_full = time.time() - start
+
+        checker = IncrementalChecker()
+        blocks = checker.split_blocks(lines)
+        if summary(checker.check(lines), blocks) != summary(full_problems, blocks):
+            raise RuntimeError("Incremental check differs from full check")
+
+        durations, num_checked = [], []
+        for edit in range(args.edits):
+            ind = rng.randrange(len(lines))
+            if edit % 2:
+                # so everything after it moves down a line
+                lines.insert(ind, "The the new line.\n")
+            else:
+                # like typing a word into a line
+                column = rng.randint(0, len(lines[ind]) - 1)
+                lines[ind] = lines[ind][:column] + "the the " + lines[ind][column:]
+            start = time.time()
+            checker.check(lines)
+            durations.append(time.time() - start)
+            num_checked.append(checker.num_checked)
+
+        blocks = checker.split_blocks(lines)
+        if (summary(checker.check(lines), blocks)
+                != summary(pubcheck.check_text(Text(lines), False), blocks)):
+            raise RuntimeError("Incremental check differs from full check after edits")
+        print("{0:>8} {1:>8} {2:>8} {3:>10.1f} {4:>12.1f} {5:>12.1f} {6:>12.1f} {7:>7.1f}x".format(
+            kind, num_lines, checker.num_blocks, median(num_checked), time_full * 1e3,
+            median(durations) * 1e3, max(durations) * 1e3, time_full / median(durations)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""Benchmark the whole pubcheck.py pipeline on synthetic papers of different sizes.
+
+For each paper, reports the time for each phase (reading files, making Texts,
+scanning for rules, reporting problems), the throughput & peak memory of a
+full pubcheck.main() run.
+
+Usage: python benchmarks/bench_pipeline.py [--lines N [N ...]] [--math F [F ...]]
+                                           [--nesting N [N ...]] [--fanOut N [N ...]] [--depth N]
+                                           [--repeat R] [--json FILE]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import tracemalloc
+from collections import OrderedDict
+
+from cmspubstyle import pubcheck
+from cmspubstyle.includes import FileStore, read_file, decode_lines
+from cmspubstyle.rules.classes import Text
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from make_paper import make_paper  # noqa: E402
+
+
+def time_phases(root):
+    """Time each phase of checking a paper separately, returning OrderedDict of {phase: time}"""
+    with FileStore() as file_store:
+        filenames = pubcheck.extract_input_files(root, file_store)['contents']
+
+    timings = OrderedDict()
+    start = time.time()
+    datas = [read_file(filename)[1] for filename in filenames]
+    timings['read'] = time.time() - start
+
+    start = time.time()
+    texts = [Text(decode_lines(data)) for data in datas]
+    timings['text'] = time.time() - start
+
+    start = time.time()
+    problems = []
+    for command in ["abstract", "title"]:
+        problems.extend(pubcheck.check_text(next(texts[0].iter_command(command)), False))
+    for text in texts:
+        problems.extend(pubcheck.check_text(text, False))
+    timings['scan'] = time.time() - start
+
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        for broken_rule in problems:
+            pubcheck.report_error(broken_rule, out=devnull)
+    timings['report'] = time.time() - start
+    return timings, len(problems)
+
+
+def run_main(root, trace_memory=False):
+    """Run pubcheck.main on a paper without a cache, and hiding its output.
+
+    Returns (time taken, peak memory in bytes if trace_memory else None)
+    """
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    os.chdir(os.path.dirname(root))
+    try:
+        if os.path.isfile("checker_cache.json"):
+            os.remove("checker_cache.json")
+        sys.stdout = open(os.devnull, 'w')
+        if trace_memory:
+            tracemalloc.start()
+        start = time.time()
+        pubcheck.main([os.path.basename(root)])
+        duration = time.time() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.chdir(cwd)
+    return duration, peak
+
+
+def best_of(func, repeat, key):
+    """Return the result of repeat calls to func with the smallest key(result)"""
+    return min((func() for _ in range(repeat)), key=key)
+
+
+def main(in_args):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Total number of lines in each paper")
+    parser.add_argument("--math", type=float, nargs="+", default=[0.3],
+                        help="Fraction of sentences with inline maths")
+    parser.add_argument("--nesting", type=int, nargs="+", default=[2],
+                        help="Deepest level of nested itemize environments")
+    parser.add_argument("--fanOut", type=int, nargs="+", default=[4],
+                        help="Number of files included per file")
+    parser.add_argument("--depth", type=int, default=1, help="Number of levels of included files")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Number of repeats, best time is reported")
+    parser.add_argument("--json", help="Also save results to this JSON file")
+    args = parser.parse_args(in_args)
+
+    header = ("{0:>7} {1:>5} {2:>4} {3:>4} {4:>6} {5:>8} {6:>8} {7:>8} {8:>8} "
+              "{9:>8} {10:>9} {11:>7} {12:>9}")
+    row = ("{0:>7} {1:>5.2f} {2:>4} {3:>4} {4:>6} {5:>8.3f} {6:>8.3f} {7:>8.3f} {8:>8.3f} "
+           "{9:>8.3f} {10:>9.0f} {11:>7.2f} {12:>9.1f}")
+    print(header.format("lines", "math", "nest", "fan", "issues", "read [s]", "text [s]",
+                        "scan [s]", "rep. [s]", "main [s]", "lines/s", "MB/s", "peak [MB]"))
+
+    results = []
+    for num_lines, maths, nesting, fan_out in itertools.product(args.lines, args.math,
+                                                                args.nesting, args.fanOut):
+        directory = tempfile.mkdtemp(prefix="cmspubstyle_bench_")
+        try:
+            root = make_paper(directory, num_lines, maths, nesting, fan_out, args.depth)
+            num_bytes = sum(os.path.getsize(os.path.join(directory, f))
+                            for f in os.listdir(directory))
+            total_lines = 0
+            for filename in os.listdir(directory):
+                with open(os.path.join(directory, filename)) as f:
+                    total_lines += sum(1 for _ in f)
+
+            timings, num_problems = best_of(lambda: time_phases(root), args.repeat,
+                                            key=lambda x: sum(x[0].values()))
+            main_time, _ = best_of(lambda: run_main(root), args.repeat, key=lambda x: x[0])
+            _, peak_memory = run_main(root, trace_memory=True)
+        finally:
+            shutil.rmtree(directory)
+
+        result = OrderedDict([('lines', total_lines), ('bytes', num_bytes), ('math', maths),
+                              ('nesting', nesting), ('fan_out', fan_out), ('depth', args.depth),
+                              ('problems', num_problems), ('phases', timings),
+                              ('main', main_time), ('lines_per_s', total_lines / main_time),
+                              ('mb_per_s', num_bytes / 1e6 / main_time),
+                              ('peak_memory_mb', peak_memory / 1e6)])
+        results.append(result)
+        print(row.format(total_lines, maths, nesting, fan_out, num_problems,
+                         timings['read'], timings['text'], timings['scan'], timings['report'],
+                         main_time, result['lines_per_s'], result['mb_per_s'],
+                         result['peak_memory_mb']))
+        sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""Make a synthetic CMS paper, split over many included files, for benchmarking.
+
+The same arguments always give the same paper.
+
+Usage: python benchmarks/make_paper.py <output directory> [--lines N] [--math F]
+                                       [--nesting N] [--fanOut N] [--depth N] [--seed S]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import random
+import argparse
+
+
+# Mix of good sentences & ones that break some rules
+SENTENCES = [
+    "We present a search for new physics in events with jets and missing transverse momentum.",
+    "The data were collected by the CMS experiment at the LHC in 2016.",
+    "The data set corresponds to an integrated luminosity of 35.9\\fbinv.",
+    "Jets are reconstructed with the anti-\\kt algorithm with a distance parameter of 0.4.",
+    "The dominant backgrounds are estimated from control regions in data.",
+    "Systematic uncertainties are described in Section~\\ref{sec:systematics}.",
+    "The results are shown in Fig.~\\ref{fig:results}, and agree with the SM prediction.",
+    "No significant excess is observed above the expected background.",
+    "The Standard Model is great, e.g. for the the top quark.",
+    "Results from Ram et al show a large effect at 13 TeV.",
+    "We use Monte-Carlo samples with errors of 5-10\\%.",
+    "The dataset was large; it's a big effect, i.e. a surprise.",
+    "Events are required to have at least 2 jets with p_T > 30 GeV.",
+    "Fig. \\ref{fig:a} shows the distribution. % TODO i.e. check this",
+]
+
+MATHS = [
+    r"$\pt > 30\GeV$",
+    r"$\abs{\eta} < 2.4$",
+    r"$\frac{1}{2}$",
+    r"$ sin x$",
+    r"$m_{\PQt} = 172.5\GeV$",
+    r"$5$",
+    r"$\sqrt{s} = 13\TeV$",
+    r"$\Delta\phi(\ptvecmiss, \text{jet}) > 0.5$",
+]
+
+EQUATIONS = [
+    [r"\begin{equation}", r"  \sigma = \frac{N - B}{\epsilon \mathcal{L}},", r"\end{equation}"],
+    [r"\begin{equation}", r"  a = sin(x) \rightarrow b", r"\end{equation}"],
+    [r"\begin{equation*}", r"  \mT = \sqrt{2 \pt \ptmiss (1 - \cos\Delta\phi)}", r"\end{equation*}"],
+]
+
+
+def make_paragraph(rng, maths):
+    """Make list of lines for a paragraph, with a fraction maths of sentences having inline maths"""
+    lines = []
+    for _ in range(rng.randint(3, 8)):
+        sentence = rng.choice(SENTENCES)
+        if rng.random() < maths:
+            sentence = sentence[:-1] + " with " + rng.choice(MATHS) + "."
+        lines.append(sentence)
+    return lines
+
+
+def make_list(rng, maths, nesting):
+    """Make list of lines for an itemize, with itemizes nested up to nesting deep"""
+    indent = "  " * nesting
+    lines = [indent + r"\begin{itemize}"]
+    for _ in range(rng.randint(2, 4)):
+        lines.append(indent + r"\item " + rng.choice(SENTENCES))
+        if nesting > 1 and rng.random() < 0.5:
+            lines.extend(make_list(rng, maths, nesting - 1))
+    lines.append(indent + r"\end{itemize}")
+    return lines
+
+
+def make_body(rng, num_lines, maths, nesting, section_name):
+    """Make list of about num_lines lines of a section"""
+    lines = [r"\section{" + section_name + "}", r"\label{sec:" + section_name.lower() + "}", ""]
+    while len(lines) < num_lines:
+        choice = rng.random()
+        if nesting > 0 and choice < 0.1:
+            lines.extend(make_list(rng, maths, nesting))
+        elif choice < 0.1 + maths * 0.3:
+            lines.extend(rng.choice(EQUATIONS))
+        else:
+            lines.extend(make_paragraph(rng, maths))
+        lines.append("")
+    return lines[:num_lines]
+
+
+def make_paper(directory, num_lines=1000, maths=0.3, nesting=2, fan_out=4, depth=1, seed=1):
+    """Write a paper of about num_lines lines in total to directory.
+
+    The main file includes fan_out files, each of which includes fan_out more,
+    down to depth levels of includes. maths is the fraction of sentences with
+    inline maths, and nesting the deepest level of nested itemize environments.
+    Returns the filename of the main file.
+    """
+    rng = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # names of included files, and their included files
+    children = {}
+    level = ["paper"]
+    for this_depth in range(depth):
+        next_level = []
+        for name in level:
+            children[name] = ["%s_%d" % ("sec" if name == "paper" else name, ind)
+                              for ind in range(fan_out)]
+            next_level.extend(children[name])
+        level = next_level
+    names = ["paper"] + sorted(name for names in children.values() for name in names)
+    lines_per_file = max(num_lines // len(names), 10)
+
+    for name in names:
+        if name == "paper":
+            lines = [r"\documentclass{cmspaper}", r"\begin{document}",
+                     r"\title{Search for new physics with the CMS detector at 13 TeV}",
+                     r"\abstract{", rng.choice(SENTENCES), rng.choice(SENTENCES), "}", ""]
+            body = make_body(rng, lines_per_file - len(lines) - 1, maths, nesting, "Introduction")
+        else:
+            lines = []
+            body = make_body(rng, lines_per_file, maths, nesting, name.capitalize())
+        lines.extend(body)
+        lines.extend(r"\input{" + child + "}" for child in children.get(name, []))
+        if name == "paper":
+            lines.append(r"\end{document}")
+        with open(os.path.join(directory, name + ".tex"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    return os.path.join(directory, "paper.tex")
+
+
+def main(in_args):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help="Directory to write the paper to")
+    parser.add_argument("--lines", type=int, default=1000, help="Total number of lines")
+    parser.add_argument("--math", type=float, default=0.3,
+                        help="Fraction of sentences with inline maths")
+    parser.add_argument("--nesting", type=int, default=2,
+                        help="Deepest level of nested itemize environments")
+    parser.add_argument("--fanOut", type=int, default=4, help="Number of files included per file")
+    parser.add_argument("--depth", type=int, default=1, help="Number of levels of included files")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args(in_args)
+    print(make_paper(args.output, args.lines, args.math, args.nesting, args.fanOut,
+                     args.depth, args.seed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,149 @@
+"""Check LaTeX from other python code, getting back Violations instead of printed output"""
+
+
+import io
+import hashlib
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+from cmspubstyle import pubcheck
+from cmspubstyle.includes import FileStore, read_file, decode_lines
+from cmspubstyle.output import make_record
+from cmspubstyle.rules.classes import Text
+from cmspubstyle.rules.watchdog import Watchdog
+
+
+# One broken rule, see output.make_record() for the fields. part is None,
+# or e.g. TITLE for problems in the title of the main TeX file
+Violation = namedtuple("Violation", ["file", "part", "line_start", "line_end", "column_start",
+                                     "column_end", "rule", "rule_index", "match"])
+
+
+def make_violation(filename, broken_rule, part=None):
+    """Make Violation from a RuleBroken in filename (and part, e.g. TITLE, if given)"""
+    record = make_record(filename, broken_rule, pubcheck.RULE_INDEX[broken_rule.rule], part)
+    record['part'] = part
+    return Violation(**record)
+
+
+class Checker(object):
+    """Check LaTeX against all the rules in this process, without printing anything.
+
+    The rules are only compiled once per process, however many Checkers are made.
+    Results are kept for each file (or filename given to check_string()), so
+    checking the same contents again is cheap. If cache_filename is given,
+    results are also loaded from that cache file, and check_document()
+    saves its results to it, like pubcheck.py does.
+
+    Each rule can spend at most rule_timeout seconds on each text (0 for no limit).
+    Rules that go over are listed in timeouts as (label, rule description, or
+    None for the combined scan), for the last check.
+    """
+
+    def __init__(self, do_comments=False, rule_timeout=10, cache_filename=None):
+        self.do_comments = do_comments
+        self.rule_timeout = rule_timeout
+        self.cache_filename = cache_filename
+        self.cache_key = pubcheck.make_cache_key(do_comments)
+        self.file_cache = {}
+        if cache_filename is not None:
+            self.file_cache = pubcheck.read_files_from_cache(cache_filename, self.cache_key)
+        self.timeouts = []
+
+    @property
+    def rules(self):
+        """List of all Rules, in the order Violation.rule_index refers to"""
+        return pubcheck.ALL_RULES
+
+    @contextmanager
+    def _rules_state(self):
+        """Set up the shared RuleSet for this Checker, putting it back afterwards"""
+        rule_set = pubcheck.RULE_SET
+        old_state = (rule_set.profile, rule_set.watchdog, rule_set.num_scans, rule_set.num_skipped)
+        rule_set.profile = None
+        rule_set.watchdog = Watchdog(self.rule_timeout) if self.rule_timeout > 0 else None
+        try:
+            yield rule_set.watchdog
+        finally:
+            rule_set.profile, rule_set.watchdog, rule_set.num_scans, rule_set.num_skipped = \
+                old_state
+
+    def _get_problems(self, label, content_hash, get_text, parent=None):
+        """Get list of RuleBroken for a Text, reusing the last results if content_hash matches.
+
+        get_text is called to make the Text if it needs checking. If parent is given,
+        the Text is part of it, and problems are given in parent (see pubcheck.check_part()).
+        """
+        problems = pubcheck.get_cached_problems(self.file_cache, label, content_hash)
+        if problems is not None:
+            return problems
+        with self._rules_state() as watchdog:
+            if watchdog is not None:
+                watchdog.filename = label
+            if parent is None:
+                problems = list(pubcheck.check_text(get_text(), self.do_comments))
+            else:
+                problems = list(pubcheck.check_part(parent, get_text(), self.do_comments))
+            timeouts = [] if watchdog is None else watchdog.timeouts
+        self.timeouts.extend((filename, None if rule is None else rule.description)
+                             for filename, rule in timeouts)
+        # incomplete results shouldn't be reused
+        if not timeouts:
+            pubcheck.store_cached_problems(self.file_cache, label, content_hash, problems)
+        return problems
+
+    def check_string(self, contents, filename="<string>"):
+        """Check a str of LaTeX as normal text, returning list of Violation.
+
+        filename is used to label the Violations, and to reuse results
+        if the same contents are checked again.
+        """
+        self.timeouts = []
+        content_hash = hashlib.sha1(contents.encode('utf-8')).hexdigest()
+        # split into lines the same way as when reading a file
+        get_text = lambda: Text(io.StringIO(contents, newline=None).readlines())  # noqa: E731
+        return [make_violation(filename, p)
+                for p in self._get_problems(filename, content_hash, get_text)]
+
+    def check_file(self, filename):
+        """Check one file as normal text, not following any \\input, returning list of Violation"""
+        self.timeouts = []
+        content_hash, data = read_file(filename)
+        return [make_violation(filename, p)
+                for p in self._get_problems(filename, content_hash,
+                                            lambda: Text(decode_lines(data)))]
+
+    def check_document(self, tex_file):
+        """Check a main TeX file, its title & abstract, and all the files it includes.
+
+        Returns list of Violation in the same order as pubcheck.py prints them.
+        """
+        self.timeouts = []
+        results = OrderedDict()
+        violations = []
+        with FileStore() as file_store:
+            files_dict = pubcheck.extract_input_files(tex_file, file_store)
+            root = files_dict['root']
+            root_hash, _ = file_store.get(root)
+            for part, command in pubcheck.ROOT_PARTS:
+                root_text = file_store.get_text(root)
+                part_text = next(root_text.iter_command(command), None)
+                if part_text is None:
+                    continue
+                label = pubcheck.make_label(root, part)
+                results[label] = self._get_problems(label, root_hash, lambda: part_text,
+                                                    parent=root_text)
+                violations.extend(make_violation(root, p, part) for p in results[label])
+
+            for filename in files_dict['contents']:
+                file_store.prefetch(filename)
+            for filename in files_dict['contents']:
+                file_hash, _ = file_store.get(filename)
+                results[filename] = self._get_problems(
+                    filename, file_hash, lambda: file_store.get_text(filename))
+                violations.extend(make_violation(filename, p) for p in results[filename])
+
+        if self.cache_filename is not None:
+            pubcheck.write_results_to_cache(results, self.cache_filename, tex_file,
+                                            self.file_cache, self.cache_key)
+        return violations
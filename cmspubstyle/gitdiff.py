@@ -0,0 +1,89 @@
+"""Find which lines of the .tex files in a directory have changed since a git revision.
+
+Uses the local git, comparing the working tree (including uncommitted changes)
+with the revision. Untracked .tex files count as completely changed.
+"""
+
+
+import os
+import re
+import subprocess
+from collections import OrderedDict
+
+
+# number of old lines in a hunk (1 if not given), start of the new lines, and how many there are
+HUNK_RE = re.compile(r"^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def run_git(directory, git_args):
+    """Run git in directory, returning its output. Raises RuntimeError if it fails"""
+    try:
+        result = subprocess.run(["git", "-c", "core.quotePath=false"] + git_args, cwd=directory,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+    except OSError as err:
+        raise RuntimeError("Could not run git: " + str(err))
+    if result.returncode != 0:
+        raise RuntimeError("git " + " ".join(git_args) + " failed: " + result.stderr.strip())
+    return result.stdout
+
+
+def parse_diff(diff):
+    """Parse output of git diff -U0, returning OrderedDict of {filename: set of changed line numbers}.
+
+    The diff must have the default a/ & b/ prefixes on filenames.
+    Line numbers are in the new version of each file. Where lines were only removed,
+    the lines either side are counted as changed, as they are now next to each other.
+    Removed files are skipped.
+    """
+    changed = OrderedDict()
+    line_nums = None
+    # number of old & new lines left in the current hunk
+    old_left, new_left = 0, 0
+    for line in diff.splitlines():
+        if old_left > 0 or new_left > 0:
+            # inside a hunk, so lines like "+++ x" are content, not headers
+            if line.startswith("-"):
+                old_left -= 1
+            elif line.startswith("+"):
+                new_left -= 1
+            elif line.startswith(" "):
+                old_left -= 1
+                new_left -= 1
+            continue
+        if line.startswith("+++ "):
+            filename = line[4:]
+            if filename == "/dev/null":
+                line_nums = None
+                continue
+            # strip the b/ prefix
+            line_nums = changed.setdefault(filename[2:], set())
+            continue
+        match = HUNK_RE.match(line)
+        if match is None or line_nums is None:
+            continue
+        old_left = 1 if match.group(1) is None else int(match.group(1))
+        start = int(match.group(2))
+        new_left = 1 if match.group(3) is None else int(match.group(3))
+        if new_left == 0:
+            line_nums.update([start, start + 1])
+        else:
+            line_nums.update(range(start, start + new_left))
+    return changed
+
+
+def get_changed_lines(directory, rev):
+    """Get the .tex files in directory (and below) changed since git revision rev.
+
+    Returns OrderedDict of {filename: set of changed line numbers, or None if the whole
+    file is new}, with filenames relative to directory.
+    """
+    # set the prefixes in case the user's config changes them
+    diff = run_git(directory, ["diff", "-U0", "--no-color", "--no-ext-diff", "--relative",
+                               "--src-prefix=a/", "--dst-prefix=b/", rev, "--", "*.tex"])
+    changed = parse_diff(diff)
+    untracked = run_git(directory, ["ls-files", "--others", "--exclude-standard", "--", "*.tex"])
+    for filename in untracked.splitlines():
+        changed[filename] = None
+    return OrderedDict((os.path.normpath(filename), line_nums)
+                       for filename, line_nums in changed.items())
@@ -0,0 +1,166 @@
+"""Find all the files that make up a document, following \\input, \\include & \\subfile"""
+
+
+import io
+import os
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from cmspubstyle.rules.classes import Text
+
+
+# \input{file}, \include{file}, \subfile{file}, or \input file
+INCLUDE_RE = re.compile(r"\\(?:input|include|subfile)(?![A-Za-z])"
+                        r"(?:\s*\{([^{}]+)\}|\s+([^\s{}%\\]+))")
+
+# \documentclass on a line that isn't commented out
+DOCUMENTCLASS_RE = re.compile(r"^[^%]*\\documentclass")
+
+
+def read_file(filename):
+    """Read a file's raw contents, returning (hash of contents, contents as bytes)"""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    return hashlib.sha1(data).hexdigest(), data
+
+
+def decode_lines(data):
+    """Split raw file contents into lines, decoding them the same way as open() would"""
+    return io.TextIOWrapper(io.BytesIO(data)).readlines()
+
+
+class FileStore(object):
+    """Contents of files, each read from disk exactly once, and shared by all checks.
+
+    Reads are started in a pool of threads by prefetch(), so several files
+    can be read at once, and get() waits for them.
+    Each file is only made into a Text once, by get_text().
+    """
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # filename -> Future of (hash, data)
+        self._reads = {}
+        # filename -> Text
+        self._texts = {}
+
+    def prefetch(self, filename):
+        """Start reading a file in the background, if not already done"""
+        if filename not in self._reads:
+            self._reads[filename] = self._executor.submit(read_file, filename)
+
+    def get(self, filename):
+        """Get (hash of contents, contents as bytes) of a file.
+
+        Raises IOError if the file can't be read.
+        """
+        self.prefetch(filename)
+        return self._reads[filename].result()
+
+    def get_text(self, filename):
+        """Get the contents of a file as a Text"""
+        if filename not in self._texts:
+            self._texts[filename] = Text(decode_lines(self.get(filename)[1]))
+        return self._texts[filename]
+
+    def shutdown(self):
+        """Stop the pool of threads"""
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+def find_includes(text):
+    """Get list of names of files included by a Text, in order.
+
+    Includes inside comments are ignored.
+    """
+    names = []
+    for match in INCLUDE_RE.finditer(text.text_as_one_line):
+        if text.comments.contains(match.start()):
+            continue
+        names.append((match.group(1) or match.group(2)).strip())
+    return names
+
+
+def include_filename(name, tex_file):
+    """Convert name in an \\input etc to a filename, relative to the main TeX file like LaTeX does"""
+    if not name.endswith(".tex"):
+        name += ".tex"
+    return os.path.normpath(os.path.join(os.path.dirname(tex_file), name))
+
+
+def resolve_includes(tex_file, file_store, circular=None, includes=None):
+    """Get list of all files that make up the document in tex_file, including itself.
+
+    Follows \\input, \\include & \\subfile recursively. Each file is only listed
+    once, the first time it is included. Files that include themselves
+    (directly or not) are not followed again, and if circular is a list,
+    (filename, including filename) is added to it for each of those.
+    If includes is a dict, {filename: names from find_includes()} is added
+    to it for each file read.
+    Files that can't be read are listed, but not followed, so the error
+    comes when they are checked.
+    """
+    filenames = []
+    seen = set()
+
+    def visit(filename, parents):
+        key = os.path.normpath(filename)
+        if key in parents:
+            if circular is not None:
+                circular.append((filename, parents[-1]))
+            return
+        if key in seen:
+            return
+        seen.add(key)
+        filenames.append(filename)
+        try:
+            text = file_store.get_text(filename)
+        except (IOError, OSError):
+            return
+        names = find_includes(text)
+        if includes is not None:
+            includes[filename] = names
+        children = [include_filename(name, tex_file) for name in names]
+        # start reading all of them now, while we work through them in order
+        for child in children:
+            file_store.prefetch(child)
+        for child in children:
+            visit(child, parents + [key])
+
+    visit(tex_file, [])
+    return filenames
+
+
+def is_main_file(filename):
+    """Check if a TeX file is the main file of a document, i.e. has a \\documentclass"""
+    with open(filename, 'rb') as f:
+        for line in f:
+            if DOCUMENTCLASS_RE.match(line.decode('utf-8', 'replace')):
+                return True
+    return False
+
+
+def find_documents(paths):
+    """Get list of main TeX files from a list of TeX files and/or directories.
+
+    Directories are searched recursively for .tex files with a \\documentclass.
+    """
+    documents = []
+    for path in paths:
+        if not os.path.isdir(path):
+            documents.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filename = os.path.join(dirpath, filename)
+                if filename.endswith(".tex") and is_main_file(filename):
+                    documents.append(filename)
+    return documents
@@ -0,0 +1,263 @@
+"""Re-check a document block by block, so that after an edit only the changed parts are checked.
+
+The document is split into blocks of paragraphs (runs of lines ending in blank lines).
+Blocks only end where every brace, environment & maths started in the document
+so far is closed, so commands & environments are not split between blocks,
+and each block can be checked on its own. The document environment is ignored,
+and something left open only keeps a block going for MAX_OPEN_LINES lines,
+so a missing } doesn't make the rest of the document one block. Each block is checked along with
+the blocks either side, so problems that cross from one block into the next are
+still found. The problems starting in each block are kept, keyed by the contents
+of the block & its neighbours, so editing a block only means re-checking it &
+its neighbours. Problems in the other blocks just have their line numbers moved.
+"""
+
+
+import re
+import bisect
+import hashlib
+
+from cmspubstyle.rules.classes import Text, TextLine, RuleBroken, SavedMatch
+
+
+# things that open or close braces, environments (with their names) & maths,
+# escaped characters, and comments
+STRUCTURE_RE = re.compile(r"\\(begin|end)\s*\{([^{}\n]*)\}|\\[()\[\]]|\\.|%[^\n]*|[{}$]")
+
+# environments that don't stop a block ending, as they go around (nearly) everything
+IGNORED_ENVIRONMENTS = ("document",)
+
+# most lines a block can be kept going for by something that isn't closed
+MAX_OPEN_LINES = 100
+
+
+def structure_change(contents):
+    """Get how much a paragraph opens (+ve) or closes (-ve) braces, environments & maths.
+
+    Returns tuple of (change in brace depth, change in environment depth,
+    change in \\( \\[ maths depth, # of $ mod 2)
+    """
+    braces, environments, maths, dollars = 0, 0, 0, 0
+    for match in STRUCTURE_RE.finditer(contents):
+        token = match.group(0)
+        if match.group(1) is not None:
+            if match.group(2).strip() not in IGNORED_ENVIRONMENTS:
+                environments += 1 if match.group(1) == "begin" else -1
+        elif token == "{":
+            braces += 1
+        elif token == "}":
+            braces -= 1
+        elif token == "$":
+            dollars ^= 1
+        elif token in ("\\(", "\\["):
+            maths += 1
+        elif token in ("\\)", "\\]"):
+            maths -= 1
+    return braces, environments, maths, dollars
+
+
+def iter_paragraphs(lines):
+    """Iterate over (index of first line, index of last line + 1) of paragraphs in lines.
+
+    Each paragraph is a run of lines followed by any blank lines after it.
+    """
+    start = 0
+    last_blank = True
+    for ind, line in enumerate(lines):
+        blank = line.strip() == ""
+        if last_blank and not blank and ind > start:
+            yield start, ind
+            start = ind
+        last_blank = blank
+    if start < len(lines):
+        yield start, len(lines)
+
+
+def shift_problem(broken_rule, shift):
+    """Make copy of a RuleBroken with line numbers moved by shift"""
+    if shift == 0:
+        return broken_rule
+    return RuleBroken(broken_rule.rule, broken_rule.match,
+                      [TextLine(line.line_num + shift, line.char_num_start, line.text)
+                       for line in broken_rule.lines])
+
+
+class Block(object):
+    """Some lines of a document that can be checked on their own"""
+
+    __slots__ = ["start", "end", "hash"]
+
+    def __init__(self, start, end, block_hash):
+        # index of first line, and last line + 1
+        self.start = start
+        self.end = end
+        self.hash = block_hash
+
+
+class IncrementalChecker(object):
+    """Check versions of a document, only re-checking the blocks that change.
+
+    Texts are checked with checks.check_text(), and checks.num_timeouts()
+    says whether any rules timed out. checks defaults to the pubcheck module,
+    pubcheck.py passes itself in case it is being run as a script.
+    num_blocks & num_checked are the number of blocks in the document, and how
+    many were checked, in the last call to check().
+    """
+
+    def __init__(self, do_comments=False, checks=None):
+        self.do_comments = do_comments
+        if checks is None:
+            # import here to avoid a circular import
+            from cmspubstyle import pubcheck as checks
+        self.checks = checks
+        # paragraph hash -> structure_change() of it
+        self._structure = {}
+        # (previous block hash, block hash, next block hash) -> list of RuleBroken,
+        # with line numbers counted from the start of the block
+        self._problems = {}
+        # (id of list of problems in a block, start of block) -> (the list, the problems
+        # with line numbers in the document), so blocks that haven't moved aren't shifted again
+        self._shifted = {}
+        self.num_blocks = 0
+        self.num_checked = 0
+
+    def split_blocks(self, lines):
+        """Split lines into list of Blocks"""
+        blocks = []
+        start, block_hash = 0, hashlib.sha1()
+        # how much is still open, at the end of each paragraph
+        braces, environments, maths, dollars = 0, 0, 0, 0
+        for para_start, para_end in iter_paragraphs(lines):
+            contents = ''.join(lines[para_start:para_end])
+            para_hash = hashlib.sha1(contents.encode('utf-8')).hexdigest()
+            if para_hash not in self._structure:
+                self._structure[para_hash] = structure_change(contents)
+            change = self._structure[para_hash]
+            # anything closed that wasn't open is ignored, like RegionTree does
+            braces = max(braces + change[0], 0)
+            environments = max(environments + change[1], 0)
+            maths = max(maths + change[2], 0)
+            dollars ^= change[3]
+            block_hash.update(para_hash.encode('utf-8'))
+            if (braces == environments == maths == dollars == 0
+                    or para_end - start >= MAX_OPEN_LINES):
+                blocks.append(Block(start, para_end, block_hash.hexdigest()))
+                start, block_hash = para_end, hashlib.sha1()
+                # forget anything left open, so the next block can end
+                braces, environments, maths, dollars = 0, 0, 0, 0
+        if start < len(lines):
+            blocks.append(Block(start, len(lines), block_hash.hexdigest()))
+        return blocks
+
+    def _check_lines(self, lines, start, end, blocks):
+        """Check lines[start:end], splitting the problems between blocks.
+
+        Returns (list of lists of RuleBroken starting in each block, with line numbers
+        counted from the start of the block, whether they were checked completely)
+        """
+        text = Text(lines[start:end], line_num_start=start + 1)
+        timeouts_before = self.checks.num_timeouts()
+        problems = [[] for _ in blocks]
+        block_starts = [block.start for block in blocks]
+        for broken_rule in self.checks.check_text(text, self.do_comments):
+            line_ind = broken_rule.lines[0].line_num - 1
+            ind = bisect.bisect_right(block_starts, line_ind) - 1
+            if ind < 0 or line_ind >= blocks[ind].end:
+                continue
+            # don't keep the whole text alive via the match
+            problems[ind].append(RuleBroken(
+                rule=broken_rule.rule,
+                match=SavedMatch.from_match(broken_rule.match),
+                lines=[TextLine(line.line_num - blocks[ind].start, line.char_num_start, line.text)
+                       for line in broken_rule.lines]))
+        return problems, self.checks.num_timeouts() == timeouts_before
+
+    def check_blocks(self, lines):
+        """Check a document, returning list of (Block, list of RuleBroken starting in it).
+
+        The RuleBroken have line numbers counted from the start of the block,
+        and the same list is returned for a block as last time if it wasn't checked again,
+        so callers can keep anything they work out from it. See check().
+        """
+        blocks = self.split_blocks(lines)
+        keys = [(blocks[ind-1].hash if ind > 0 else None, block.hash,
+                 blocks[ind+1].hash if ind + 1 < len(blocks) else None)
+                for ind, block in enumerate(blocks)]
+        to_check = [ind for ind, key in enumerate(keys) if key not in self._problems]
+        new_problems = {}
+        if len(to_check) * 2 > len(blocks):
+            # quicker to check everything in one go
+            block_problems, complete = self._check_lines(lines, 0, len(lines), blocks)
+            new_problems = {ind: (block_problems[ind], complete) for ind in to_check}
+        else:
+            for ind in to_check:
+                # check along with the neighbours, but only keep problems in this block
+                start = blocks[ind-1].start if ind > 0 else blocks[ind].start
+                end = blocks[ind+1].end if ind + 1 < len(blocks) else blocks[ind].end
+                block_problems, complete = self._check_lines(lines, start, end, [blocks[ind]])
+                new_problems[ind] = (block_problems[0], complete)
+
+        problems = {}
+        results = []
+        for ind, block in enumerate(blocks):
+            if ind in new_problems:
+                block_problems, complete = new_problems[ind]
+                # incomplete results shouldn't be reused
+                if complete:
+                    problems[keys[ind]] = block_problems
+            else:
+                block_problems = problems[keys[ind]] = self._problems[keys[ind]]
+            results.append((block, block_problems))
+        # forget blocks that are no longer in the document
+        self._problems = problems
+        self.num_blocks = len(blocks)
+        self.num_checked = len(to_check)
+        return results
+
+    def check(self, lines):
+        """Check a document, returning list of RuleBroken in order of line number.
+
+        lines is a list of the lines of the document, as read from a file.
+        Only blocks that have changed since the last check, and their neighbours,
+        are checked again.
+        """
+        all_problems = []
+        shifted = {}
+        for block, block_problems in self.check_blocks(lines):
+            key = (id(block_problems), block.start)
+            if key in self._shifted:
+                problems = self._shifted[key][1]
+            else:
+                problems = [shift_problem(p, block.start) for p in block_problems]
+            # keep the list of problems, so its id isn't reused
+            shifted[key] = (block_problems, problems)
+            all_problems.extend(problems)
+        self._shifted = shifted
+        return all_problems
+
+    def check_lines(self, lines, line_nums):
+        """Check only the blocks of a document containing some lines.
+
+        line_nums are the (1-based) numbers of the lines to check. Each block
+        containing any of them is checked along with its neighbours, as in check(),
+        and list of RuleBroken starting in those blocks is returned in order of
+        line number. Nothing is kept for later checks.
+        """
+        blocks = self.split_blocks(lines)
+        block_starts = [block.start for block in blocks]
+        to_check = sorted(set(bisect.bisect_right(block_starts, line_num - 1) - 1
+                              for line_num in line_nums if 1 <= line_num <= len(lines)))
+        all_problems = []
+        self.num_blocks = len(blocks)
+        self.num_checked = len(to_check)
+        while to_check:
+            # check each run of neighbouring blocks together
+            first = last = to_check.pop(0)
+            while to_check and to_check[0] == last + 1:
+                last = to_check.pop(0)
+            start = blocks[first-1].start if first > 0 else blocks[first].start
+            end = blocks[last+1].end if last + 1 < len(blocks) else blocks[last].end
+            block_problems, _ = self._check_lines(lines, start, end, blocks[first:last+1])
+            for block, problems in zip(blocks[first:last+1], block_problems):
+                all_problems.extend(shift_problem(p, block.start) for p in problems)
+        return all_problems
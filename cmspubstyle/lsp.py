@@ -0,0 +1,320 @@
+"""Language server, so editors can show problems as the paper is typed.
+
+Speaks the Language Server Protocol (JSON-RPC with Content-Length headers)
+over a pair of binary streams, normally stdin & stdout via pubcheck.py --lsp.
+Each open document is kept as a list of lines, and edits are applied to it
+as they come in. The document is checked with an IncrementalChecker after each
+change, so only the paragraphs around the edit are checked again, and the
+problems are published as diagnostics.
+"""
+
+
+import re
+import json
+
+from cmspubstyle import pubcheck
+from cmspubstyle.incremental import IncrementalChecker
+from cmspubstyle.rules.watchdog import Watchdog
+
+
+# splits text into lines, keeping the line endings
+LINE_RE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+")
+
+# LSP constants
+SYNC_INCREMENTAL = 2
+SEVERITY_WARNING = 2
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+MESSAGE_ERROR = 1
+
+
+def read_message(in_stream):
+    """Read one JSON-RPC message from binary stream in_stream.
+
+    Returns None at the end of the stream.
+    Raises ValueError if the headers or the message can't be read.
+    """
+    length = None
+    while True:
+        header = in_stream.readline()
+        if not header:
+            return None
+        header = header.decode('ascii').strip()
+        if not header:
+            if length is None:
+                # no Content-Length, skip to the next headers
+                continue
+            break
+        name, _, value = header.partition(":")
+        if name.strip().lower() == "content-length":
+            try:
+                length = int(value)
+            except ValueError:
+                length = -1
+            if length < 0:
+                raise ValueError("Bad Content-Length: " + value.strip())
+    return json.loads(in_stream.read(length).decode('utf-8'))
+
+
+def write_message(out_stream, message):
+    """Write one JSON-RPC message (a dict) to binary stream out_stream"""
+    body = json.dumps(message).encode('utf-8')
+    out_stream.write(("Content-Length: %d\r\n\r\n" % len(body)).encode('ascii'))
+    out_stream.write(body)
+    out_stream.flush()
+
+
+def split_lines(text):
+    """Split str into list of lines, keeping line endings"""
+    return LINE_RE.findall(text)
+
+
+def utf16_length(text):
+    """Get length of str in UTF-16 code units, which LSP counts positions in"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def from_utf16(line, units):
+    """Get index in str line of a position given in UTF-16 code units"""
+    count = 0
+    for ind, char in enumerate(line):
+        if count >= units:
+            return ind
+        count += 2 if ord(char) > 0xFFFF else 1
+    return len(line)
+
+
+def apply_change(lines, change):
+    """Apply one content change from a didChange notification to list of lines, in place"""
+    if 'range' not in change:
+        lines[:] = split_lines(change['text'])
+        return
+    start, end = change['range']['start'], change['range']['end']
+    start_line = min(start['line'], len(lines))
+    end_line = min(end['line'], len(lines))
+    start_text = lines[start_line] if start_line < len(lines) else ""
+    end_text = lines[end_line] if end_line < len(lines) else ""
+    # don't split a line ending
+    start_char = min(from_utf16(start_text, start['character']), len(start_text.rstrip('\r\n')))
+    end_char = min(from_utf16(end_text, end['character']), len(end_text.rstrip('\r\n')))
+    new_text = start_text[:start_char] + change['text'] + end_text[end_char:]
+    lines[start_line:end_line + 1] = split_lines(new_text)
+
+
+def find_in_line(line, fragment, approx_column):
+    """Find fragment of checked text in a line as written, nearest to approx_column.
+
+    Multiple spaces are collapsed in the checked text, so fragment can match
+    runs of spaces. Returns (start, end) index in line, or None if not found.
+    """
+    pattern = " +".join(re.escape(piece) for piece in fragment.split(" "))
+    best = None
+    for match in re.finditer(pattern, line):
+        if best is None or abs(match.start() - approx_column) < abs(best.start() - approx_column):
+            best = match
+    return None if best is None else best.span()
+
+
+def make_range(broken_rule, lines):
+    """Make LSP Range for a RuleBroken in document lines"""
+    match, problem_lines = broken_rule.match, broken_rule.lines
+    first, last = problem_lines[0], problem_lines[-1]
+    first_ind = min(first.line_num - 1, len(lines) - 1)
+    last_ind = min(last.line_num - 1, len(lines) - 1)
+    first_line = lines[first_ind].rstrip('\r\n')
+    last_line = lines[last_ind].rstrip('\r\n')
+
+    # position of match in each line as checked, which can differ from the line as written
+    start_offset = match.start() - first.char_num_start + 1
+    end_offset = match.end() - last.char_num_start + 1
+    start = min(max(start_offset, 0), len(first_line))
+    end = min(max(end_offset, 0), len(last_line))
+    # checked lines get a space added at the end, which isn't in the line as written
+    start_fragment = match.group(0)[:len(first.text) - start_offset].rstrip(" ")
+    if start_fragment:
+        span = find_in_line(first_line, start_fragment, start)
+        if span is not None:
+            start = span[0]
+            if first_ind == last_ind:
+                end = span[1]
+    if first_ind != last_ind:
+        end_fragment = match.group(0)[max(len(match.group(0)) - end_offset, 0):].lstrip(" ")
+        span = find_in_line(last_line, end_fragment, end - len(end_fragment)) \
+            if end_fragment else None
+        if span is not None:
+            end = span[1]
+
+    return {
+        'start': {'line': first_ind, 'character': utf16_length(first_line[:start])},
+        'end': {'line': last_ind, 'character': utf16_length(last_line[:end])},
+    }
+
+
+def shift_diagnostic(diagnostic, shift):
+    """Make copy of a Diagnostic with line numbers moved by shift"""
+    if shift == 0:
+        return diagnostic
+    start, end = diagnostic['range']['start'], diagnostic['range']['end']
+    return dict(diagnostic, range={
+        'start': {'line': start['line'] + shift, 'character': start['character']},
+        'end': {'line': end['line'] + shift, 'character': end['character']},
+    })
+
+
+def make_diagnostic(broken_rule, lines):
+    """Make LSP Diagnostic for a RuleBroken in document lines"""
+    return {
+        'range': make_range(broken_rule, lines),
+        'severity': SEVERITY_WARNING,
+        'code': "R%d" % pubcheck.RULE_INDEX[broken_rule.rule],
+        'source': "cmspubstyle",
+        'message': broken_rule.rule.description,
+    }
+
+
+class Document(object):
+    """Text document open in the editor, and the checker that keeps its results"""
+
+    def __init__(self, text, version, do_comments=False):
+        self.lines = split_lines(text)
+        self.version = version
+        self.checker = IncrementalChecker(do_comments)
+        # id of list of problems in a block -> (the list, Diagnostics for it, with
+        # line numbers counted from the start of the block)
+        self._diagnostics = {}
+
+    def get_diagnostics(self):
+        """Check the document, returning list of Diagnostics"""
+        diagnostics = []
+        block_diagnostics = {}
+        for block, problems in self.checker.check_blocks(self.lines):
+            # problems in blocks that weren't checked again are the same list as before
+            if id(problems) in self._diagnostics:
+                _, relative = self._diagnostics[id(problems)]
+            else:
+                block_lines = self.lines[block.start:block.end]
+                relative = [make_diagnostic(p, block_lines) for p in problems]
+            block_diagnostics[id(problems)] = (problems, relative)
+            diagnostics.extend(shift_diagnostic(d, block.start) for d in relative)
+        self._diagnostics = block_diagnostics
+        return diagnostics
+
+
+class LanguageServer(object):
+    """Handle LSP messages, writing responses & diagnostics to binary stream out_stream"""
+
+    def __init__(self, out_stream, do_comments=False):
+        self.out_stream = out_stream
+        self.do_comments = do_comments
+        # uri -> Document
+        self.documents = {}
+        self.shutdown_requested = False
+        self.exited = False
+
+    def send(self, message):
+        message['jsonrpc'] = "2.0"
+        write_message(self.out_stream, message)
+
+    def publish(self, uri):
+        """Check a document, and send its diagnostics"""
+        document = self.documents[uri]
+        pubcheck.set_current_file(uri)
+        params = {'uri': uri, 'diagnostics': document.get_diagnostics()}
+        if pubcheck.RULE_SET.watchdog is not None:
+            # rules that time out are only skipped for that check, so don't keep them
+            del pubcheck.RULE_SET.watchdog.timeouts[:]
+        if document.version is not None:
+            params['version'] = document.version
+        self.send({'method': "textDocument/publishDiagnostics", 'params': params})
+
+    def handle(self, message):
+        """Handle one message from the client"""
+        method = message.get('method')
+        params = message.get('params') or {}
+        is_request = 'id' in message
+        if method is None:
+            # response to something we never send
+            return
+
+        if method == "initialize":
+            result = {
+                'capabilities': {
+                    'textDocumentSync': {'openClose': True, 'change': SYNC_INCREMENTAL},
+                },
+                'serverInfo': {'name': "cmspubstyle"},
+            }
+        elif method == "shutdown":
+            self.shutdown_requested = True
+            result = None
+        elif method == "exit":
+            self.exited = True
+            return
+        elif method == "textDocument/didOpen":
+            doc = params['textDocument']
+            self.documents[doc['uri']] = Document(doc['text'], doc.get('version'),
+                                                  self.do_comments)
+            self.publish(doc['uri'])
+            return
+        elif method == "textDocument/didChange":
+            doc = params['textDocument']
+            document = self.documents.get(doc['uri'])
+            if document is None:
+                return
+            for change in params['contentChanges']:
+                apply_change(document.lines, change)
+            document.version = doc.get('version')
+            self.publish(doc['uri'])
+            return
+        elif method == "textDocument/didClose":
+            uri = params['textDocument']['uri']
+            self.documents.pop(uri, None)
+            self.send({'method': "textDocument/publishDiagnostics",
+                       'params': {'uri': uri, 'diagnostics': []}})
+            return
+        elif not is_request:
+            # e.g. initialized, $/cancelRequest, didSave: nothing to do
+            return
+        else:
+            self.send({'id': message['id'],
+                       'error': {'code': METHOD_NOT_FOUND, 'message': "Unknown method " + method}})
+            return
+
+        if is_request:
+            self.send({'id': message['id'], 'result': result})
+
+
+def serve(in_stream, out_stream, do_comments=False, rule_timeout=10):
+    """Run a language server on binary streams until the client exits.
+
+    Each rule can spend at most rule_timeout seconds on each check (0 for no limit).
+    A message that can't be read or handled gets an error response (or is logged
+    to the client if it isn't a request), and the server carries on.
+    Returns the exit code: 0 if the client asked to shut down first, otherwise 1.
+    """
+    pubcheck.RULE_SET.watchdog = Watchdog(rule_timeout) if rule_timeout > 0 else None
+    server = LanguageServer(out_stream, do_comments)
+    while not server.exited:
+        try:
+            message = read_message(in_stream)
+        except ValueError as err:
+            server.send({'id': None, 'error': {'code': PARSE_ERROR, 'message': str(err)}})
+            continue
+        if message is None:
+            break
+        if not isinstance(message, dict):
+            server.send({'id': None,
+                         'error': {'code': INVALID_REQUEST, 'message': "Batches not supported"}})
+            continue
+        try:
+            server.handle(message)
+        except Exception as err:
+            text = "Error handling %s: %s: %s" % (message.get('method'), type(err).__name__, err)
+            if 'id' in message:
+                server.send({'id': message['id'],
+                             'error': {'code': INTERNAL_ERROR, 'message': text}})
+            else:
+                server.send({'method': "window/logMessage",
+                             'params': {'type': MESSAGE_ERROR, 'message': text}})
+    return 0 if server.shutdown_requested else 1
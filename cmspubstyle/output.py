@@ -0,0 +1,138 @@
+"""Write problems in machine-readable formats (NDJSON, SARIF), as they are found.
+
+Records are written out one at a time, so the whole set of results is never
+held in one structure. Columns are 1-based positions in each line as checked,
+i.e. after multiple spaces are collapsed. They always count from the start of
+the line, including for matches inside commands, environments or maths,
+and in the title & abstract.
+"""
+
+
+import json
+from collections import OrderedDict
+
+from cmspubstyle import __version__
+
+
+FORMATS = ["text", "ndjson", "sarif"]
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+def make_record(filename, broken_rule, rule_index, part=None):
+    """Make OrderedDict describing one RuleBroken in filename (and part, e.g. TITLE, if given)"""
+    match, lines = broken_rule.match, broken_rule.lines
+    record = OrderedDict()
+    record['file'] = filename
+    if part is not None:
+        record['part'] = part
+    record['line_start'] = lines[0].line_num
+    record['line_end'] = lines[-1].line_num
+    record['column_start'] = match.start() - lines[0].char_num_start + 2
+    # inclusive, like line_end
+    record['column_end'] = match.end() - lines[-1].char_num_start + 1
+    record['rule'] = broken_rule.rule.description
+    record['rule_index'] = rule_index
+    record['match'] = match.group(0)
+    return record
+
+
+class ResultsWriter(object):
+    """Base class to write out RuleBroken to out (a file-like object) one at a time.
+
+    rules is the list of all Rules, so they can be referred to by index.
+    Call close() once all problems are written, which doesn't close out.
+    """
+
+    def __init__(self, out, rules):
+        self.out = out
+        self.rules = rules
+        self._rule_index = {rule: ind for ind, rule in enumerate(rules)}
+        self.num_written = 0
+
+    def write(self, filename, broken_rule, part=None):
+        """Write one RuleBroken, found in filename (and part, e.g. TITLE, if given)"""
+        record = make_record(filename, broken_rule, self._rule_index[broken_rule.rule], part)
+        self.write_record(record)
+        self.num_written += 1
+
+    def write_problems(self, filename, problems, part=None):
+        """Write list of RuleBroken for filename, see write()"""
+        for broken_rule in problems:
+            self.write(filename, broken_rule, part)
+        self.out.flush()
+
+    def write_record(self, record):
+        raise NotImplementedError()
+
+    def close(self):
+        self.out.flush()
+
+
+class NdjsonWriter(ResultsWriter):
+    """Write one JSON object per line for each problem, see make_record()"""
+
+    def write_record(self, record):
+        self.out.write(json.dumps(record) + "\n")
+
+
+class SarifWriter(ResultsWriter):
+    """Write a SARIF 2.1.0 log, with one run that has all the problems as results.
+
+    The results array is written out as it goes, and finished off by close().
+    """
+
+    def __init__(self, out, rules):
+        super(SarifWriter, self).__init__(out, rules)
+        driver = OrderedDict([
+            ('name', 'cmspubstyle'),
+            ('version', __version__),
+            ('informationUri', 'https://github.com/raggleton/cmspubstyle'),
+            ('rules', [OrderedDict([('id', self.rule_id(ind)),
+                                    ('shortDescription', {'text': rule.description})])
+                       for ind, rule in enumerate(rules)]),
+        ])
+        header = json.dumps(OrderedDict([('version', '2.1.0'), ('$schema', SARIF_SCHEMA)]))
+        # leave the log open, to add results to
+        self.out.write(header[:-1] + ', "runs": [{"tool": {"driver": ' + json.dumps(driver) +
+                       '}, "results": [\n')
+
+    @staticmethod
+    def rule_id(rule_index):
+        """Make SARIF id for a rule from its index"""
+        return "R%d" % rule_index
+
+    def write_record(self, record):
+        region = OrderedDict([
+            ('startLine', record['line_start']),
+            ('startColumn', record['column_start']),
+            ('endLine', record['line_end']),
+            # SARIF end columns are exclusive
+            ('endColumn', record['column_end'] + 1),
+            ('snippet', {'text': record['match']}),
+        ])
+        location = {'physicalLocation': OrderedDict([
+            ('artifactLocation', {'uri': record['file'].replace("\\", "/")}),
+            ('region', region),
+        ])}
+        result = OrderedDict([
+            ('ruleId', self.rule_id(record['rule_index'])),
+            ('ruleIndex', record['rule_index']),
+            ('level', 'warning'),
+            ('message', {'text': record['rule']}),
+            ('locations', [location]),
+        ])
+        if 'part' in record:
+            result['properties'] = {'part': record['part']}
+        separator = ",\n" if self.num_written else ""
+        self.out.write(separator + json.dumps(result))
+
+    def close(self):
+        self.out.write("\n]}]}\n")
+        super(SarifWriter, self).close()
+
+
+WRITERS = {
+    'ndjson': NdjsonWriter,
+    'sarif': SarifWriter,
+}
@@ -0,0 +1,120 @@
+"""Record how long each rule takes to check each file, for --profile"""
+
+
+from __future__ import print_function
+import json
+import time
+from collections import OrderedDict
+
+
+timer = getattr(time, "perf_counter", time.time)
+
+# name used for the combined first-character scan for ALL() rules,
+# which can't be split between rules
+COMBINED_SCAN = "(combined scan for ALL() rules)"
+
+
+class Profile(object):
+    """Wall time, number of regex calls & number of matches for each rule, for each file.
+
+    rules is the list of all Rules, so they can be referred to by index
+    e.g. when passing results between processes. The current file is set
+    by assigning to filename.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._rule_index = {rule: ind for ind, rule in enumerate(rules)}
+        self.filename = None
+        # (rule index, filename) -> [time, # regex calls, # matches]
+        # with rule index None for the combined scan
+        self.stats = OrderedDict()
+
+    def add(self, rule, duration, calls=1, matches=0):
+        """Add time for regex calls for a rule (None for the combined scan) in the current file"""
+        key = (self._rule_index.get(rule), self.filename)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = [0., 0, 0]
+        stats[0] += duration
+        stats[1] += calls
+        stats[2] += matches
+
+    def iter_timed(self, rule, iterator):
+        """Iterate over iterator (e.g. of regex matches), adding the time for each item to rule"""
+        while True:
+            start = timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(rule, timer() - start)
+                return
+            self.add(rule, timer() - start, matches=1)
+            yield item
+
+    def to_list(self):
+        """Convert stats to a JSON-friendly list"""
+        return [[rule_ind, filename] + stats for (rule_ind, filename), stats in self.stats.items()]
+
+    def update(self, stats_list):
+        """Add stats from the output of to_list() of another Profile"""
+        for rule_ind, filename, duration, calls, matches in stats_list:
+            stats = self.stats.setdefault((rule_ind, filename), [0., 0, 0])
+            stats[0] += duration
+            stats[1] += calls
+            stats[2] += matches
+
+    def rule_name(self, rule_ind):
+        """Get human readable name of a rule from its index"""
+        if rule_ind is None:
+            return COMBINED_SCAN
+        return self.rules[rule_ind].description
+
+    def totals(self, by_file=False):
+        """Get list of (rule index or filename, [time, # regex calls, # matches]),
+        summed over all files or all rules, most expensive first"""
+        totals = OrderedDict()
+        for (rule_ind, filename), stats in self.stats.items():
+            this_total = totals.setdefault(filename if by_file else rule_ind, [0., 0, 0])
+            for ind, value in enumerate(stats):
+                this_total[ind] += value
+        return sorted(totals.items(), key=lambda x: x[1][0], reverse=True)
+
+    def print_table(self, max_rules=25, out=None):
+        """Print the most expensive rules, and the time per file"""
+        separator = "-" * 80
+        print(separator, file=out)
+        print("PROFILE (by rule, most expensive first)", file=out)
+        print(separator, file=out)
+        row = "{0:>4} {1:<38.38} {2:<14.14} {3:>8} {4:>7} {5:>6}"
+        print(row.format("#", "rule", "pattern", "time [s]", "calls", "matches"), file=out)
+        rule_totals = self.totals()
+        for rule_ind, (duration, calls, matches) in rule_totals[:max_rules]:
+            pattern = "" if rule_ind is None else self.rules[rule_ind].re_pattern.pattern
+            print(row.format("" if rule_ind is None else rule_ind, self.rule_name(rule_ind),
+                             pattern, "%.4f" % duration, calls, matches), file=out)
+        if len(rule_totals) > max_rules:
+            print("... and", len(rule_totals) - max_rules, "more", file=out)
+        print(separator, file=out)
+        print("PROFILE (by file)", file=out)
+        print(separator, file=out)
+        for filename, (duration, calls, matches) in self.totals(by_file=True):
+            print("{0:<50} {1:>8.4f} {2:>9} {3:>7}".format(filename, duration, calls, matches),
+                  file=out)
+        print(separator, file=out)
+
+    def save(self, filename):
+        """Save all stats to a JSON file"""
+        entries = []
+        for (rule_ind, this_filename), (duration, calls, matches) in self.stats.items():
+            entries.append(OrderedDict([
+                ('rule', self.rule_name(rule_ind)),
+                ('rule_index', rule_ind),
+                ('file', this_filename),
+                ('time', duration),
+                ('calls', calls),
+                ('matches', matches),
+            ]))
+        entries.sort(key=lambda x: x['time'], reverse=True)
+        with open(filename, 'w') as f:
+            json.dump(entries, f, indent=2)
@@ -15,17 +15,45 @@ from __future__ import print_function
 import os
 import re
 import sys
+import time
 import json
+import heapq
 import argparse
+from operator import itemgetter
+from io import StringIO
+from contextlib import redirect_stdout
 from collections import OrderedDict, defaultdict
 
-from cmspubstyle.rules import normal_text
-from cmspubstyle.rules import latex
-from cmspubstyle.rules.classes import Location, ALL, ENVIRONMENT, INLINE, COMMAND
-from cmspubstyle.rules.classes import Text, RuleBroken
+from cmspubstyle import __version__
+from cmspubstyle.rules.classes import Location, ALL
+from cmspubstyle.rules.classes import Text, TextLine, RuleBroken, SavedMatch
+from cmspubstyle.rules.bundle import load_rule_set
+from cmspubstyle.includes import FileStore, resolve_includes, find_includes, find_documents
+from cmspubstyle.includes import read_file, decode_lines
+from cmspubstyle.streaming import iter_stdin_lines, iter_mmap_lines, iter_windows
+from cmspubstyle.profiling import Profile
+from cmspubstyle.rules.watchdog import Watchdog
+from cmspubstyle.output import FORMATS, WRITERS
+from cmspubstyle.incremental import IncrementalChecker
+from cmspubstyle.gitdiff import get_changed_lines
 
 
-ALL_RULES = normal_text.RULES + latex.RULES
+# Compiled version of all the rules, to check everything in one go,
+# loaded from a saved bundle if the rules haven't changed
+RULE_SET = load_rule_set()
+ALL_RULES = RULE_SET.rules
+# To refer to rules by index when passing results between processes
+RULE_INDEX = {rule: ind for ind, rule in enumerate(ALL_RULES)}
+
+# ResultsWriter for --format, if used
+RESULTS_WRITER = None
+
+# (part, command) for the parts of the main TeX file that are checked on their own
+ROOT_PARTS = [("ABSTRACT", "abstract"), ("TITLE", "title")]
+
+# Version of checker_cache.json format
+# (3: positions of problems in parts of a line are counted from the start of the line)
+CACHE_VERSION = 3
 
 
 class TERMCOL:
@@ -50,49 +78,173 @@ def create_arg_parser():
     parser = argparse.ArgumentParser(description=__doc__,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument("input",
+                        nargs="*",
                         help="Main paper/PAS/AN tex file. "
-                        "Will also check every file included with \\input.")
+                        "Will also check every file included with \\input. "
+                        "Use - to read from stdin, which implies --stream. "
+                        "If several files or a directory are given, they are checked in "
+                        "batch mode: every main file (with a \\documentclass) in a "
+                        "directory is found and checked, with a summary for them all.")
     parser.add_argument("--doComments",
                         action='store_true',
                         help="Include comment lines in checks")
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=1,
+                        help="Number of processes to use to check files "
+                        "(documents in batch mode) in parallel")
+    parser.add_argument("--watch",
+                        action='store_true',
+                        help="Keep running, and re-check files whenever they are saved")
+    parser.add_argument("--watchInterval",
+                        type=float,
+                        default=0.5,
+                        help="Time in seconds between checking files for changes in --watch mode")
+    parser.add_argument("--stream",
+                        action='store_true',
+                        help="Check one huge file (or stdin) a window of lines at a time, "
+                        "so it never has to all be in memory. Included files, the title "
+                        "& abstract are not checked, and nothing is cached")
+    parser.add_argument("--windowLines",
+                        type=int,
+                        default=2000,
+                        help="Number of lines in each window in --stream mode")
+    parser.add_argument("--windowOverlap",
+                        type=int,
+                        default=50,
+                        help="Number of extra lines either side of each window in --stream mode. "
+                        "Problems spanning more lines than this may be missed")
+    parser.add_argument("--ruleTimeout",
+                        type=float,
+                        default=10,
+                        help="Time in seconds each rule can take on each file, "
+                        "after which it is stopped for that file. 0 for no limit")
+    parser.add_argument("--profile",
+                        action='store_true',
+                        help="Print the time taken, number of regex calls & matches "
+                        "for each rule and file")
+    parser.add_argument("--profileJson",
+                        help="Also save the --profile results for each rule & file "
+                        "to this JSON file. Implies --profile")
+    parser.add_argument("--format",
+                        choices=FORMATS,
+                        default="text",
+                        help="Also write each problem in this machine-readable format: "
+                        "ndjson (one JSON object per line) or sarif. Unless --output is "
+                        "given, these go to stdout, and the normal text output to stderr")
+    parser.add_argument("--output",
+                        help="File to write --format results to, instead of stdout")
+    parser.add_argument("--lsp",
+                        action='store_true',
+                        help="Run as a language server on stdin & stdout, so editors can "
+                        "show problems as you type. No input file is needed")
+    parser.add_argument("--since",
+                        metavar="REV",
+                        help="Only check .tex files in the input's directory that have "
+                        "changed since git revision REV (e.g. origin/master), and only "
+                        "report problems on changed lines. Includes, the title & abstract "
+                        "checks and the cache aren't used")
     return parser
 
 
 def check_args(args):
     """Check all user arguments are sane, otherwise raise errors"""
-    if not args.input.endswith(".tex"):
+    if args.profileJson:
+        args.profile = True
+
+    if args.jobs < 1:
+        raise RuntimeError("--jobs must be at least 1")
+
+    if args.ruleTimeout < 0:
+        raise RuntimeError("--ruleTimeout must be at least 0")
+
+    if args.output and args.format == "text":
+        raise RuntimeError("--output needs a machine-readable --format")
+
+    if args.format != "text" and args.watch:
+        raise RuntimeError("Cannot use --format with --watch")
+
+    if args.lsp:
+        if args.input or args.watch or args.stream or args.since or args.format != "text":
+            raise RuntimeError("Cannot use input files, --watch, --stream, --since or --format "
+                               "with --lsp")
+        return
+
+    if not args.input:
+        raise RuntimeError("Need an input file (or --lsp)")
+
+    if args.since is not None:
+        if args.watch or args.stream or len(args.input) > 1 or args.input[0] == "-":
+            raise RuntimeError("--since needs one main TeX file or directory, "
+                               "and cannot use --watch, --stream or stdin")
+        args.batch = False
+        args.input = args.input[0]
+        if not os.path.isdir(args.input):
+            check_tex_file(args.input)
+        return
+
+    args.batch = len(args.input) > 1 or os.path.isdir(args.input[0])
+    if args.batch:
+        if args.watch or args.stream or "-" in args.input:
+            raise RuntimeError("Cannot use --watch, --stream or stdin with several files")
+        for filename in args.input:
+            if not os.path.isdir(filename):
+                check_tex_file(filename)
+        return
+
+    args.input = args.input[0]
+    if args.input == "-":
+        args.stream = True
+        if args.watch:
+            raise RuntimeError("Cannot use --watch with stdin")
+    else:
+        check_tex_file(args.input)
+
+    if args.stream and args.watch:
+        raise RuntimeError("Cannot use --stream with --watch")
+
+    if args.windowLines < 1 or args.windowOverlap < 0:
+        raise RuntimeError("--windowLines must be at least 1, and --windowOverlap at least 0")
+
+
+def check_tex_file(filename):
+    """Check an input file is an existing TeX file, otherwise raise errors"""
+    if not filename.endswith(".tex"):
         raise RuntimeError("Your input file must be a .tex")
 
-    if not os.path.isfile(args.input):
+    if not os.path.isfile(filename):
         raise IOError("Input file does not exist")
 
 
-def extract_input_files(tex_file):
-    """Return dict of included files in main tex file, split by category."""
+def extract_input_files(tex_file, file_store=None):
+    """Return dict of included files in main tex file, split by category.
+
+    Files are read into file_store if given, so they don't need reading again.
+    """
     files_dict = OrderedDict()
     # the main tex file with abstract, title
     files_dict['root'] = tex_file
     # included bibliography
     files_dict['bib'] = os.path.splitext(tex_file)[0] + ".bib"
 
-    # included files with main contents
-    files_dict['contents'] = [tex_file]
-    input_pattern = re.compile(r"\\input\s*{(.+)}")
-    with open(tex_file) as f:
-        for line in f:
-            if line.strip().startswith("%"):
-                continue
-            input_res = input_pattern.search(line)
-            if not input_res:
-                continue
-            filename = input_res.group(1) + ".tex"
-            filename = os.path.join(os.path.dirname(tex_file), filename)
-            files_dict['contents'].append(filename)
+    # included files with main contents, following \input etc all the way down
+    # also (filename, including filename) for any that are included in a loop,
+    # and the names each file includes
+    files_dict['circular'] = []
+    files_dict['includes'] = {}
+    if file_store is None:
+        with FileStore() as file_store:
+            files_dict['contents'] = resolve_includes(tex_file, file_store,
+                                                      files_dict['circular'],
+                                                      files_dict['includes'])
+    else:
+        files_dict['contents'] = resolve_includes(tex_file, file_store, files_dict['circular'],
+                                                  files_dict['includes'])
 
     return files_dict
 
 
-def report_error(broken_rule, color=TERMCOL.GREEN, padding=25):
+def report_error(broken_rule, color=TERMCOL.GREEN, padding=25, out=None):
     """Print broken rule message on screen, highlight violating part & rule"""
     # print(broken_rule)
 
@@ -116,100 +268,416 @@ def report_error(broken_rule, color=TERMCOL.GREEN, padding=25):
 
     print("  L" + line_num_str + ":", error_str,
           TERMCOL.PINK, "[", broken_rule.rule.description, "]",
-          TERMCOL.ENDC)
+          TERMCOL.ENDC, file=out)
+
+
+def get_locations(rule):
+    """Get list of Locations for a rule"""
+    where = rule.where
+    if isinstance(where, Location):
+        where = [rule.where]
+    return where
+
+
+def iter_all_location_problems(text, do_comments):
+    """Iterate over problems for ALL() rules, in order of line number.
+
+    Yields (sort key, RuleBroken), see check_text()
+    """
+    skip = None if do_comments else text.comments
+    this_line_num, this_line_problems = None, []
+    for rule, match in RULE_SET.iter_matches(text, skip):
+        lines = text.find_lines_with_char_num_range(match.start()+1, match.end())
+        line_num = lines[0].line_num
+        if line_num != this_line_num:
+            # matches come in order of position, so no more for the previous line
+            for problem in sorted(this_line_problems, key=itemgetter(0)):
+                yield problem
+            this_line_num, this_line_problems = line_num, []
+        rule_ind = RULE_INDEX[rule]
+        for loc_ind, location in enumerate(get_locations(rule)):
+            if isinstance(location, ALL):
+                sort_key = (line_num, rule_ind, loc_ind, match.start())
+                this_line_problems.append((sort_key, RuleBroken(rule=rule, match=match, lines=lines)))
+    for problem in sorted(this_line_problems, key=itemgetter(0)):
+        yield problem
 
 
-def check_text(text, do_comments):
-    """Method to check any piece of main text (not bib)"""
-    # locations = list(set([rule.where for rule in chain(normal_text.rules, latex.rules)]))
-    # for l in locations:
-    #     print(l)
+def move_problem(broken_rule, text, shift):
+    """Move a RuleBroken found in part of text (starting shift characters into it)
+    into text, so its columns count from the start of the line, not of the part"""
+    if not shift:
+        return broken_rule
+    match = broken_rule.match
+    match = SavedMatch(match.start() + shift, match.end() + shift, match.group(0))
+    lines = text.find_lines_with_char_num_range(match.start() + 1, match.end())
+    return RuleBroken(rule=broken_rule.rule, match=match, lines=lines)
+
+
+def iter_location_problems(text, rule, location, loc_ind, do_comments):
+    """Iterate over problems for one rule in one scoped location (e.g. INLINE()),
+    in order of line number.
+
+    Only the parts of text inside that location are searched, but matches & lines
+    are given in text, so columns count from the start of the line, not of the part.
+    Yields (sort key, RuleBroken), see check_text()
+    """
+    rule_ind = RULE_INDEX[rule]
+    counter = 0
+    for this_text in text.iter_location(location):
+        shift = this_text.offset - text.offset
+        skip = None if do_comments else this_text.comments
+        matches = this_text.find_iter(rule.re_pattern, skip)
+        if RULE_SET.profile is not None:
+            matches = RULE_SET.profile.iter_timed(rule, matches)
+        if RULE_SET.watchdog is not None:
+            matches = RULE_SET.watchdog.iter_calls(rule, matches)
+        for match, lines in matches:
+            broken_rule = move_problem(RuleBroken(rule=rule, match=match, lines=lines),
+                                       text, shift)
+            sort_key = (broken_rule.lines[0].line_num, rule_ind, loc_ind, counter)
+            counter += 1
+            yield sort_key, broken_rule
 
-    # for x in text.text_contents:
-    #     print(x)
-    # print(text.text_as_one_line)
 
+def check_text(text, do_comments):
+    """Method to check any piece of main text (not bib)
+
+    Yields RuleBroken in order of line number, as soon as no earlier line can
+    have any more problems. Problems on the same line are in the order of ALL_RULES.
+    If RULE_SET.watchdog is set, rules that take too long are stopped,
+    see RULE_SET.watchdog.timed_out afterwards.
+    """
+    # Each source of problems is ordered by line number, and yields
+    # (sort key, RuleBroken), where sort key is
+    # (line number, rule index, location index, order within that rule & location),
+    # so we can merge them
+
+    # do all ALL() rules in one pass over the text
+    sources = [iter_all_location_problems(text, do_comments)]
+
+    # rules for INLINE(), COMMAND(), ENVIRONMENT() only search inside those regions of the text
     for rule in ALL_RULES:
-        where = rule.where
-        if isinstance(where, Location):
-            where = [rule.where]
-
-        for location in where:
+        for loc_ind, location in enumerate(get_locations(rule)):
             if isinstance(location, ALL):
-                for match, lines in text.find_iter(rule.re_pattern):
-                    # FIXME is this the best check? maybe check if any line?
-                    if lines[0].text.strip().startswith("%") and not do_comments:
-                        continue
-                    yield RuleBroken(rule=rule, match=match, lines=lines)
-
-            # elif isinstance(location, COMMAND):
-            #     print('doing', location)
-            #     for this_cmd_text in text.iter_command(location.opt):
-            #         print(this_cmd_text)
-            #         for match, lines in this_cmd_text.find_iter(rule.re_pattern):
-            #             yield RuleBroken(rule=rule, match=match, lines=lines)
-
-            elif isinstance(location, INLINE):
-                for this_cmd_text in text.iter_inline_delim(location.opt):
-                    for match, lines in this_cmd_text.find_iter(rule.re_pattern):
-                        yield RuleBroken(rule=rule, match=match, lines=lines)
-
-            # elif isinstance(location, ENVIRONMENT):
-            #     print('doing', location)
-            #     for this_cmd_text in text.iter_environment(location.opt):
-            #         print(this_cmd_text)
-            #         for match, lines in this_cmd_text.find_iter(rule.re_pattern):
-            #             yield RuleBroken(rule=rule, match=match, lines=lines)
-
-
-def check_and_report_errors(text, do_comments):
-    """Check text for all errors, and print them out"""
+                continue
+            if not RULE_SET.may_match(rule, text):
+                break
+            sources.append(iter_location_problems(text, rule, location, loc_ind, do_comments))
+
+    watchdog = RULE_SET.watchdog
+    if watchdog is None:
+        for _, broken_rule in heapq.merge(*sources, key=itemgetter(0)):
+            yield broken_rule
+        return
+
+    watchdog.start_text()
+    with watchdog.armed():
+        for _, broken_rule in heapq.merge(*sources, key=itemgetter(0)):
+            yield broken_rule
+
+
+def check_part(text, part_text, do_comments):
+    """Check part of text (e.g. the title, from iter_command()) on its own.
+
+    Yields RuleBroken like check_text(), but moved into text (see move_problem()).
+    """
+    shift = part_text.offset - text.offset
+    for broken_rule in check_text(part_text, do_comments):
+        yield move_problem(broken_rule, text, shift)
+
+
+def report_timeout(rule, out=None):
+    """Print message about a rule that timed out (None for the combined scan)"""
+    budget = RULE_SET.watchdog.budget
+    if rule is None:
+        print("  " + TERMCOL.RED + "Combined scan timed out after %g s, " % budget +
+              "checked the rest of this text one rule at a time" + TERMCOL.ENDC, file=out)
+    else:
+        print("  " + TERMCOL.RED + "Rule timed out after %g s, " % budget +
+              "not checked in the rest of this text" + TERMCOL.ENDC,
+              TERMCOL.PINK, "[", rule.description, "]", TERMCOL.ENDC, file=out)
+
+
+def check_and_report_errors(text, do_comments, out=None, parent=None):
+    """Check text for all errors, and print them out as they are found.
+
+    If parent is given, text is part of it, and problems are given in parent (see check_part()).
+    """
     problems = []
-    for broken_rule in check_text(text, do_comments):
+    broken_rules = (check_text(text, do_comments) if parent is None
+                    else check_part(parent, text, do_comments))
+    for broken_rule in broken_rules:
+        report_error(broken_rule, out=out)
         problems.append(broken_rule)
-    problems = sorted(problems, key=lambda x: x.lines[0].line_num)
-    for broken_rule in problems:
-        report_error(broken_rule)
+    if RULE_SET.watchdog is not None:
+        for rule in RULE_SET.watchdog.timed_out:
+            report_timeout(rule, out=out)
     return problems
 
 
-def print_filename_header(filename):
+def set_current_file(label):
+    """Set the file being checked, for profiling & timeouts"""
+    if RULE_SET.profile is not None:
+        RULE_SET.profile.filename = label
+    if RULE_SET.watchdog is not None:
+        RULE_SET.watchdog.filename = label
+
+
+def num_timeouts():
+    """Get number of rules that have timed out so far"""
+    return 0 if RULE_SET.watchdog is None else len(RULE_SET.watchdog.timeouts)
+
+
+def make_label(filename, part=None):
+    """Make label for results of a file, or a part of it (e.g. TITLE)"""
+    return filename if part is None else filename + " [" + part + "]"
+
+
+def split_label(label):
+    """Split output of make_label back into (filename, part or None)"""
+    match = re.match(r"^(.*) \[([A-Z]+)\]$", label)
+    if match is None:
+        return label, None
+    return match.group(1), match.group(2)
+
+
+def write_results(label, problems):
+    """Write list of RuleBroken for a file (see make_label) with RESULTS_WRITER, if used"""
+    if RESULTS_WRITER is not None:
+        filename, part = split_label(label)
+        RESULTS_WRITER.write_problems(filename, problems, part)
+
+
+def print_filename_header(filename, out=None):
     """Print header for filename"""
     separator = "-" * 60
-    print(separator)
-    print(TERMCOL.BLUE + filename + TERMCOL.ENDC)
-    print(separator)
+    print(separator, file=out)
+    print(TERMCOL.BLUE + filename + TERMCOL.ENDC, file=out)
+    print(separator, file=out)
 
 
-def check_root_file(filename):
-    """Check elements of the main TeX file"""
-    with open(filename) as f:
-        root_text = Text(f.readlines())
+def serialize_problems(problems):
+    """Convert list of RuleBroken into a JSON-friendly list"""
+    return [[RULE_INDEX[p.rule], p.match.start(), p.match.end(), p.match.group(0),
+             [list(line) for line in p.lines]]
+            for p in problems]
 
-    problems_dict = OrderedDict()
 
-    abstract_text = list(root_text.iter_command("abstract"))[0]
-    print_filename_header(filename + " (ABSTRACT)")
-    abstract_problems = check_and_report_errors(abstract_text, do_comments=False)
-    problems_dict[filename + " [ABSTRACT]"] = abstract_problems
+def deserialize_problems(saved_problems):
+    """Convert output of serialize_problems back into list of RuleBroken"""
+    return [RuleBroken(rule=ALL_RULES[rule_ind],
+                       match=SavedMatch(start, end, text),
+                       lines=[TextLine(*line) for line in lines])
+            for rule_ind, start, end, text, lines in saved_problems]
 
-    title_text = list(root_text.iter_command("title"))[0]
-    print_filename_header(filename + " (TITLE)")
-    title_problems = check_and_report_errors(title_text, do_comments=False)
-    problems_dict[filename + " [TITLE]"] = title_problems
 
-    return problems_dict
+def get_cached_problems(file_cache, label, file_hash):
+    """Get list of RuleBroken for label from file_cache, if the file hash matches.
+
+    Returns None if there are no valid cached results.
+    """
+    if file_cache is None:
+        return None
+    entry = file_cache.get(os.path.abspath(label))
+    if entry is None or entry['hash'] != file_hash:
+        return None
+    return deserialize_problems(entry['problems'])
 
 
-def check_content_files(filenames, do_comments=False):
-    """Iterate through normal latex files and check each, printing out errors"""
+def store_cached_problems(file_cache, label, file_hash, problems):
+    """Store list of RuleBroken for label in file_cache"""
+    if file_cache is None:
+        return
+    file_cache[os.path.abspath(label)] = {
+        'hash': file_hash,
+        'problems': serialize_problems(problems)
+    }
+
+
+def report_cached_errors(problems, out=None):
+    """Print out errors that were stored from a previous run"""
+    for broken_rule in problems:
+        report_error(broken_rule, out=out)
+    return problems
+
+
+def check_root_file(filename, file_cache=None, report_cached=True, file_store=None):
+    """Check elements of the main TeX file
+
+    If file_cache is given, results from it are used if the file is unchanged,
+    and it is updated with any new results. Cached results are only printed
+    if report_cached is True.
+    The file is taken from file_store if given, otherwise it is read from disk.
+    """
+    if file_store is None:
+        with FileStore() as file_store:
+            return check_root_file(filename, file_cache, report_cached, file_store)
+
+    file_hash, _ = file_store.get(filename)
+
     problems_dict = OrderedDict()
+
+    for part, command in ROOT_PARTS:
+        label = make_label(filename, part)
+        problems = get_cached_problems(file_cache, label, file_hash)
+        if problems is not None:
+            if report_cached:
+                print_filename_header(filename + " (" + part + ")")
+                report_cached_errors(problems)
+        else:
+            print_filename_header(filename + " (" + part + ")")
+            set_current_file(label)
+            # only need the first one
+            text = file_store.get_text(filename)
+            part_text = next(text.iter_command(command), None)
+            timeouts_before = num_timeouts()
+            if part_text is None:
+                # e.g. half-written while using --watch
+                print(TERMCOL.RED + "No complete \\" + command + "{...} found" + TERMCOL.ENDC)
+                problems = []
+            else:
+                problems = check_and_report_errors(part_text, do_comments=False, parent=text)
+            # incomplete results shouldn't be reused
+            if num_timeouts() == timeouts_before:
+                store_cached_problems(file_cache, label, file_hash, problems)
+        write_results(label, problems)
+        problems_dict[label] = problems
+
+    return problems_dict
+
+
+def check_content_text(filename, text, do_comments=False, out=None):
+    """Check the Text of one normal latex file, printing out errors"""
+    set_current_file(filename)
+    print_filename_header(filename, out=out)
+    return check_and_report_errors(text, do_comments, out=out)
+
+
+def check_content_data(filename, data, do_comments=False, out=None):
+    """Check the raw contents of one normal latex file, printing out errors"""
+    return check_content_text(filename, Text(decode_lines(data)), do_comments, out=out)
+
+
+def check_content_incremental(filename, lines, checkers, do_comments=False):
+    """Check one normal latex file with its IncrementalChecker, printing out errors.
+
+    checkers is a dict of {filename: IncrementalChecker}, which is added to if needed.
+    Only the blocks of the file that changed since it was last checked are checked again.
+    """
+    set_current_file(filename)
+    print_filename_header(filename)
+    if filename not in checkers:
+        # pass this module, in case it is being run as a script
+        checkers[filename] = IncrementalChecker(do_comments, sys.modules[__name__])
+    timeouts_before = num_timeouts()
+    problems = checkers[filename].check(lines)
+    for broken_rule in problems:
+        report_error(broken_rule)
+    if RULE_SET.watchdog is not None:
+        for _, rule in RULE_SET.watchdog.timeouts[timeouts_before:]:
+            report_timeout(rule)
+    return problems
+
+
+def check_content_data_in_worker(filename, data, do_comments, profile=False, rule_timeout=0):
+    """Check one file in a worker process, returning results in a picklable form.
+
+    Returns (printed output, serialized list of RuleBroken,
+    (# rule scans, # rule scans skipped), Profile stats as a list if profile else None,
+    list of indices of rules that timed out, None for the combined scan)
+    """
+    out = StringIO()
+    num_scans, num_skipped = RULE_SET.num_scans, RULE_SET.num_skipped
+    RULE_SET.profile = Profile(ALL_RULES) if profile else None
+    RULE_SET.watchdog = Watchdog(rule_timeout) if rule_timeout > 0 else None
+    problems = check_content_data(filename, data, do_comments, out=out)
+    scan_counts = (RULE_SET.num_scans - num_scans, RULE_SET.num_skipped - num_skipped)
+    profile_stats = RULE_SET.profile.to_list() if profile else None
+    timeouts = []
+    if RULE_SET.watchdog is not None:
+        timeouts = [RULE_INDEX.get(rule) for _, rule in RULE_SET.watchdog.timeouts]
+    return out.getvalue(), serialize_problems(problems), scan_counts, profile_stats, timeouts
+
+
+def check_content_files(filenames, do_comments=False, jobs=1, file_cache=None,
+                        report_cached=True, file_store=None, checkers=None):
+    """Iterate through normal latex files and check each, printing out errors
+
+    With jobs > 1, files are checked in a pool of that many processes,
+    biggest files first. Output is still printed in the order of filenames.
+
+    If file_cache is given, results from it are used for unchanged files,
+    and it is updated with results for the other files. Cached results are
+    only printed if report_cached is True.
+    Files are taken from file_store if given, otherwise they are read from disk.
+    If checkers is given, files checked in this process are checked with the
+    IncrementalChecker for them in it, see check_content_incremental().
+    """
+    if file_store is None:
+        with FileStore() as file_store:
+            return check_content_files(filenames, do_comments, jobs, file_cache,
+                                       report_cached, file_store, checkers)
+
+    file_hashes, file_datas, cached_problems = {}, {}, {}
     for filename in filenames:
-        with open(filename) as f:
-            text = Text(f.readlines())
-        print_filename_header(filename)
-        these_problems = check_and_report_errors(text, do_comments)
-        problems_dict[filename] = these_problems
+        file_store.prefetch(filename)
+    for filename in filenames:
+        file_hashes[filename], file_datas[filename] = file_store.get(filename)
+        problems = get_cached_problems(file_cache, filename, file_hashes[filename])
+        if problems is not None:
+            cached_problems[filename] = problems
+    to_check = sorted(set(filenames) - set(cached_problems),
+                      key=lambda x: len(file_datas[x]), reverse=True)
+
+    executor = None
+    futures = {}
+    if jobs > 1 and len(to_check) > 1:
+        # only imported when needed, as it is slow to import
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        for filename in to_check:
+            futures[filename] = executor.submit(check_content_data_in_worker,
+                                                filename, file_datas[filename], do_comments,
+                                                RULE_SET.profile is not None,
+                                                RULE_SET.watchdog.budget
+                                                if RULE_SET.watchdog is not None else 0)
+
+    problems_dict = OrderedDict()
+    try:
+        for filename in filenames:
+            timeouts_before = num_timeouts()
+            if filename in cached_problems:
+                problems = cached_problems[filename]
+                if report_cached:
+                    print_filename_header(filename)
+                    report_cached_errors(problems)
+            elif filename in futures:
+                output, saved_problems, (num_scans, num_skipped), profile_stats, timeouts = \
+                    futures[filename].result()
+                sys.stdout.write(output)
+                RULE_SET.num_scans += num_scans
+                RULE_SET.num_skipped += num_skipped
+                if profile_stats is not None:
+                    RULE_SET.profile.update(profile_stats)
+                for rule_ind in timeouts:
+                    RULE_SET.watchdog.timeouts.append(
+                        (filename, None if rule_ind is None else ALL_RULES[rule_ind]))
+                problems = deserialize_problems(saved_problems)
+            elif checkers is not None:
+                problems = check_content_incremental(filename, decode_lines(file_datas[filename]),
+                                                     checkers, do_comments)
+            else:
+                problems = check_content_text(filename, file_store.get_text(filename),
+                                              do_comments)
+            # incomplete results shouldn't be reused
+            if num_timeouts() == timeouts_before:
+                store_cached_problems(file_cache, filename, file_hashes[filename], problems)
+            write_results(filename, problems)
+            problems_dict[filename] = problems
+    finally:
+        if executor is not None:
+            executor.shutdown()
     return problems_dict
 
 
@@ -219,15 +687,24 @@ def check_content_files(filenames, do_comments=False):
 
 def print_final_summary(problems_dict, cached_results=None):
     """Print summary for user: # errors per file, and # per error type"""
+    file_counts = OrderedDict((fname, len(problems)) for fname, problems in problems_dict.items())
+    issue_counts = defaultdict(int)
+    for problems in problems_dict.values():
+        for problem in problems:
+            issue_counts[problem.rule.description] += 1
+    print_summary_counts(file_counts, issue_counts, cached_results)
+
+
+def print_summary_counts(file_counts, issue_counts, cached_results=None):
+    """Print summary from dict of {filename: # errors} & dict of {rule description: # errors}"""
     separator = "-" * 80
     print(separator)
     print(TERMCOL.YELLOW + TERMCOL.BOLD + "SUMMARY (by file)" + TERMCOL.ENDC)
     print(separator)
-    max_len = max([len(f) for f in problems_dict])
-    max_problems = max([len(p) for p in problems_dict.values()])
+    max_len = max([len(f) for f in file_counts] + [0])
+    max_problems = max(list(file_counts.values()) + [0])
     max_problems_str = "%d" % max_problems
-    for fname, problems in problems_dict.items():
-        num_problems = len(problems)
+    for fname, num_problems in file_counts.items():
         num_problems_str = str(num_problems)
         num_dots = max_len + 3 - len(fname) + len(max_problems_str) - len(num_problems_str)
         err_count_str = fname + "." * num_dots + num_problems_str
@@ -258,75 +735,584 @@ def print_final_summary(problems_dict, cached_results=None):
     print(separator)
     print(TERMCOL.YELLOW + TERMCOL.BOLD + "SUMMARY (by issue)" + TERMCOL.ENDC)
     print(separator)
-    issue_dict = defaultdict(int)
-    for problems in problems_dict.values():
-        for problem in problems:
-            issue_dict[problem.rule.description] += 1
     # Sort by descending # of occurences
-    issue_dict = {k[0]: k[1] for k in sorted(issue_dict.items(), key=lambda x: x[1], reverse=True)}
-    max_len = max([len(k) for k in issue_dict])
-    desc_fmt_str = "{0:.<%d}" % (max_len+2)
-    for desc, ind in issue_dict.items():
-        print(desc_fmt_str.format(desc), ind)
+    issue_dict = {k[0]: k[1] for k in sorted(issue_counts.items(), key=lambda x: x[1],
+                                              reverse=True)}
+    if not issue_dict:
+        print(TERMCOL.GREEN + "No issues" + TERMCOL.ENDC)
+    else:
+        max_len = max([len(k) for k in issue_dict])
+        desc_fmt_str = "{0:.<%d}" % (max_len+2)
+        for desc, ind in issue_dict.items():
+            print(desc_fmt_str.format(desc), ind)
     print(separator)
     total_num_issues = sum(issue_dict.values())
-    total_num_bad_files = len([p for p in problems_dict if len(problems_dict[p]) > 0])
+    total_num_bad_files = len([n for n in file_counts.values() if n > 0])
     print(TERMCOL.YELLOW + TERMCOL.BOLD + "TOTAL:",
           total_num_issues, "issues across", total_num_bad_files, "files",
           TERMCOL.ENDC)
     print(separator)
 
 
-def read_results_from_cache(cache_filename, tex_filename):
-    """Get cached results from JSON file"""
+def load_cache(cache_filename):
+    """Load cache file contents, converting from older formats if necessary
+
+    The cache has a dict of summary results (# problems per file) for each main
+    TeX file, and full results for each checked file, for each rule set/option
+    combination (see make_cache_key)
+    """
+    jdict = {'version': CACHE_VERSION, 'summaries': {}, 'files': {}}
     if not os.path.isfile(cache_filename) or os.path.getsize(cache_filename) == 0:
-        return None
+        return jdict
 
     with open(cache_filename) as f:
-        jdict = json.load(f)
-        full_text_filename = os.path.abspath(tex_filename)
-        if full_text_filename not in jdict:
-            return None
-        return jdict[full_text_filename]
+        contents = json.load(f)
+    if contents.get('version') == CACHE_VERSION:
+        return contents
+    if 'version' not in contents:
+        # original format, with only summary results
+        jdict['summaries'] = contents
+    return jdict
+
 
+def make_cache_key(do_comments):
+    """Make key for storing full results, so they are only reused with the same rules & options"""
+    return "%s-%s-doComments=%s" % (__version__, RULE_SET.fingerprint(), do_comments)
 
-def write_results_to_cache(results, cache_filename, tex_filename):
-    """Save results to cache file for comparison on later runs"""
+
+def read_results_from_cache(cache_filename, tex_filename):
+    """Get cached results from JSON file"""
+    jdict = load_cache(cache_filename)
     full_text_filename = os.path.abspath(tex_filename)
-    if os.path.isfile(cache_filename) and os.path.getsize(cache_filename) > 0:
-        with open(cache_filename) as f:
-            jdict = json.load(f)
-    else:
-        jdict = {full_text_filename: None}
+    return jdict['summaries'].get(full_text_filename, None)
+
+
+def read_files_from_cache(cache_filename, cache_key):
+    """Get dict of full results per file from JSON file, for a given cache key"""
+    jdict = load_cache(cache_filename)
+    return jdict['files'].get(cache_key, {})
+
+
+def write_results_to_cache(results, cache_filename, tex_filename, file_cache=None, cache_key=None):
+    """Save results to cache file for comparison on later runs
+
+    If file_cache & cache_key are given, the full results are also saved,
+    for those files in results.
+    """
+    write_batch_results_to_cache({tex_filename: results}, cache_filename, file_cache, cache_key)
+
 
-    slim_results = {k: len(v) for k, v in results.items()}
-    jdict[full_text_filename] = slim_results
+def write_batch_results_to_cache(results_by_document, cache_filename, file_cache=None,
+                                 cache_key=None):
+    """Save results for several documents to cache file, see write_results_to_cache()
 
+    results_by_document is a dict of {main TeX file: results}
+    """
+    jdict = load_cache(cache_filename)
+    # only write the file if something in it changes
+    changed = not os.path.isfile(cache_filename)
+
+    for tex_filename, results in results_by_document.items():
+        full_text_filename = os.path.abspath(tex_filename)
+        slim_results = {k: len(v) for k, v in results.items()}
+        if jdict['summaries'].get(full_text_filename) != slim_results:
+            jdict['summaries'][full_text_filename] = slim_results
+            changed = True
+
+    if file_cache is not None and cache_key is not None:
+        # forget results from other versions of the rules
+        fingerprint = cache_key.split("doComments=")[0]
+        files = {k: v for k, v in jdict['files'].items() if k.startswith(fingerprint)}
+        changed = changed or len(files) != len(jdict['files'])
+        these_files = files.setdefault(cache_key, {})
+        for results in results_by_document.values():
+            for label in results:
+                full_label = os.path.abspath(label)
+                if full_label not in file_cache:
+                    continue
+                # results only change with the file, so comparing hashes is enough
+                if these_files.get(full_label, {}).get('hash') != file_cache[full_label]['hash']:
+                    these_files[full_label] = file_cache[full_label]
+                    changed = True
+        jdict['files'] = files
+
+    if not changed:
+        return
+    # compact, as the indented encoder is much slower on big caches
     with open(cache_filename, 'w') as f:
-        json.dump(jdict, f, indent=2)
+        json.dump(jdict, f, separators=(',', ':'))
+
+
+def start_profile(args):
+    """Start recording the time for each rule if --profile is used, otherwise stop"""
+    RULE_SET.profile = Profile(ALL_RULES) if args.profile else None
+
+
+def start_watchdog(args):
+    """Start limiting the time each rule can take, if asked"""
+    RULE_SET.watchdog = Watchdog(args.ruleTimeout) if args.ruleTimeout > 0 else None
+
+
+def report_timeouts():
+    """Print out all the rules that timed out"""
+    if RULE_SET.watchdog is None:
+        return
+    for filename, rule in RULE_SET.watchdog.timeouts:
+        description = "combined scan" if rule is None else rule.description
+        print(TERMCOL.RED + "Timed out in " + filename + ": " + description + TERMCOL.ENDC)
+
+
+def report_profile(args):
+    """Print out the time for each rule, and save it if asked"""
+    if RULE_SET.profile is None:
+        return
+    RULE_SET.profile.print_table()
+    if args.profileJson:
+        RULE_SET.profile.save(args.profileJson)
+        print("Saved profile to", args.profileJson)
+
+
+def check_document(tex_file, do_comments=False, jobs=1, file_cache=None, report_cached=True,
+                   checkers=None, file_store=None, files_dict=None):
+    """Check the main TeX file & all included files, printing out errors
+
+    checkers is passed to check_content_files().
+    files_dict from extract_input_files() can be given if already known,
+    along with the FileStore it was made with.
+    Returns OrderedDict of {label: list of RuleBroken}, where label is the filename
+    (or the filename & part for the title & abstract)
+    """
+    if file_store is None:
+        with FileStore() as file_store:
+            return check_document(tex_file, do_comments, jobs, file_cache, report_cached,
+                                  checkers, file_store, files_dict)
+
+    if files_dict is None:
+        files_dict = extract_input_files(tex_file, file_store)
+    for filename, parent in files_dict['circular']:
+        print(TERMCOL.RED + "Ignoring circular include of " + filename +
+              " in " + parent + TERMCOL.ENDC)
+    root_results = check_root_file(files_dict['root'], file_cache, report_cached,
+                                   file_store)
+    content_results = check_content_files(files_dict['contents'], do_comments,
+                                          jobs, file_cache, report_cached, file_store,
+                                          checkers)
+    # bib_results = check_bib_files(files_dict['bib'])
+
+    root_results.update(content_results)
+    return root_results
+
+
+def run_checks(args, cache_filename, file_cache, cache_key, report_cached=True, checkers=None,
+               file_store=None, files_dict=None):
+    """Check the main TeX file & all included files, print results & save them to the cache
+
+    checkers, file_store & files_dict are passed to check_document().
+    """
+    RULE_SET.reset_counts()
+    start_profile(args)
+    start_watchdog(args)
+    cached_results = read_results_from_cache(cache_filename, args.input)
+
+    root_results = check_document(args.input, args.doComments, args.jobs, file_cache,
+                                  report_cached, checkers, file_store, files_dict)
+    print_final_summary(root_results, cached_results)
+    print("Skipped", RULE_SET.num_skipped, "of", RULE_SET.num_scans,
+          "rule scans as the required text was not present")
+    report_timeouts()
+    report_profile(args)
+
+    # write results to cache file
+    write_results_to_cache(root_results, cache_filename, args.input, file_cache, cache_key)
+    return root_results
+
+
+# file cache for each worker process in batch mode, loaded on first use
+WORKER_FILE_CACHE = {}
+
+
+def check_document_in_worker(tex_file, do_comments, cache_filename, cache_key,
+                             profile=False, rule_timeout=0):
+    """Check one whole document for batch mode, returning results in a picklable form.
+
+    Can be run in a worker process, or this one.
+    Results are taken from the cache file if possible, but it is not written to.
+    Returns (printed output, OrderedDict of {label: serialized list of RuleBroken},
+    dict of new file cache entries, (# rule scans, # rule scans skipped),
+    Profile stats as a list if profile else None,
+    list of (filename, rule index) that timed out, with None for the combined scan,
+    error message if the document couldn't be checked else None).
+    If the document can't be checked, e.g. as an included file is missing,
+    the error is printed and there are no results, so the other documents carry on.
+    """
+    global RESULTS_WRITER
+    if (cache_filename, cache_key) not in WORKER_FILE_CACHE:
+        WORKER_FILE_CACHE[(cache_filename, cache_key)] = read_files_from_cache(cache_filename,
+                                                                               cache_key)
+    file_cache = WORKER_FILE_CACHE[(cache_filename, cache_key)]
+
+    # keep the state of this process, in case this isn't a worker process
+    old_state = (RULE_SET.profile, RULE_SET.watchdog, RULE_SET.num_scans, RULE_SET.num_skipped)
+    # results are written out by the main process
+    old_writer, RESULTS_WRITER = RESULTS_WRITER, None
+    RULE_SET.reset_counts()
+    RULE_SET.profile = Profile(ALL_RULES) if profile else None
+    RULE_SET.watchdog = Watchdog(rule_timeout) if rule_timeout > 0 else None
+    out = StringIO()
+    error = None
+    try:
+        with redirect_stdout(out):
+            try:
+                results = check_document(tex_file, do_comments, 1, file_cache)
+            except Exception as err:
+                error = "%s: %s" % (type(err).__name__, err)
+                print(TERMCOL.RED + "Could not check document: " + error + TERMCOL.ENDC)
+                results = OrderedDict()
+        saved_results = OrderedDict((label, serialize_problems(problems))
+                                    for label, problems in results.items())
+        new_cache_entries = {}
+        for label in results:
+            full_label = os.path.abspath(label)
+            if full_label in file_cache:
+                new_cache_entries[full_label] = file_cache[full_label]
+        scan_counts = (RULE_SET.num_scans, RULE_SET.num_skipped)
+        profile_stats = RULE_SET.profile.to_list() if profile else None
+        timeouts = []
+        if RULE_SET.watchdog is not None:
+            timeouts = [(filename, RULE_INDEX.get(rule))
+                        for filename, rule in RULE_SET.watchdog.timeouts]
+    finally:
+        RULE_SET.profile, RULE_SET.watchdog, RULE_SET.num_scans, RULE_SET.num_skipped = old_state
+        RESULTS_WRITER = old_writer
+    return (out.getvalue(), saved_results, new_cache_entries, scan_counts, profile_stats,
+            timeouts, error)
+
+
+def print_document_header(tex_file):
+    """Print header for a document in batch mode"""
+    separator = "=" * 80
+    print(separator)
+    print(TERMCOL.YELLOW + TERMCOL.BOLD + "DOCUMENT: " + tex_file + TERMCOL.ENDC)
+    print(separator)
+
+
+def run_batch_checks(args, cache_filename, cache_key):
+    """Check many documents, printing results for each & a summary across all of them.
+
+    Documents are checked in a pool of --jobs processes, but printed in order.
+    Documents that can't be checked are reported, and left out of the results.
+    Returns OrderedDict of {main TeX file: OrderedDict of {label: list of RuleBroken}}
+    """
+    RULE_SET.reset_counts()
+    start_profile(args)
+    start_watchdog(args)
+    documents = find_documents(args.input)
+    print("Found", len(documents), "documents")
+    if not documents:
+        return OrderedDict()
+
+    jdict = load_cache(cache_filename)
+    # the cache file may have changed since the last batch, and worker processes
+    # may be forked from this one
+    WORKER_FILE_CACHE.clear()
+    rule_timeout = RULE_SET.watchdog.budget if RULE_SET.watchdog is not None else 0
+    task_args = [(tex_file, args.doComments, cache_filename, cache_key, args.profile, rule_timeout)
+                 for tex_file in documents]
+
+    executor = None
+    if args.jobs > 1 and len(documents) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        outputs = executor.map(check_document_in_worker, *zip(*task_args))
+    else:
+        outputs = (check_document_in_worker(*these_args) for these_args in task_args)
+
+    results_by_document = OrderedDict()
+    # main TeX file -> error message, for documents that couldn't be checked
+    failed = OrderedDict()
+    file_cache = {}
+    try:
+        for tex_file, output in zip(documents, outputs):
+            (printed, saved_results, new_cache_entries, (num_scans, num_skipped),
+             profile_stats, timeouts, error) = output
+            print_document_header(tex_file)
+            sys.stdout.write(printed)
+            if error is not None:
+                failed[tex_file] = error
+                continue
+            results_by_document[tex_file] = OrderedDict(
+                (label, deserialize_problems(saved_problems))
+                for label, saved_problems in saved_results.items())
+            for label, problems in results_by_document[tex_file].items():
+                write_results(label, problems)
+            file_cache.update(new_cache_entries)
+            RULE_SET.num_scans += num_scans
+            RULE_SET.num_skipped += num_skipped
+            if profile_stats is not None:
+                RULE_SET.profile.update(profile_stats)
+            for filename, rule_ind in timeouts:
+                RULE_SET.watchdog.timeouts.append(
+                    (filename, None if rule_ind is None else ALL_RULES[rule_ind]))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # one entry per document, with all the problems in its files
+    document_problems = OrderedDict()
+    cached_totals = {}
+    for tex_file, results in results_by_document.items():
+        document_problems[tex_file] = [p for problems in results.values() for p in problems]
+        last_results = jdict['summaries'].get(os.path.abspath(tex_file))
+        if last_results is not None:
+            cached_totals[tex_file] = sum(last_results.values())
+    print_final_summary(document_problems, cached_totals)
+    print("Checked", len(results_by_document), "documents with",
+          sum(len(results) for results in results_by_document.values()), "files & parts")
+    if failed:
+        print(TERMCOL.RED + "Could not check %d documents:" % len(failed) + TERMCOL.ENDC)
+        for tex_file, error in failed.items():
+            print("  " + tex_file + ": " + error)
+    print("Skipped", RULE_SET.num_skipped, "of", RULE_SET.num_scans,
+          "rule scans as the required text was not present")
+    report_timeouts()
+    report_profile(args)
+
+    write_batch_results_to_cache(results_by_document, cache_filename, file_cache, cache_key)
+    return results_by_document
+
+
+def check_stream(args):
+    """Check one file or stdin in overlapping windows of lines, printing out errors as they are found.
+
+    Only the current window is kept in memory, plus the number of problems
+    for each rule, for the summary. Returns dict of {rule description: # of problems}.
+    """
+    RULE_SET.reset_counts()
+    start_profile(args)
+    start_watchdog(args)
+    if args.input == "-":
+        label, lines = "<stdin>", iter_stdin_lines()
+    else:
+        label, lines = args.input, iter_mmap_lines(args.input)
+
+    print_filename_header(label)
+    set_current_file(label)
+    # only the number of problems for each rule is needed for the summary
+    issue_counts = defaultdict(int)
+    for text, own_start, own_end in iter_windows(lines, args.windowLines, args.windowOverlap):
+        for broken_rule in check_text(text, args.doComments):
+            # problems starting in the overlap with another window are reported by that window
+            if not own_start <= broken_rule.lines[0].line_num < own_end:
+                continue
+            report_error(broken_rule)
+            if RESULTS_WRITER is not None:
+                RESULTS_WRITER.write(label, broken_rule)
+            issue_counts[broken_rule.rule.description] += 1
+        if RULE_SET.watchdog is not None:
+            for rule in RULE_SET.watchdog.timed_out:
+                report_timeout(rule)
+
+    print_summary_counts(OrderedDict([(label, sum(issue_counts.values()))]), issue_counts)
+    print("Skipped", RULE_SET.num_skipped, "of", RULE_SET.num_scans,
+          "rule scans as the required text was not present")
+    report_timeouts()
+    report_profile(args)
+    return issue_counts
+
+
+def check_since(args):
+    """Check the lines of .tex files changed since git revision args.since, printing out errors.
+
+    Only changed files are read, and only the paragraphs around the changed lines
+    (see IncrementalChecker.check_lines()) are checked. Only problems that include
+    a changed line are reported. New (untracked) files are only checked if the main
+    file (or any main file in the directory) includes them, so if there are any,
+    the included files are all read to find out.
+    """
+    RULE_SET.reset_counts()
+    start_profile(args)
+    start_watchdog(args)
+    directory = args.input if os.path.isdir(args.input) else os.path.dirname(args.input)
+    changed = get_changed_lines(directory or ".", args.since)
+    if None in changed.values():
+        # new files only count if they are part of the paper
+        included = set()
+        for tex_file in find_documents([args.input]):
+            files_dict = extract_input_files(tex_file)
+            included.update(os.path.abspath(filename)
+                            for filename in [files_dict['root']] + files_dict['contents'])
+        changed = OrderedDict((filename, line_nums) for filename, line_nums in changed.items()
+                              if line_nums is not None or
+                              os.path.abspath(os.path.join(directory, filename)) in included)
+    print("Found", len(changed), ".tex files changed since", args.since)
+
+    results = OrderedDict()
+    for filename, line_nums in changed.items():
+        filename = os.path.join(directory, filename)
+        print_filename_header(filename)
+        set_current_file(filename)
+        _, data = read_file(filename)
+        lines = decode_lines(data)
+        if line_nums is None:
+            line_nums = set(range(1, len(lines) + 1))
+        checker = IncrementalChecker(args.doComments, sys.modules[__name__])
+        timeouts_before = num_timeouts()
+        problems = [broken_rule for broken_rule in checker.check_lines(lines, line_nums)
+                    if any(line.line_num in line_nums for line in broken_rule.lines)]
+        for broken_rule in problems:
+            report_error(broken_rule)
+        if RULE_SET.watchdog is not None:
+            for _, rule in RULE_SET.watchdog.timeouts[timeouts_before:]:
+                report_timeout(rule)
+        write_results(filename, problems)
+        results[filename] = problems
+
+    print_final_summary(results)
+    print("Skipped", RULE_SET.num_skipped, "of", RULE_SET.num_scans,
+          "rule scans as the required text was not present")
+    report_timeouts()
+    report_profile(args)
+    return results
+
+
+def get_watched_files(files_dict):
+    """Get list of the main TeX file & all the files it includes, from extract_input_files()"""
+    return [files_dict['root']] + files_dict['contents']
+
+
+def includes_changed(files_dict, filenames, file_store):
+    """Check if any of filenames now include different files from files_dict.
+
+    Files that couldn't be read before, or can't be read now, count as changed.
+    """
+    for filename in filenames:
+        if filename not in files_dict['includes']:
+            return True
+        try:
+            names = find_includes(file_store.get_text(filename))
+        except (IOError, OSError):
+            return True
+        if names != files_dict['includes'][filename]:
+            return True
+    return False
+
+
+def get_modification_times(filenames):
+    """Get dict of {filename: (modification time, size)} for list of files.
+
+    Missing files have None.
+    """
+    times = OrderedDict()
+    for filename in filenames:
+        if os.path.isfile(filename):
+            stat = os.stat(filename)
+            times[filename] = (stat.st_mtime_ns, stat.st_size)
+        else:
+            times[filename] = None
+    return times
+
+
+def watch(args, cache_filename, file_cache, cache_key, max_checks=None):
+    """Keep checking files whenever they change, until stopped with Ctrl-C.
+
+    Only new problems from changed files are printed after the first check,
+    followed by the updated summary. Changed files are checked with an IncrementalChecker,
+    so only the paragraphs around each change are checked again.
+    max_checks limits the number of checks (for testing).
+    The included files are only found again when a changed file's
+    \\input etc lines change.
+    """
+    last_times = None
+    files_dict = None
+    num_checks = 0
+    # filename -> IncrementalChecker
+    checkers = {}
+    while max_checks is None or num_checks < max_checks:
+        times = None if last_times is None else get_modification_times(last_times)
+        if times is None or times != last_times:
+            with FileStore() as file_store:
+                changed = [filename for filename in times or []
+                           if times[filename] != last_times[filename]]
+                if files_dict is None or includes_changed(files_dict, changed, file_store):
+                    files_dict = extract_input_files(args.input, file_store)
+                times = get_modification_times(get_watched_files(files_dict))
+                last_times = times
+                # forget files no longer included
+                for filename in set(checkers) - set(times):
+                    del checkers[filename]
+                try:
+                    run_checks(args, cache_filename, file_cache, cache_key,
+                               report_cached=(num_checks == 0), checkers=checkers,
+                               file_store=file_store, files_dict=files_dict)
+                except (IOError, OSError) as err:
+                    # e.g. a file is missing or half-written, try again on the next change
+                    print(TERMCOL.RED + "Could not check files: " + str(err) + TERMCOL.ENDC)
+            num_checks += 1
+            print("Watching", len(times), "files for changes, press Ctrl-C to stop")
+            sys.stdout.flush()
+        else:
+            time.sleep(args.watchInterval)
 
 
 def main(in_args):
     """Main function to organise all the things, collate results, publish them"""
+    global RESULTS_WRITER
     parser = create_arg_parser()
     args = parser.parse_args(in_args)
     check_args(args)
 
+    if args.lsp:
+        # import here, as the server isn't needed for normal checks
+        from cmspubstyle import lsp
+        return lsp.serve(sys.stdin.buffer, sys.stdout.buffer, args.doComments, args.ruleTimeout)
+
+    if args.format == "text":
+        return run_main(args)
+
+    # machine-readable results go to stdout, unless another file is given,
+    # so move the normal output out of the way
+    out = open(args.output, 'w') if args.output else sys.stdout
+    RESULTS_WRITER = WRITERS[args.format](out, ALL_RULES)
+    try:
+        if args.output:
+            return run_main(args)
+        with redirect_stdout(sys.stderr):
+            return run_main(args)
+    finally:
+        RESULTS_WRITER.close()
+        RESULTS_WRITER = None
+        if args.output:
+            out.close()
+
+
+def run_main(args):
+    """Run the checks asked for in args, printing out results"""
     print("Checking against", len(ALL_RULES), "rules")
 
+    if args.stream:
+        check_stream(args)
+        return 0
+
+    if args.since is not None:
+        check_since(args)
+        return 0
+
     cache_filename = "checker_cache.json"
-    cached_results = read_results_from_cache(cache_filename, args.input)
+    cache_key = make_cache_key(args.doComments)
 
-    files_dict = extract_input_files(args.input)
-    root_results = check_root_file(files_dict['root'])
-    content_results = check_content_files(files_dict['contents'], args.doComments)
-    # bib_results = check_bib_files(files_dict['bib'])
+    if args.batch:
+        run_batch_checks(args, cache_filename, cache_key)
+        return 0
 
-    root_results.update(content_results)
-    print_final_summary(root_results, cached_results)
+    file_cache = read_files_from_cache(cache_filename, cache_key)
 
-    # write results to cache file
-    write_results_to_cache(root_results, cache_filename, args.input)
+    if args.watch:
+        try:
+            watch(args, cache_filename, file_cache, cache_key)
+        except KeyboardInterrupt:
+            pass
+    else:
+        run_checks(args, cache_filename, file_cache, cache_key)
 
     return 0
 
@@ -0,0 +1,211 @@
+"""Save the analysed rule set to disk, so later runs can load it instead of rebuilding it.
+
+The bundle is a JSON file with each rule's description, pattern, flags & locations,
+along with everything RuleSet works out from them. It is keyed by the package
+version, the python version & a hash of the source of the rule modules (and the code
+that analyses them), so it is rebuilt automatically whenever the rules change.
+Only the MAX_BUNDLES most recently saved bundles are kept, so installs sharing
+a cache directory don't remove each other's bundles.
+Loading a bundle doesn't import the rule modules, and each pattern is only
+compiled when it is first used.
+"""
+
+
+import os
+import re
+import sys
+import json
+import hashlib
+from collections import OrderedDict
+
+from cmspubstyle import __version__
+from cmspubstyle.rules.classes import Rule, ALL, ENVIRONMENT, INLINE, COMMAND
+
+
+BUNDLE_VERSION = 1
+
+# most bundles to keep in the directory, e.g. for different installs or python versions
+MAX_BUNDLES = 5
+
+RULES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# sources that define the rules, or what is worked out from them
+SOURCE_FILES = ["normal_text.py", "latex.py", "classes.py", "engine.py", "bundle.py"]
+
+LOCATIONS = OrderedDict((cls.__name__, cls) for cls in [ALL, ENVIRONMENT, INLINE, COMMAND])
+
+
+class LazyRule(Rule):
+    """Rule whose pattern is only compiled when first used"""
+
+    def __init__(self, description, pattern, flags, where):
+        self.description = description
+        self.pattern = pattern
+        self.flags = flags
+        self.where = where
+        self._re_pattern = None
+
+    @property
+    def re_pattern(self):
+        """Compiled pattern, made on first use"""
+        if self._re_pattern is None:
+            self._re_pattern = re.compile(self.pattern, self.flags)
+        return self._re_pattern
+
+    def __repr__(self):
+        return "Rule(" + str(self.re_pattern) + ")"
+
+
+def sources_hash():
+    """Hash of the source files of the rules"""
+    source_hash = hashlib.sha1()
+    for filename in SOURCE_FILES:
+        with open(os.path.join(RULES_DIR, filename), 'rb') as f:
+            source_hash.update(f.read())
+    return source_hash.hexdigest()
+
+
+def bundle_key():
+    """Key for the current rules, that changes if the package, python or any rule is changed"""
+    return "%s-py%d.%d-%s" % (__version__, sys.version_info[0], sys.version_info[1],
+                              sources_hash())
+
+
+def bundle_directory():
+    """Directory to keep bundles in: $CMSPUBSTYLE_CACHE_DIR, or cmspubstyle in the user cache"""
+    directory = os.environ.get("CMSPUBSTYLE_CACHE_DIR")
+    if directory:
+        return directory
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"),
+                                                                   ".cache")
+    return os.path.join(cache_home, "cmspubstyle")
+
+
+def bundle_filename(directory, key):
+    """Get filename of the bundle for key in directory"""
+    return os.path.join(directory, "rules-%s.json" % key)
+
+
+def remove_old_bundles(directory, keep=MAX_BUNDLES):
+    """Remove all but the keep most recently saved bundles in directory"""
+    bundles = []
+    for filename in os.listdir(directory):
+        if filename.startswith("rules-") and filename.endswith(".json"):
+            filename = os.path.join(directory, filename)
+            try:
+                bundles.append((os.path.getmtime(filename), filename))
+            except OSError:
+                # removed by another process
+                pass
+    for _, filename in sorted(bundles, reverse=True)[keep:]:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def save_where(where):
+    """Convert a rule's Location, or list of Locations, to a JSON-friendly list"""
+    locations = where if isinstance(where, list) else [where]
+    return [isinstance(where, list)] + [[loc.__class__.__name__, loc.opt] for loc in locations]
+
+
+def load_where(saved_where):
+    """Convert output of save_where() back into Location(s)"""
+    is_list, locations = saved_where[0], [LOCATIONS[name](opt) for name, opt in saved_where[1:]]
+    return locations if is_list else locations[0]
+
+
+def save_bundle(rule_set, filename, key):
+    """Save rules in a RuleSet, and what it has worked out from them, to filename"""
+    entries = []
+    for rule in rule_set.rules:
+        literals = rule_set.required_literals.get(rule)
+        first_chars = rule_set.first_chars.get(rule)
+        entries.append([
+            rule.description,
+            rule.re_pattern.pattern,
+            rule.re_pattern.flags,
+            save_where(rule.where),
+            None if literals is None else [list(literals[0]), literals[1]],
+            # False for rules not searched everywhere, which don't have first chars
+            False if rule not in rule_set.first_chars else
+            (None if first_chars is None else ''.join(sorted(first_chars))),
+        ])
+    bundle = OrderedDict([
+        ('version', BUNDLE_VERSION),
+        ('key', key),
+        ('fingerprint', rule_set.fingerprint()),
+        ('rules', entries),
+    ])
+    # write to a temporary file first, so other processes never see half a bundle
+    tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+        json.dump(bundle, f)
+    os.replace(tmp_filename, filename)
+
+
+def load_bundle(filename, key):
+    """Load a RuleSet from a bundle in filename.
+
+    Returns None if there is no such bundle, or it isn't for key.
+    """
+    # import here to avoid a circular import
+    from cmspubstyle.rules.engine import RuleSet
+
+    try:
+        with open(filename) as f:
+            bundle = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if bundle.get('version') != BUNDLE_VERSION or bundle.get('key') != key:
+        return None
+
+    rules, required_literals, first_chars = [], {}, {}
+    for description, pattern, flags, where, literals, chars in bundle['rules']:
+        rule = LazyRule(description, pattern, flags, load_where(where))
+        rules.append(rule)
+        if literals is not None:
+            required_literals[rule] = (tuple(literals[0]), literals[1])
+        if chars is not False:
+            first_chars[rule] = None if chars is None else set(chars)
+    return RuleSet(rules, required_literals, first_chars, bundle['fingerprint'])
+
+
+def build_rule_set():
+    """Make a RuleSet from the rule modules"""
+    from cmspubstyle.rules import normal_text
+    from cmspubstyle.rules import latex
+    from cmspubstyle.rules.engine import RuleSet
+    return RuleSet(normal_text.RULES + latex.RULES)
+
+
+def load_rule_set(directory=None):
+    """Get RuleSet for all the rules, from a bundle in directory if possible.
+
+    Otherwise the RuleSet is made from the rule modules, and saved as a bundle
+    for next time, removing the oldest ones (see remove_old_bundles()). If the bundle can't be saved,
+    e.g. if the directory isn't writeable, the rules still work as normal.
+    directory defaults to bundle_directory().
+    """
+    if directory is None:
+        directory = bundle_directory()
+    try:
+        key = bundle_key()
+    except (IOError, OSError):
+        # sources not available, e.g. only .pyc files installed
+        return build_rule_set()
+    filename = bundle_filename(directory, key)
+    rule_set = load_bundle(filename, key)
+    if rule_set is not None:
+        return rule_set
+
+    rule_set = build_rule_set()
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        save_bundle(rule_set, filename, key)
+        remove_old_bundles(directory)
+    except (IOError, OSError):
+        pass
+    return rule_set
@@ -2,9 +2,13 @@
 
 
 import re
+from array import array
 from bisect import bisect_left, bisect_right
 from collections import namedtuple
 
+from cmspubstyle.rules import regions
+from cmspubstyle.rules.regions import RegionTree, SpanIndex
+
 
 def find_ge(sequence, item):
     'Find leftmost item greater than or equal to item'
@@ -27,151 +31,299 @@ def cleanup_tex_line(text):
     return text
 
 
+class LineStartsView(object):
+    """Start of each line of a Text that is a view into another, see Text.sub_text()
+
+    Behaves like a read-only list of the 0-indexed starts, relative to the view,
+    computed from the starts in the parent text. The first line is cut at the
+    start of the view.
+    """
+
+    __slots__ = ["_line_starts", "_first", "_num_lines", "_offset"]
+
+    def __init__(self, line_starts, first, num_lines, offset):
+        self._line_starts = line_starts
+        self._first = first
+        self._num_lines = num_lines
+        self._offset = offset
+
+    def __len__(self):
+        return self._num_lines
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return [self[i] for i in range(*ind.indices(self._num_lines))]
+        if ind < 0:
+            ind += self._num_lines
+        if not 0 <= ind < self._num_lines:
+            raise IndexError("line index out of range")
+        return max(self._line_starts[self._first + ind] - self._offset, 0)
+
+
 class Text(object):
-    """Class to aid storage & finding in lines of latex"""
+    """Class to aid storage & finding in lines of latex
+
+    All the lines are stored as one str, text_as_one_line, with arrays of the
+    start of each line in it & its line number. TextLines are only made when asked for.
+    Texts for parts of another Text (see sub_text()) are views that share the arrays
+    of the original, and only copy their part of the str when it is first used.
+    """
+
+    __slots__ = ["_base", "_offset", "_end", "_first_line", "_num_lines", "_text",
+                 "_base_line_starts", "_base_line_nums", "line_starts",
+                 "_lower_text", "_regions", "_comments", "_masked", "_location_texts"]
 
     def __init__(self, text, line_num_start=1):
-        self.text_contents = []
-        self.text_as_one_line = ""
-        
+        # Text whose str & arrays this one uses, and where this one starts & ends in it
+        self._base = self
+        self._offset = 0
+        self._end = 0
+        self._first_line = 0
+        self._text = ""
+        # 0-indexed start of each line in the base text, and its line number
+        self._base_line_starts = array('l')
+        self._base_line_nums = array('l')
+        self._reset()
+
         if text:
+            lines = []
             # Creation from list of str
             if isinstance(text[0], str):
                 for ind, line in enumerate(text, line_num_start):
                     # don't include the newline (which python counts as 1 char) since
                     # we remove it when searching, and it would screw up looking for
                     # relevant line(s)
-                    char_num_start = sum([len(l.text) for l in self.text_contents]) + 1
                     this_line = line
                     this_line = cleanup_tex_line(this_line)
                     if (len(text) >= 2 and ind < (len(text)+line_num_start-1)
                             and (text[ind-line_num_start+1].rstrip() != "")):
                         this_line += " "  # latex auto adds a space. but only if text on next line
-                    this_tl = TextLine(line_num=ind,
-                                       char_num_start=char_num_start,
-                                       text=this_line)
-                    self.text_contents.append(this_tl)
+                    lines.append(this_line)
+                    self._base_line_nums.append(ind)
             # Creation from list of TextLine e.g. from output of another Text
             elif isinstance(text[0], TextLine):
                 for line in text:
-                    # reset char_num_start
-                    char_num_start = 1 + sum([len(l.text.rstrip('\n'))
-                                              for l in self.text_contents])
-                    this_textline = TextLine(line_num=line.line_num,
-                                             char_num_start=char_num_start,
-                                             text=line.text)
-                    self.text_contents.append(this_textline)
+                    lines.append(line.text.rstrip('\n'))
+                    self._base_line_nums.append(line.line_num)
             else:
                 raise RuntimeError("Unknown type %s for text arg for Text class "
                                    "- should be list[str] or list[TextLine]" % type(text[0]))
 
-            self.create_one_str_from_contents()
-
-    def create_one_str_from_contents(self):
-        """Store text as one long line to make searching across lines easier"""
-        self.text_as_one_line = ''.join([x.text.rstrip("\n") for x in self.text_contents])
+            # running total of characters so far, so we only make one pass
+            char_num = 0
+            for line in lines:
+                self._base_line_starts.append(char_num)
+                char_num += len(line)
+            # Store text as one long line to make searching across lines easier
+            self._text = ''.join(lines)
+            self._end = len(self._text)
+
+        self._num_lines = len(self._base_line_nums)
+        self.line_starts = self._base_line_starts
+
+    def _reset(self):
+        """Forget everything made on demand"""
+        # lower case version of text_as_one_line, made on demand by contains_any()
+        self._lower_text = None
+        # RegionTree, made on demand
+        self._regions = None
+        # SpanIndex of comments, made on demand
+        self._comments = None
+        # (SpanIndex, text_as_one_line with its spans blanked out), made on demand by masked_text()
+        self._masked = None
+        # Location -> list of Texts inside it, made on demand by iter_location()
+        self._location_texts = None
+
+    @property
+    def text_as_one_line(self):
+        """All the text as one str, to make searching across lines easier"""
+        if self._text is None:
+            # a view, so copy our part of the base text on first use
+            self._text = self._base.text_as_one_line[self._offset:self._end]
+        return self._text
+
+    @property
+    def offset(self):
+        """Position of the start of this text in the Text it is a view of (0 if not a view)"""
+        return self._offset
+
+    @property
+    def num_lines(self):
+        """Number of lines in the text"""
+        return self._num_lines
+
+    def get_line(self, ind):
+        """Make TextLine for the line with index ind"""
+        start = self.line_starts[ind]
+        end = self.line_starts[ind+1] if ind + 1 < self._num_lines else self._end - self._offset
+        return TextLine(line_num=self._base_line_nums[self._first_line + ind],
+                        char_num_start=start + 1,
+                        text=self.text_as_one_line[start:end])
+
+    @property
+    def text_contents(self):
+        """List of TextLine for every line, made each time it is used"""
+        return [self.get_line(ind) for ind in range(self._num_lines)]
+
+    @property
+    def char_num_starts(self):
+        """List of char_num_start of each line, i.e. the 1-indexed line starts"""
+        return [x + 1 for x in self.line_starts]
+
+    def contains_any(self, substrings, ignore_case=False):
+        """Check if any of substrings is in the text, as a cheap check before a regex search.
+
+        If ignore_case, substrings must already be lower case.
+        Non-ASCII text then always gives True, since re's case-insensitive
+        matching doesn't exactly follow str.lower()
+        """
+        if not ignore_case:
+            return any(x in self.text_as_one_line for x in substrings)
+        if self._lower_text is None:
+            if self.text_as_one_line.isascii():
+                self._lower_text = self.text_as_one_line.lower()
+            else:
+                self._lower_text = False
+        if self._lower_text is False:
+            return True
+        return any(x in self._lower_text for x in substrings)
 
     def find_line_with_char_num(self, char_num):
         """Select relevant line, based on which characters are involved"""
-        # TODO: use bisect?
-        for ind, line in enumerate(self.text_contents):
-            if (line.char_num_start <= char_num and
-                    (ind == len(self.text_contents)-1 or
-                     self.text_contents[ind+1].char_num_start > char_num)):
-                return line
+        # last line starting at or before char_num
+        # (empty lines share a char_num_start with the following line)
+        ind = bisect_right(self.line_starts, char_num - 1) - 1
+        if ind < 0:
+            return None
+        return self.get_line(ind)
 
     def find_lines_with_char_num_range(self, char_num_start, char_num_end):
         """Select lines based on range of character numbers"""
-        char_num_starts = [x.char_num_start for x in self.text_contents]
-        start_ind = bisect_right(char_num_starts, char_num_start)-1
-        end_ind = bisect_left(char_num_starts, char_num_end)
-        lines = self.text_contents[start_ind: end_ind]
-        return lines
+        start_ind = bisect_right(self.line_starts, char_num_start - 1) - 1
+        # always include the starting line, e.g. for a 1-char match at the very start
+        end_ind = max(bisect_left(self.line_starts, char_num_end - 1), start_ind+1)
+        return [self.get_line(ind) for ind in range(max(start_ind, 0), end_ind)]
+
+    @property
+    def regions(self):
+        """RegionTree of commands, environments, maths & comments, made on first use"""
+        if self._regions is None:
+            self._regions = RegionTree(self.text_as_one_line, self.line_starts)
+        return self._regions
+
+    @property
+    def comments(self):
+        """SpanIndex of comments, from the % to the end of the line, made on first use.
+
+        Escaped \\% don't start a comment.
+        """
+        if self._comments is None:
+            if "%" not in self.text_as_one_line:
+                self._comments = SpanIndex([])
+            else:
+                self._comments = SpanIndex([(r.start, r.end)
+                                            for r in self.regions.find(regions.COMMENT)])
+        return self._comments
+
+    def sub_text(self, start, end):
+        """Make a new Text from the part of text_as_one_line in [start, end) (0-indexed)
+
+        Lines are chopped as needed, and keep their line numbers.
+        The new Text is a view into the same str & arrays as this one.
+        """
+        first_ind = max(bisect_right(self.line_starts, start) - 1, 0)
+        last_ind = max(bisect_right(self.line_starts, end - 1) - 1, first_ind)
+        if not self._num_lines:
+            return Text([])
+
+        view = Text.__new__(Text)
+        view._base = self._base
+        view._offset = self._offset + start
+        view._end = self._offset + end
+        view._first_line = self._first_line + first_ind
+        view._num_lines = last_ind - first_ind + 1
+        view._base_line_starts = self._base_line_starts
+        view._base_line_nums = self._base_line_nums
+        view._text = None
+        view.line_starts = LineStartsView(view._base_line_starts, view._first_line,
+                                          view._num_lines, view._offset)
+        view._reset()
+        return view
 
     def iter_environment(self, environment):
-        r"""Return contents of environments, i.e. \begin{<environment>}...\end{<environment>}
+        r"""Iterate over contents of environments, i.e. \begin{<environment>}...\end{<environment>}
 
-        Returns list of TextLine for each occurence of \begin{<environment>}...\end{<environment>}
+        Returns Text for each occurence of \begin{<environment>}...\end{<environment>}.
+        If the \begin or \end are on their own lines, those lines are not included.
         """
-        start_env = "\\begin{"+environment
-        end_env = "\\end{"+environment
-        if start_env not in self.text_as_one_line:
-            yield None
-            return
-        # FIXME: this assumes everything on own lines,
-        # no pre/post extra bits we dont want - issue?
-        start_ind, end_ind = None, None
-        for ind, line in enumerate(self.text_contents):
-            if start_env in line.text:
-                start_ind = ind
-            if end_env in line.text:
-                end_ind = ind
-                if not (start_ind and end_ind):
-                    raise RuntimeError("Found end of environment but not beginning: %s" % line)
-                these_lines = self.text_contents[start_ind+1:end_ind]
-                start_ind, end_ind = None, None
-                yield Text(these_lines)
+        for region in self.regions.find(regions.ENVIRONMENT, environment):
+            yield self.sub_text(region.content_start, region.content_end)
 
     def iter_inline_delim(self, delim="$"):
         """Iterate over text inside matching delim, e.g. $...$
 
-        Returns TextLine for each occurence of <delim>...<delim>
+        Returns Text for each occurence of <delim>...<delim>
         """
-        matches = list(re.finditer("\\" + delim, self.text_as_one_line))
-        # print(matches)
-        for match1, match2 in zip(matches[:-1:2], matches[1::2]):
-            # Assumes all contents on one TextLine!
-            line = self.find_line_with_char_num(match1.start()+1)
-            # line2 = self.find_line_with_char_num(m2.end())
-            # if l2.line_num != l.line_num:
-            #     raise RuntimeError("Your inline maths spans 2 lines "
-            #                        "- I don't knos how to handle that")
-            this_text = self.text_as_one_line[match1.start()+1: match2.start()]
-            # FIXME: what should char_num_start be doing?
-            new_line = TextLine(line_num=line.line_num,
-                                char_num_start=match1.start()+1,
-                                text=this_text)
-            yield Text([new_line])
+        for region in self.regions.find(regions.MATH, delim):
+            yield self.sub_text(region.content_start, region.content_end)
 
     def iter_command(self, command):
         """Iterate over sections of text inside a \<command>{...}
 
-        Returns list of TextLine for each occurence of \<command>
+        Returns Text for each occurence of \<command>
+        """
+        for region in self.regions.find(regions.COMMAND, command.lstrip("\\")):
+            yield self.sub_text(region.content_start, region.content_end)
+
+    def iter_location(self, location):
+        """Iterate over Texts for each part of this text inside a Location.
+
+        Nested parts (e.g. an environment inside another of the same name) are only
+        included once, as part of the outer one.
+        The Texts are made the first time a Location is used, then reused
+        for any Location that is equal to it, e.g. by other rules.
+        """
+        if location.region_kind is None:
+            return iter([self])
+        if self._location_texts is None:
+            self._location_texts = {}
+        if location not in self._location_texts:
+            span_index = self.regions.span_index(location.region_kind, location.region_name)
+            self._location_texts[location] = [self.sub_text(start, end)
+                                              for start, end in span_index]
+        return iter(self._location_texts[location])
+
+    def masked_text(self, skip=None):
+        """Get text_as_one_line to search, with any parts in the SpanIndex skip
+        (e.g. comments) replaced by spaces, so everything else stays in the same place.
+
+        The whole text is searched in one go, so anchors like ^ & $ still mean
+        the start & end of the text.
         """
-        stack = []
-
-        for match in re.finditer(r"\\"+command.lstrip("\\")+"{", self.text_as_one_line):
-            # Use stack method to look for matching closing bracket
-            # - could be more {} inside
-            stack.append(match.end()-1)
-            for char_ind, char in enumerate(self.text_as_one_line[match.end():], match.end()):
-                if char == "{":
-                    stack.append(char_ind)
-                elif char == "}":
-                    if len(stack) == 1:
-                        start, end = stack.pop()+1, char_ind
-                        # Handle the relevant line(s), chopping the text appropriately
-                        these_lines = self.find_lines_with_char_num_range(start, end-1)
-
-                        first_line_char_num = these_lines[0].char_num_start
-                        offset_start = start - first_line_char_num + 1
-                        these_lines[0] = TextLine(line_num=these_lines[0].line_num,
-                                                  char_num_start=start+1,
-                                                  text=these_lines[0].text[offset_start:])
-
-                        last_line_char_num = these_lines[-1].char_num_start
-                        offset_end = end - last_line_char_num + 1
-                        these_lines[-1] = TextLine(line_num=these_lines[-1].line_num,
-                                                   char_num_start=start,
-                                                   text=these_lines[-1].text[:offset_end])
-                        yield Text(these_lines)
-                        break
-                    else:
-                        stack.pop()
-
-    def find_iter(self, pattern):
-        """Iterate over search results"""
-        for match in pattern.finditer(self.text_as_one_line):
+        if skip is None or not len(skip):
+            return self.text_as_one_line
+        if self._masked is None or self._masked[0] is not skip:
+            contents = self.text_as_one_line
+            parts = []
+            last_end = 0
+            for start, end in skip:
+                parts.append(contents[last_end:start])
+                parts.append(" " * (end - start))
+                last_end = end
+            parts.append(contents[last_end:])
+            self._masked = (skip, ''.join(parts))
+        return self._masked[1]
+
+    def find_iter(self, pattern, skip=None):
+        """Iterate over search results
+
+        Parts of the text in the SpanIndex skip (e.g. comments) are blanked out
+        before searching, see masked_text().
+        """
+        matches = pattern.finditer(self.masked_text(skip))
+        if skip is not None and len(skip):
+            matches = (match for match in matches if not skip.covers(*match.span()))
+        for match in matches:
             # TODO what if >1 group?
             # matching_text = m.groups()
 
@@ -183,9 +335,18 @@ class Text(object):
 
 class Location(object):
     """Abstract base class for any section/type of text to be searched"""
+
+    # kind of Region in a RegionTree this location corresponds to, None for everywhere
+    region_kind = None
+
     def __init__(self, opt=None):
         self.opt = opt  # generic option arg?
 
+    @property
+    def region_name(self):
+        """Name of the Region in a RegionTree this location corresponds to"""
+        return self.opt
+
     def __hash__(self):
         return hash(self.opt)
 
@@ -218,21 +379,34 @@ class ALL(Location):
 
 class ENVIRONMENT(Location):
     """Only text within an environment e.g. \\begin{table}...\\end{table}"""
+
+    region_kind = regions.ENVIRONMENT
+
     def __init__(self, *args, **kwargs):
         super(ENVIRONMENT, self).__init__(*args, **kwargs)
 
 
 class INLINE(Location):
     """Only text within an inline environment e.g. $...$"""
+
+    region_kind = regions.MATH
+
     def __init__(self, *args, **kwargs):
         super(INLINE, self).__init__(*args, **kwargs)
 
 
 class COMMAND(Location):
     """Only text within a command e.g. \\text{...}"""
+
+    region_kind = regions.COMMAND
+
     def __init__(self, *args, **kwargs):
         super(COMMAND, self).__init__(*args, **kwargs)
 
+    @property
+    def region_name(self):
+        return self.opt.lstrip("\\")
+
 
 # TODO: make this a namedtuple if only storing data fields?
 class Rule(object):
@@ -247,16 +421,27 @@ class Rule(object):
 
 
 class TestRule(object):
-    """Class to define a test for a Rule, and whether it should pass or not"""
+    """Class to define a test for a Rule, and whether it should pass or not
+
+    The Text is only made when first used, so importing the rules stays cheap.
+    """
 
     def __init__(self, rule, text, should_pass=False):
         self.rule = rule
-        if isinstance(text, str):
-            self.text = Text([text])
-        else:
-            self.text = Text(text)
+        self.raw_text = text
+        self._text = None
         self.should_pass = should_pass
 
+    @property
+    def text(self):
+        """Text to test the rule on, made on first use"""
+        if self._text is None:
+            if isinstance(self.raw_text, str):
+                self._text = Text([self.raw_text])
+            else:
+                self._text = Text(self.raw_text)
+        return self._text
+
     def _to_str(self):
         """Common method to make str representation of classe for __str/repr__"""
         str_args = {
@@ -277,5 +462,50 @@ class TestRule(object):
     #     return result
 
 
+class SavedMatch(object):
+    """Stand-in for a re match object, that only keeps the matched text & position.
+
+    Unlike re match objects, this can be pickled, e.g. to pass between processes.
+    """
+
+    def __init__(self, start, end, text):
+        self._start = start
+        self._end = end
+        self._text = text
+
+    @classmethod
+    def from_match(cls, match):
+        """Create from a re match object (or another SavedMatch)"""
+        return cls(match.start(), match.end(), match.group(0))
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._end
+
+    def span(self):
+        return (self._start, self._end)
+
+    def group(self, index=0):
+        if index != 0:
+            raise IndexError("SavedMatch only stores the whole match, group 0")
+        return self._text
+
+    def __eq__(self, other):
+        return (isinstance(other, SavedMatch) and
+                (self._start, self._end, self._text) == (other._start, other._end, other._text))
+
+    def __ne__(self, other):
+        """Overrides the default implementation (unnecessary in Python 3)"""
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self._start, self._end, self._text))
+
+    def __repr__(self):
+        return "SavedMatch(span=%s, match=%r)" % (self.span(), self._text)
+
+
 # Handle a specific case of a rule being broken, the pure regex result, and the offending line(s)
 RuleBroken = namedtuple("RuleBroken", ["rule", "match", "lines"])
@@ -0,0 +1,486 @@
+"""Engine to scan a Text for many Rules at once"""
+
+
+import re
+import sys
+import heapq
+import hashlib
+from collections import OrderedDict
+
+try:
+    # python >= 3.11
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+from cmspubstyle.rules.classes import ALL
+from cmspubstyle.rules.watchdog import RuleTimedOut
+from cmspubstyle.profiling import timer
+
+
+# if a character range in a pattern is bigger than this, treat it as "any character"
+MAX_RANGE_SIZE = 64
+
+# how many combined patterns (one per set of active rules) to keep compiled,
+# least recently used first out, so long --stream/--watch/--lsp runs don't grow
+MAX_COMPILED = 8
+
+# zero-width opcodes that can be skipped when looking for the first character
+ZERO_WIDTH_OPS = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+
+
+class UnknownFirstChar(Exception):
+    """Raised when the first character a pattern consumes can't be determined"""
+    pass
+
+
+# str of every character that has a different lower or upper case, made on demand
+CASED_CHARS = None
+
+# char -> set of chars re treats as the same when ignoring case
+_CASE_EQUIVALENTS = {}
+
+
+def case_equivalents(char):
+    """Get set of characters that re treats as the same as char when ignoring case.
+
+    As well as upper & lower case, this includes e.g. the Kelvin sign for k,
+    and long s for s, so re itself is asked.
+    """
+    global CASED_CHARS
+    if char not in _CASE_EQUIVALENTS:
+        if CASED_CHARS is None:
+            CASED_CHARS = ''.join(c for c in map(chr, range(sys.maxunicode + 1))
+                                  if c.lower() != c or c.upper() != c)
+        equivalents = set(re.findall("(?i)" + re.escape(char), CASED_CHARS))
+        equivalents.add(char)
+        _CASE_EQUIVALENTS[char] = equivalents
+    return _CASE_EQUIVALENTS[char]
+
+
+def subpattern_ignore_case(arg, ignore_case):
+    """Get whether the contents of a SUBPATTERN ignore case, given whether outside it does"""
+    # arg is (group, add_flags, del_flags, items)
+    if len(arg) == 4:
+        if arg[1] & sre_constants.SRE_FLAG_IGNORECASE:
+            return True
+        if arg[2] & sre_constants.SRE_FLAG_IGNORECASE:
+            return False
+    return ignore_case
+
+
+def first_chars(items, ignore_case=False):
+    """Find the set of characters a parsed regex can start consuming with.
+
+    If ignore_case, every character re treats as the same is included.
+    Returns (set of str, bool of whether the items can match the empty string).
+    Raises UnknownFirstChar if the first char could be (almost) anything.
+    """
+    chars = set()
+
+    def add(char):
+        if ignore_case:
+            chars.update(case_equivalents(char))
+        else:
+            chars.add(char)
+
+    for opcode, arg in items:
+        if opcode is sre_constants.LITERAL:
+            add(chr(arg))
+            return chars, False
+        elif opcode is sre_constants.IN:
+            for in_opcode, in_arg in arg:
+                if in_opcode is sre_constants.LITERAL:
+                    add(chr(in_arg))
+                elif in_opcode is sre_constants.RANGE and in_arg[1] - in_arg[0] < MAX_RANGE_SIZE:
+                    for c in range(in_arg[0], in_arg[1]+1):
+                        add(chr(c))
+                else:
+                    raise UnknownFirstChar()
+            return chars, False
+        elif opcode in ZERO_WIDTH_OPS:
+            continue
+        elif opcode is sre_constants.SUBPATTERN:
+            sub_chars, can_be_empty = first_chars(arg[-1], subpattern_ignore_case(arg, ignore_case))
+            chars.update(sub_chars)
+            if not can_be_empty:
+                return chars, False
+        elif opcode is sre_constants.BRANCH:
+            any_empty = False
+            for branch in arg[1]:
+                sub_chars, can_be_empty = first_chars(branch, ignore_case)
+                chars.update(sub_chars)
+                any_empty = any_empty or can_be_empty
+            if not any_empty:
+                return chars, False
+        elif opcode in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            min_repeat, _, sub_items = arg
+            sub_chars, can_be_empty = first_chars(sub_items, ignore_case)
+            chars.update(sub_chars)
+            if min_repeat > 0 and not can_be_empty:
+                return chars, False
+        else:
+            raise UnknownFirstChar()
+    return chars, True
+
+
+def pattern_first_chars(pattern):
+    """Get set of possible first characters for a compiled pattern, or None if unknown.
+
+    Patterns that can match the empty string also give None, since those need
+    the special empty-match handling of re.finditer.
+    """
+    try:
+        chars, can_be_empty = first_chars(sre_parse.parse(pattern.pattern, pattern.flags),
+                                          bool(pattern.flags & re.IGNORECASE))
+    except (UnknownFirstChar, TypeError, ValueError):
+        return None
+    if can_be_empty or not chars:
+        return None
+    return chars
+
+
+def literal_runs(items, ignore_case=False, inside_ignore_case=None):
+    """Find literal strings that any match of parsed regex items must contain.
+
+    ignore_case is whether the whole pattern ignores case, and inside_ignore_case
+    whether these items do (if different, e.g. inside a (?i:...) group).
+    Literals where these differ can't be checked the same way as the rest,
+    so are left out.
+    Returns list of tuples of str. Each tuple is a set of alternatives,
+    at least one of which must be present in every match.
+    """
+    if inside_ignore_case is None:
+        inside_ignore_case = ignore_case
+    runs = []
+    current = []
+    # (opcode, arg, whether it ignores case)
+    items = [(opcode, arg, inside_ignore_case) for opcode, arg in items]
+    while items:
+        opcode, arg, this_ignore_case = items.pop(0)
+        if opcode is sre_constants.LITERAL and this_ignore_case == ignore_case:
+            current.append(chr(arg))
+            continue
+        elif opcode in ZERO_WIDTH_OPS:
+            # doesn't consume anything, so the literal run carries on
+            continue
+        elif opcode is sre_constants.SUBPATTERN:
+            # treat contents as if they were inline
+            sub_ignore_case = subpattern_ignore_case(arg, this_ignore_case)
+            items = [(sub_opcode, sub_arg, sub_ignore_case)
+                     for sub_opcode, sub_arg in arg[-1]] + items
+            continue
+
+        if current:
+            runs.append((''.join(current),))
+            current = []
+
+        if opcode is sre_constants.BRANCH:
+            alternatives = []
+            for branch in arg[1]:
+                branch_runs = literal_runs(branch, ignore_case, this_ignore_case)
+                if not branch_runs:
+                    alternatives = None
+                    break
+                alternatives.extend(best_literal_run(branch_runs))
+            if alternatives:
+                runs.append(tuple(alternatives))
+        elif opcode in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            min_repeat, _, sub_items = arg
+            if min_repeat > 0:
+                runs.extend(literal_runs(sub_items, ignore_case, this_ignore_case))
+
+    if current:
+        runs.append((''.join(current),))
+    return runs
+
+
+def best_literal_run(runs):
+    """Pick the most selective run: the one with the longest shortest alternative"""
+    return max(runs, key=lambda run: (min(len(x) for x in run), -len(run)))
+
+
+def pattern_required_literals(pattern):
+    """Get tuple of literals, at least one of which must be in any match of pattern.
+
+    Returns None if no such literals could be found.
+    For case-insensitive patterns the literals are lower case.
+    """
+    try:
+        runs = literal_runs(sre_parse.parse(pattern.pattern, pattern.flags),
+                            bool(pattern.flags & re.IGNORECASE))
+    except (TypeError, ValueError):
+        return None
+    if not runs:
+        return None
+    literals = best_literal_run(runs)
+    if pattern.flags & re.IGNORECASE:
+        if not all(x.isascii() for x in literals):
+            # can't reliably replicate re's case-insensitive matching
+            return None
+        literals = tuple(x.lower() for x in literals)
+    return literals
+
+
+def can_combine(pattern):
+    """Check if a pattern can be embedded inside a bigger combined pattern"""
+    # group references & names would clash with those of other patterns
+    if pattern.groupindex or re.search(r"\\[1-9]|\(\?P=", pattern.pattern):
+        return False
+    # only the ignorecase flag can be applied to a sub-pattern
+    other_flags = pattern.flags & ~(re.IGNORECASE | re.UNICODE)
+    if other_flags != 0 or not isinstance(pattern.pattern, str):
+        return False
+    # e.g. inline global flags like (?i) can't be inside a group
+    try:
+        re.compile("(?:" + pattern.pattern + ")")
+    except re.error:
+        return False
+    return True
+
+
+class RuleSet(object):
+    """Compiled set of Rules, that scans a Text for all ALL() rules in one pass.
+
+    Rules are grouped by the first character they can match. One combined
+    pattern then looks for positions where any rule could start, dispatching on
+    that character, and each candidate position is confirmed with the rule's own
+    pattern. Rules that can't be grouped this way are scanned individually.
+
+    Before scanning, rules whose required literal text (e.g. "i.e." or "\\frac")
+    isn't in the Text are skipped altogether. num_scans and num_skipped count
+    the rule x Text checks done by may_match().
+
+    If profile is set to a Profile, the time taken by each regex call is added to it.
+    If watchdog is set to a Watchdog, rules that take too long on a Text are stopped.
+    If the combined scan itself takes too long, the rest of the Text is scanned
+    for each rule individually.
+
+    The results of analysing the patterns (required_literals, first_chars &
+    fingerprint, see below) can be given if already known, e.g. from a saved
+    bundle, otherwise they are worked out from the rules.
+    """
+
+    def __init__(self, rules, required_literals=None, first_chars=None, fingerprint=None):
+        self.rules = list(rules)
+        self.all_rules = [rule for rule in self.rules
+                          if any(isinstance(loc, ALL) for loc in self._locations(rule))]
+        # rule -> (tuple of literals, ignore case), at least one literal must be present
+        self.required_literals = required_literals
+        if self.required_literals is None:
+            self.required_literals = {}
+            for rule in self.rules:
+                literals = pattern_required_literals(rule.re_pattern)
+                if literals:
+                    self.required_literals[rule] = (literals,
+                                                    bool(rule.re_pattern.flags & re.IGNORECASE))
+        # rule -> set of possible first chars, None if it has to be scanned individually
+        self.first_chars = first_chars
+        if self.first_chars is None:
+            self.first_chars = {}
+            for rule in self.all_rules:
+                if can_combine(rule.re_pattern):
+                    self.first_chars[rule] = pattern_first_chars(rule.re_pattern)
+                else:
+                    self.first_chars[rule] = None
+        self._fingerprint = fingerprint
+        self.individual_rules = [rule for rule in self.all_rules
+                                 if self.first_chars[rule] is None]
+        self._rule_index = {rule: ind for ind, rule in enumerate(self.all_rules)}
+        # cache of compiled (pattern, rules_by_char) for each set of active rules
+        self._compiled = OrderedDict()
+        self.profile = None
+        self.watchdog = None
+        self.reset_counts()
+
+    @staticmethod
+    def _locations(rule):
+        """Get list of Locations for a rule"""
+        return rule.where if isinstance(rule.where, list) else [rule.where]
+
+    @staticmethod
+    def _sub_pattern(pattern):
+        """Convert compiled pattern to str that can be embedded in a bigger pattern"""
+        if pattern.flags & re.IGNORECASE:
+            return "(?i:" + pattern.pattern + ")"
+        return "(?:" + pattern.pattern + ")"
+
+    def fingerprint(self):
+        """Hash of all rules, that changes if any rule is changed, added or removed"""
+        if self._fingerprint is None:
+            rules_hash = hashlib.sha1()
+            for rule in self.rules:
+                rules_hash.update(repr((rule.description, rule.re_pattern.pattern,
+                                        rule.re_pattern.flags, rule.where)).encode('utf-8'))
+            self._fingerprint = rules_hash.hexdigest()
+        return self._fingerprint
+
+    def reset_counts(self):
+        """Reset the counts of rule scans done/skipped"""
+        self.num_scans = 0
+        self.num_skipped = 0
+
+    def may_match(self, rule, text):
+        """Cheap check if rule could match anywhere in text, based on its required literals.
+
+        Rules without any required literals always give True.
+        """
+        self.num_scans += 1
+        if rule not in self.required_literals:
+            return True
+        literals, ignore_case = self.required_literals[rule]
+        if text.contains_any(literals, ignore_case):
+            return True
+        self.num_skipped += 1
+        return False
+
+    def _combined_pattern(self, rules):
+        """Get combined pattern & dict of {first char: [rules]} for the combinable rules.
+
+        Returns (None, {}) if there are no such rules.
+        """
+        rules = tuple(rule for rule in rules if self.first_chars[rule] is not None)
+        if rules in self._compiled:
+            self._compiled.move_to_end(rules)
+        else:
+            groups = OrderedDict()
+            rules_by_char = {}
+            for rule in rules:
+                chars = self.first_chars[rule]
+                groups.setdefault(''.join(sorted(chars)), []).append(rule)
+                for char in chars:
+                    rules_by_char.setdefault(char, []).append(rule)
+
+            pattern = None
+            if groups:
+                branches = []
+                for chars, group_rules in groups.items():
+                    alternatives = "|".join(["(?=" + self._sub_pattern(rule.re_pattern) + ")"
+                                             for rule in group_rules])
+                    branches.append("(?=[" + re.escape(chars) + "])(?:" + alternatives + ")")
+                pattern = re.compile("|".join(branches))
+            self._compiled[rules] = (pattern, rules_by_char)
+            if len(self._compiled) > MAX_COMPILED:
+                self._compiled.popitem(last=False)
+        return self._compiled[rules]
+
+    @property
+    def combined_pattern(self):
+        """Combined pattern for all the combinable ALL() rules"""
+        return self._combined_pattern(self.all_rules)[0]
+
+    def iter_matches(self, text, skip=None):
+        """Iterate over all matches for the ALL() rules in a Text, as they are found.
+
+        Yields (rule, match), ordered by match start. Matches with the same
+        start are in the same order as the rules.
+        Parts of the text in the SpanIndex skip (e.g. comments) are blanked out
+        before searching, see Text.masked_text().
+        """
+        active_rules = [rule for rule in self.all_rules if self.may_match(rule, text)]
+        contents = text.masked_text(skip)
+        spans = [(0, len(contents))]
+
+        # each source yields (match start, rule index, counter, rule, match)
+        sources = []
+        combined_pattern, rules_by_char = self._combined_pattern(active_rules)
+        if combined_pattern is not None:
+            sources.append(self._iter_combined(combined_pattern, rules_by_char,
+                                                contents, spans))
+        for rule in active_rules:
+            if self.first_chars[rule] is None:
+                sources.append(self._iter_individual(rule, contents, spans))
+
+        for _, _, _, rule, match in heapq.merge(*sources):
+            if skip is not None and skip.covers(*match.span()):
+                continue
+            yield rule, match
+
+    def _iter_individual(self, rule, contents, spans):
+        """Iterate over matches for a rule that is scanned on its own, in order of match start"""
+        rule_ind = self._rule_index[rule]
+        counter = 0
+        for start, end in spans:
+            matches = rule.re_pattern.finditer(contents, start, end)
+            if self.profile is not None:
+                matches = self.profile.iter_timed(rule, matches)
+            if self.watchdog is not None:
+                matches = self.watchdog.iter_calls(rule, matches)
+            for match in matches:
+                yield match.start(), rule_ind, counter, rule, match
+                counter += 1
+
+    def _iter_combined(self, combined_pattern, rules_by_char, contents, spans):
+        """Iterate over matches for rules in a combined pattern, in order of match start"""
+        # end of last match for each rule, since matches for one rule can't overlap
+        last_end = {}
+        counter = 0
+        profile, watchdog = self.profile, self.watchdog
+        for span_ind, (start, end) in enumerate(spans):
+            candidates = combined_pattern.finditer(contents, start, end)
+            if profile is not None:
+                # time finding the candidates, which can't be split between rules
+                candidates = profile.iter_timed(None, candidates)
+            if watchdog is not None:
+                candidates = watchdog.iter_calls(None, candidates)
+            pos = start - 1
+            for candidate in candidates:
+                pos = candidate.start()
+                for rule in rules_by_char[contents[pos]]:
+                    if pos < last_end.get(rule, 0):
+                        continue
+                    if profile is None and watchdog is None:
+                        match = rule.re_pattern.match(contents, pos, end)
+                    else:
+                        match = self._checked_match(rule, contents, pos, end)
+                    if match:
+                        last_end[rule] = match.end()
+                        yield pos, self._rule_index[rule], counter, rule, match
+                counter += 1
+
+            if watchdog is not None and watchdog.is_timed_out(None):
+                # carry on after the last candidate, with each rule on its own
+                rules = sorted(set(rule for these in rules_by_char.values() for rule in these),
+                               key=self._rule_index.get)
+                remaining = [(max(this_start, pos + 1), this_end)
+                             for this_start, this_end in spans[span_ind:]]
+                sources = [self._iter_individual(rule, contents,
+                                                 [(max(this_start, last_end.get(rule, 0)), this_end)
+                                                  for this_start, this_end in remaining])
+                           for rule in rules]
+                for item in heapq.merge(*sources):
+                    yield item
+                return
+
+    def _checked_match(self, rule, contents, pos, end):
+        """Match rule at pos, with profiling and/or time limits.
+
+        Returns None if the rule has timed out.
+        """
+        if self.watchdog is not None and self.watchdog.is_timed_out(rule):
+            return None
+        match_start = timer()
+        try:
+            if self.watchdog is not None:
+                match = self.watchdog.call(rule, rule.re_pattern.match, contents, pos, end)
+            else:
+                match = rule.re_pattern.match(contents, pos, end)
+        except RuleTimedOut:
+            match = None
+        if self.profile is not None:
+            self.profile.add(rule, timer() - match_start, matches=int(match is not None))
+        return match
+
+    def find_matches(self, text, skip=None):
+        """Find all matches for the ALL() rules in a Text.
+
+        Returns OrderedDict of {rule: [(match, lines), ...]}, in the same order as
+        the rules and with the same matches as running find_iter() for each rule.
+        """
+        results = OrderedDict((rule, []) for rule in self.all_rules)
+        for rule, match in self.iter_matches(text, skip):
+            lines = text.find_lines_with_char_num_range(match.start()+1, match.end())
+            results[rule].append((match, lines))
+        return results
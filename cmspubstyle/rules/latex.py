@@ -205,7 +205,7 @@ for func_name in COMMON_FUNC_NAMES:
              re_pattern=re.compile(r"(?<!\\)"+func_name+r"[^\w\-]"),
              # re_pattern=re.compile(r"(?<!\\)"+func_name+r"\s*?(\\|\(|\[)"),
             #  where=ALL())
-             where=[INLINE("$"), COMMAND("EQUATION")])
+             where=[INLINE("$"), ENVIRONMENT("equation")])
     )
     TESTS.extend([
         TestRule(rule=RULES[-1], text=r"$\\times "+func_name+r"(x)$"),
@@ -0,0 +1,247 @@
+"""Split LaTeX into regions: commands, environments, maths, and comments"""
+
+
+import re
+from bisect import bisect_right
+
+
+# Kinds of Region
+DOCUMENT = "document"
+COMMAND = "command"
+ENVIRONMENT = "environment"
+MATH = "math"
+COMMENT = "comment"
+GROUP = "group"
+
+# Everything that can start or end a region.
+# A backslash escapes the next character, so \%, \$, \{, \} are plain text
+TOKEN_RE = re.compile(r"\\(?:[A-Za-z]+|.)|\$\$|[{}$%]")
+# Environment name after \begin or \end
+ENV_NAME_RE = re.compile(r"\{([^{}]*)\}")
+# Optional arguments after \begin{...}, e.g. \begin{figure}[htb]
+ENV_OPT_ARGS_RE = re.compile(r"(?:\[[^\]]*\])*")
+
+MATH_DELIMS = {"$": "$", "$$": "$$", "\\(": "\\)", "\\[": "\\]"}
+
+
+class SpanIndex(object):
+    """Sorted, non-overlapping (start, end) spans, for quickly checking if a position is in any.
+
+    Overlapping or touching spans are merged.
+    """
+
+    def __init__(self, spans):
+        self.starts, self.ends = [], []
+        for start, end in sorted(spans):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def contains(self, pos):
+        """Check if pos is inside any span"""
+        ind = bisect_right(self.starts, pos) - 1
+        return ind >= 0 and pos < self.ends[ind]
+
+    def overlaps(self, start, end):
+        """Check if [start, end) overlaps any span"""
+        ind = bisect_right(self.starts, end - 1) - 1 if end > start else -1
+        return ind >= 0 and start < self.ends[ind]
+
+    def covers(self, start, end):
+        """Check if [start, end) is all inside one span"""
+        ind = bisect_right(self.starts, start) - 1
+        return ind >= 0 and end <= self.ends[ind]
+
+
+class Region(object):
+    """One region of LaTeX, e.g. a command, environment, maths or a comment.
+
+    kind is one of the kinds above. name is the command name (without backslash),
+    environment name, or opening delimiter for maths.
+    start & end are the (0-indexed, end exclusive) span of the whole region,
+    content_start & content_end are the span of just its contents,
+    e.g. inside the {} of a command.
+    """
+
+    def __init__(self, kind, name, start, content_start, parent=None):
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.content_start = content_start
+        self.content_end = None
+        self.end = None
+        self.parent = parent
+        self.children = []
+
+    def close(self, content_end, end):
+        """Mark the end of this region"""
+        self.content_end = content_end
+        self.end = end
+
+    @property
+    def closed(self):
+        return self.end is not None
+
+    def __repr__(self):
+        return "Region(%s, %r, span=(%s, %s))" % (self.kind, self.name, self.start, self.end)
+
+
+class RegionTree(object):
+    """Tree of Regions in some LaTeX, made in one pass over the text.
+
+    contents is the LaTeX as one str, and line_starts is a list of the
+    (0-indexed) positions in it where each line starts, so comments can be ended.
+    Regions that aren't closed (e.g. a missing }) are dropped.
+    """
+
+    def __init__(self, contents, line_starts):
+        self.contents = contents
+        self.line_starts = line_starts
+        self.root = Region(DOCUMENT, None, 0, 0)
+        self.root.close(len(contents), len(contents))
+        # (kind, name) -> list of Regions, in order of start
+        self._regions = {}
+        # (kind, name) -> SpanIndex of their contents
+        self._span_indices = {}
+        self._parse()
+
+    def _line_end(self, pos):
+        """Get position of the end of the line that contains pos"""
+        ind = bisect_right(self.line_starts, pos)
+        return self.line_starts[ind] if ind < len(self.line_starts) else len(self.contents)
+
+    def _trim_environment(self, region):
+        """Don't include the rest of the \\begin line or start of the \\end line if they're empty"""
+        contents = self.contents
+        start, end = region.content_start, region.content_end
+        begin_line_end = self._line_end(start)
+        if start < begin_line_end <= end and contents[start:begin_line_end].strip() == "":
+            start = begin_line_end
+        end_line_start = self.line_starts[max(bisect_right(self.line_starts, end) - 1, 0)]
+        if start <= end_line_start < end and contents[end_line_start:end].strip() == "":
+            end = end_line_start
+        region.content_start, region.content_end = start, end
+
+    def _parse(self):
+        contents = self.contents
+        opened = []
+        stack = [self.root]
+        # last command, to attach a directly following {...} to it
+        last_command = None
+
+        def open_region(kind, name, start, content_start):
+            region = Region(kind, name, start, content_start, parent=stack[-1])
+            stack[-1].children.append(region)
+            stack.append(region)
+            opened.append(region)
+            return region
+
+        def close_region(test, content_end, end):
+            """Close the innermost open region that passes test, dropping any open inside it"""
+            for ind in range(len(stack)-1, 0, -1):
+                if test(stack[ind]):
+                    stack[ind].close(content_end, end)
+                    del stack[ind:]
+                    return True
+            return False
+
+        pos = 0
+        while True:
+            match = TOKEN_RE.search(contents, pos)
+            if not match:
+                break
+            token, start, pos = match.group(0), match.start(), match.end()
+            command, last_command = last_command, None
+
+            if token == "%":
+                end = self._line_end(start)
+                comment = Region(COMMENT, None, start, start+1, parent=stack[-1])
+                comment.close(end, end)
+                stack[-1].children.append(comment)
+                opened.append(comment)
+                pos = end
+
+            elif token == "{":
+                if command is not None and command[2] == start:
+                    open_region(COMMAND, command[0], command[1], pos)
+                else:
+                    open_region(GROUP, None, start, pos)
+
+            elif token == "}":
+                close_region(lambda r: r.kind in (COMMAND, GROUP), start, pos)
+
+            elif token in ("$", "$$"):
+                top = stack[-1]
+                if top.kind == MATH and top.name == token:
+                    top.close(start, pos)
+                    stack.pop()
+                else:
+                    open_region(MATH, token, start, pos)
+
+            elif token in ("\\(", "\\["):
+                open_region(MATH, token, start, pos)
+
+            elif token in ("\\)", "\\]"):
+                close_region(lambda r, t=token: r.kind == MATH and MATH_DELIMS[r.name] == t,
+                             start, pos)
+
+            elif token in ("\\begin", "\\end"):
+                name_match = ENV_NAME_RE.match(contents, pos)
+                if not name_match:
+                    continue
+                name = name_match.group(1)
+                if token == "\\begin":
+                    pos = ENV_OPT_ARGS_RE.match(contents, name_match.end()).end()
+                    open_region(ENVIRONMENT, name, start, pos)
+                else:
+                    pos = name_match.end()
+                    close_region(lambda r: r.kind == ENVIRONMENT and r.name == name, start, pos)
+
+            elif token[1:].isalpha():
+                last_command = (token[1:], start, pos)
+
+        for region in opened:
+            if region.closed:
+                if region.kind == ENVIRONMENT:
+                    self._trim_environment(region)
+                self._regions.setdefault((region.kind, region.name), []).append(region)
+
+        # drop unclosed regions from the tree, moving their children up
+        def prune(region):
+            children = []
+            for child in region.children:
+                prune(child)
+                if child.closed:
+                    children.append(child)
+                else:
+                    for grandchild in child.children:
+                        grandchild.parent = region
+                    children.extend(child.children)
+            region.children = children
+        prune(self.root)
+
+    def span_index(self, kind, name=None):
+        """Get SpanIndex of the contents of all Regions of a kind (and name if given)
+
+        Made on first use, then shared.
+        """
+        key = (kind, name)
+        if key not in self._span_indices:
+            self._span_indices[key] = SpanIndex([(r.content_start, r.content_end)
+                                                 for r in self.find(kind, name)])
+        return self._span_indices[key]
+
+    def find(self, kind, name=None):
+        """Get list of Regions of a kind (and name if given), in order of their start"""
+        if name is not None:
+            return self._regions.get((kind, name), [])
+        regions = [r for (k, _), these in self._regions.items() if k == kind for r in these]
+        return sorted(regions, key=lambda r: r.start)
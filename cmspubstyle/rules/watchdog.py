@@ -0,0 +1,126 @@
+"""Stop rules that take too long on a piece of text, e.g. due to catastrophic backtracking"""
+
+
+import signal
+import threading
+from contextlib import contextmanager
+
+from cmspubstyle.profiling import timer
+
+
+class RuleTimedOut(Exception):
+    """Raised when a rule uses up its time on a Text"""
+
+    def __init__(self, rule):
+        super(RuleTimedOut, self).__init__(rule)
+        self.rule = rule
+
+
+class Watchdog(object):
+    """Limits the total time each rule can spend searching one Text to budget seconds.
+
+    Regex calls are made through call(). Once a rule goes over budget, it raises
+    RuleTimedOut, as do any later calls for that rule on the same Text.
+    While armed (in the main thread, on platforms with signal.setitimer),
+    a timer also interrupts a regex call that is still running once it goes
+    over budget, since re can't be stopped any other way. Otherwise calls are
+    only checked once they finish.
+
+    Rules that time out are added to timeouts as (filename, rule), where
+    filename is whatever the current one is set to. The rule is None for
+    the combined scan of a RuleSet.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.filename = None
+        self.timeouts = []
+        self._used = {}
+        self._timed_out = []
+        # rule currently being searched for (if in a call), and when it started
+        self._in_call = False
+        self._rule = None
+        self._call_start = None
+        self._armed = False
+
+    def start_text(self):
+        """Reset time used by each rule, for a new Text"""
+        self._used = {}
+        self._timed_out = []
+
+    @property
+    def timed_out(self):
+        """List of rules that have timed out on this Text, in order"""
+        return list(self._timed_out)
+
+    def is_timed_out(self, rule):
+        """Check if a rule has already timed out on this Text"""
+        return rule in self._timed_out
+
+    def _over_budget(self, rule, now):
+        return self._used.get(rule, 0) + now - self._call_start > self.budget
+
+    def _time_out(self, rule):
+        if rule not in self._timed_out:
+            self._timed_out.append(rule)
+            self.timeouts.append((self.filename, rule))
+
+    def call(self, rule, func, *args):
+        """Return func(*args), a regex call on behalf of rule, raising RuleTimedOut if over budget"""
+        if rule in self._timed_out:
+            raise RuleTimedOut(rule)
+        self._call_start = timer()
+        self._rule = rule
+        try:
+            self._in_call = True
+            result = func(*args)
+        except RuleTimedOut:
+            self._in_call = False
+            self._time_out(rule)
+            raise
+        self._in_call = False
+        now = timer()
+        self._used[rule] = self._used.get(rule, 0) + now - self._call_start
+        if self._used[rule] > self.budget:
+            # still return this result, but don't search any more
+            self._time_out(rule)
+        return result
+
+    def iter_calls(self, rule, iterator):
+        """Iterate over iterator (e.g. of regex matches), making each step through call().
+
+        Stops early if the rule times out.
+        """
+        try:
+            while True:
+                item = self.call(rule, next, iterator, StopIteration)
+                if item is StopIteration:
+                    return
+                yield item
+                if rule in self._timed_out:
+                    return
+        except RuleTimedOut:
+            return
+
+    def _handle_alarm(self, signum, frame):
+        if self._in_call and self._over_budget(self._rule, timer()):
+            self._in_call = False
+            raise RuleTimedOut(self._rule)
+
+    @contextmanager
+    def armed(self):
+        """Interrupt regex calls that go over budget while in this context, if possible"""
+        if (self._armed or not hasattr(signal, "setitimer")
+                or threading.current_thread() is not threading.main_thread()):
+            yield
+            return
+        interval = min(max(self.budget / 4., 0.001), 0.25)
+        old_handler = signal.signal(signal.SIGALRM, self._handle_alarm)
+        old_timer = signal.setitimer(signal.ITIMER_REAL, interval, interval)
+        self._armed = True
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, *old_timer)
+            signal.signal(signal.SIGALRM, old_handler)
+            self._armed = False
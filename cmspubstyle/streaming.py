@@ -0,0 +1,70 @@
+"""Read huge or piped inputs in overlapping windows of lines, so they never have to be
+in memory all at once"""
+
+
+import sys
+import mmap
+import locale
+
+from cmspubstyle.rules.classes import Text
+
+
+def iter_stdin_lines():
+    """Iterate over lines from stdin"""
+    for line in sys.stdin:
+        yield line
+
+
+def iter_mmap_lines(filename):
+    """Iterate over lines of a file via a memory map, decoding them the same way as open() would.
+
+    Only the current line is held in memory as a str.
+    """
+    encoding = locale.getpreferredencoding(False)
+    with open(filename, 'rb') as f:
+        try:
+            contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return
+        try:
+            while True:
+                line = contents.readline()
+                if not line:
+                    break
+                yield line.decode(encoding).replace("\r\n", "\n")
+        finally:
+            contents.close()
+
+
+def iter_windows(lines, window_lines=2000, overlap_lines=50):
+    """Split an iterable of lines into overlapping windows.
+
+    Yields (Text of window, first owned line number, last owned line number + 1),
+    where the owned lines of the windows don't overlap & cover all the lines,
+    so a match is counted by the window that owns the line it starts on.
+    Each window also has up to overlap_lines lines either side of the ones it owns,
+    so matches (and regions like $...$) that cross into the next or previous
+    window are still found, as long as they are shorter than overlap_lines.
+    The leading overlap starts after a blank line where possible, since
+    e.g. maths can't cross a paragraph break.
+    The last window owns everything to the end.
+    """
+    window_lines = max(window_lines, 1)
+    buf, buf_start = [], 1
+    own_start = 1
+    for line in lines:
+        buf.append(line)
+        if buf_start + len(buf) >= own_start + window_lines + overlap_lines:
+            yield Text(buf, line_num_start=buf_start), own_start, own_start + window_lines
+            own_start += window_lines
+            # keep the lines needed before the next owned lines, from a paragraph break if any
+            context_start = max(own_start - overlap_lines, buf_start)
+            for line_num in range(context_start, own_start):
+                if buf[line_num - buf_start].strip() == "":
+                    context_start = line_num
+                    break
+            del buf[:context_start - buf_start]
+            buf_start = context_start
+    if buf and own_start < buf_start + len(buf):
+        yield Text(buf, line_num_start=buf_start), own_start, float("inf")
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+
+# the rules are loaded (and saved as a bundle) when pubcheck is first imported,
+# which is before any fixture runs, so keep that bundle out of the user's cache too
+BUNDLE_DIR = tempfile.mkdtemp(prefix="cmspubstyle-tests-")
+os.environ["CMSPUBSTYLE_CACHE_DIR"] = BUNDLE_DIR
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(BUNDLE_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def bundle_dir(tmp_path, monkeypatch):
+    """Save rule bundles in a temporary directory, rather than the user's cache"""
+    monkeypatch.setenv("CMSPUBSTYLE_CACHE_DIR", str(tmp_path))
+
+
+ROOT = r"""\documentclass{cmspaper}
+\begin{document}
+\title{A search at 13 TeV}
+\abstract{
+We present a search, i.e. a test. The CMS experiment at the LHC in 2016.
+}
+\input{intro}
+\input{method}
+\end{document}
+"""
+
+INTRO = r"""\section{Introduction}
+The Standard Model is great, e.g. for the the top quark.
+% a comment with i.e. inside
+Results from Ram et al show a $\frac{1}{2}$ effect at 13 TeV.
+"""
+
+METHOD = r"""\section{Method}
+We apply a cut on the $\pt$ of jets.
+The dataset is large, it's true.
+"""
+
+
+@pytest.fixture
+def paper(tmp_path, monkeypatch):
+    """Make a small paper with 2 included files, and run from its directory"""
+    for name, contents in [("paper.tex", ROOT), ("intro.tex", INTRO), ("method.tex", METHOD)]:
+        (tmp_path / name).write_text(contents)
+    monkeypatch.chdir(tmp_path)
+    return "paper.tex"
+
+
+@pytest.fixture
+def papers(tmp_path, monkeypatch):
+    """Make a directory with 2 papers, each with their own included files"""
+    for subdir in ["a", "b"]:
+        os.makedirs(str(tmp_path / "papers" / subdir))
+        for name, contents in [("paper.tex", ROOT), ("intro.tex", INTRO), ("method.tex", METHOD)]:
+            (tmp_path / "papers" / subdir / name).write_text(contents)
+    with open(str(tmp_path / "papers" / "b" / "method.tex"), "a") as f:
+        f.write("The the end.\n")
+    monkeypatch.chdir(tmp_path)
+    return "papers"
+
+
+@pytest.fixture
+def run_main(capsys):
+    """Function to run pubcheck.main without a cache file, returning what was printed"""
+    # imported here, so the rules are only loaded once the bundle directory is set above
+    from cmspubstyle import pubcheck
+
+    def run(args):
+        if os.path.isfile("checker_cache.json"):
+            os.remove("checker_cache.json")
+        assert(pubcheck.main(args) == 0)
+        return capsys.readouterr().out
+    return run
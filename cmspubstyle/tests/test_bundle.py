@@ -0,0 +1,69 @@
+import os
+import sys
+
+from cmspubstyle.rules import bundle
+from cmspubstyle.rules.bundle import load_rule_set, build_rule_set, LazyRule
+from cmspubstyle.rules.classes import Text
+
+
+TEXT = Text([r"The Standard Model is great, e.g. for the", r"the top quark. Results from",
+             r"Ram et al show a $\frac{1}{2}$ effect at 13 TeV, i.e. big."])
+
+
+def rule_keys(rule_set):
+    return [(rule.description, rule.re_pattern.pattern, rule.re_pattern.flags, repr(rule.where),
+             rule_set.required_literals.get(rule), rule_set.first_chars.get(rule, False))
+            for rule in rule_set.rules]
+
+
+def match_keys(rule_set):
+    return [(rule.description, match.span()) for rule, match in rule_set.iter_matches(TEXT)]
+
+
+def test_bundle_same_rules(tmp_path):
+    built = build_rule_set()
+    first = load_rule_set(str(tmp_path))
+    assert(len(os.listdir(str(tmp_path))) == 1)
+    loaded = load_rule_set(str(tmp_path))
+    assert(all(isinstance(rule, LazyRule) for rule in loaded.rules))
+    # patterns are only compiled when needed
+    assert(not any(rule._re_pattern is not None for rule in loaded.rules))
+    assert(rule_keys(loaded) == rule_keys(built) == rule_keys(first))
+    assert(loaded.fingerprint() == built.fingerprint())
+    assert(match_keys(loaded) == match_keys(built))
+
+
+def test_bundle_rebuilt(tmp_path, monkeypatch):
+    load_rule_set(str(tmp_path))
+    old_files = os.listdir(str(tmp_path))
+    # as if a rule had changed
+    monkeypatch.setattr(bundle, "bundle_key", lambda: "changed")
+    rule_set = load_rule_set(str(tmp_path))
+    assert(not isinstance(rule_set.rules[0], LazyRule))
+    # the old bundle is kept, e.g. for another install
+    assert(sorted(os.listdir(str(tmp_path))) == sorted(old_files + ["rules-changed.json"]))
+    assert(isinstance(load_rule_set(str(tmp_path)).rules[0], LazyRule))
+
+
+def test_old_bundles_removed(tmp_path, monkeypatch):
+    for ind in range(bundle.MAX_BUNDLES + 2):
+        monkeypatch.setattr(bundle, "bundle_key", lambda: "key%d" % ind)
+        load_rule_set(str(tmp_path))
+        filename = bundle.bundle_filename(str(tmp_path), "key%d" % ind)
+        # as if saved one after another
+        os.utime(filename, (ind, ind))
+    (tmp_path / "other.json").write_text("")
+    bundle.remove_old_bundles(str(tmp_path))
+    assert(sorted(os.listdir(str(tmp_path)))
+           == ["other.json"] + ["rules-key%d.json" % ind for ind in range(2, bundle.MAX_BUNDLES + 2)])
+
+
+def test_key_has_python_version():
+    assert("-py%d.%d-" % sys.version_info[:2] in bundle.bundle_key())
+
+
+def test_bundle_not_writeable(tmp_path):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    rule_set = load_rule_set(str(not_a_dir))
+    assert(match_keys(rule_set) == match_keys(build_rule_set()))
@@ -0,0 +1,67 @@
+import os
+import json
+
+from cmspubstyle import pubcheck
+from cmspubstyle.checker import Checker, Violation
+
+
+def count_checks(monkeypatch):
+    """Count calls to check_text"""
+    calls = []
+    check_text = pubcheck.check_text
+
+    def counting_check_text(text, do_comments):
+        calls.append(text)
+        return check_text(text, do_comments)
+    monkeypatch.setattr(pubcheck, "check_text", counting_check_text)
+    return calls
+
+
+def test_check_string(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    checker = Checker()
+    violations = checker.check_string("We present a search,\r\ni.e. a test. % i.e. not this\n")
+    assert(Violation(file="<string>", part=None, line_start=2, line_end=2, column_start=1,
+                     column_end=4, rule="Use \\ie macro",
+                     rule_index=[r.description for r in checker.rules].index("Use \\ie macro"),
+                     match="i.e.") in violations)
+    assert(len([v for v in violations if v.match == "i.e."]) == 1)
+    assert(len(Checker(do_comments=True).check_string("i.e. % i.e.")) == 2)
+    # columns in the line, not the maths
+    frac = [v for v in checker.check_string(r"So $x = \frac{1}{2}$.") if v.match == "\\frac"]
+    assert([(v.column_start, v.column_end) for v in frac] == [(9, 13)])
+    # nothing printed or saved
+    assert(capsys.readouterr().out == "")
+    assert(os.listdir(str(tmp_path)) == [])
+
+
+def test_check_again_reuses_results(monkeypatch):
+    calls = count_checks(monkeypatch)
+    checker = Checker()
+    first = checker.check_string("The the end.", "a.tex")
+    assert(checker.check_string("The the end.", "a.tex") == first)
+    assert(len(calls) == 1)
+    assert(checker.check_string("The end.", "a.tex") == [])
+    assert(len(calls) == 2)
+
+
+def test_check_document_same_as_cli(paper, capsys, monkeypatch):
+    assert(pubcheck.main([paper, "--format", "ndjson"]) == 0)
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    os.remove("checker_cache.json")
+
+    violations = Checker().check_document(paper)
+    assert([dict(v._asdict(), part=v.part) for v in violations] ==
+           [dict(r, part=r.get('part')) for r in records])
+    assert(not os.path.exists("checker_cache.json"))
+    # columns in the line, not the title
+    title = [v for v in violations if v.part == "TITLE" and v.match == "TeV"]
+    assert([(v.line_start, v.column_start, v.column_end) for v in title] == [(3, 23, 25)])
+    assert(Checker().check_file("intro.tex") == [v for v in violations if v.file == "intro.tex"])
+
+    # only saved if asked, then reused
+    Checker(cache_filename="checker_cache.json").check_document(paper)
+    assert(os.path.exists("checker_cache.json"))
+    calls = count_checks(monkeypatch)
+    assert(Checker(cache_filename="checker_cache.json").check_document(paper) == violations)
+    assert(calls == [])
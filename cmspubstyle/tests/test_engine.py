@@ -0,0 +1,123 @@
+import re
+
+from cmspubstyle.rules import normal_text
+from cmspubstyle.rules import latex
+from cmspubstyle.rules.classes import Text, Rule, ALL, INLINE
+from cmspubstyle.rules.engine import RuleSet, pattern_first_chars, pattern_required_literals, MAX_COMPILED
+from cmspubstyle.rules.watchdog import Watchdog
+
+
+ALL_RULES = normal_text.RULES + latex.RULES
+ALL_TESTS = normal_text.TESTS + latex.TESTS
+RULE_SET = RuleSet(ALL_RULES)
+
+
+def per_rule_matches(text):
+    """What the engine should give, using the simple loop over rules"""
+    return [(rule, [(m.span(), [l.line_num for l in lines])
+                    for m, lines in text.find_iter(rule.re_pattern)])
+            for rule in RULE_SET.all_rules]
+
+
+def engine_matches(text):
+    return [(rule, [(m.span(), [l.line_num for l in lines]) for m, lines in matches])
+            for rule, matches in RULE_SET.find_matches(text).items()]
+
+
+def test_first_chars():
+    assert(pattern_first_chars(re.compile(r"(?<!\\)\bab")) == set("a"))
+    assert(pattern_first_chars(re.compile(r"ab", re.IGNORECASE)) == set("aA"))
+    assert(pattern_first_chars(re.compile(r"(x|y)?z")) == set("xyz"))
+    assert(pattern_first_chars(re.compile(r"\w+")) is None)
+    assert(pattern_first_chars(re.compile(r"a*")) is None)
+    # everything re treats as the same when ignoring case
+    assert(pattern_first_chars(re.compile(r"kin", re.IGNORECASE)) == set("kK\u212a"))
+    assert(pattern_first_chars(re.compile(r"(?i:ab)c")) == set("aA"))
+    assert(pattern_first_chars(re.compile(r"(?-i:a)b", re.IGNORECASE)) == set("a"))
+
+
+def test_required_literals():
+    assert(pattern_required_literals(re.compile(r"(?<!\\)\bi\.e\.")) == ("i.e.",))
+    assert(pattern_required_literals(re.compile(r"\\PT(slash|m)")) == ("\\PT",))
+    assert(pattern_required_literals(re.compile(r"(ab|cd)x?")) == ("ab", "cd"))
+    assert(pattern_required_literals(re.compile(r"Et Al", re.IGNORECASE)) == ("et al",))
+    assert(pattern_required_literals(re.compile(r"\w+")) is None)
+    # literals that ignore case differently from the rest of the pattern are left out
+    assert(pattern_required_literals(re.compile(r"(?i:abc)d")) == ("d",))
+    assert(pattern_required_literals(re.compile(r"ab(?-i:CD)", re.IGNORECASE)) == ("ab",))
+
+
+def test_skip_rules_without_literals():
+    rule_set = RuleSet([Rule("a", re.compile("abc"), ALL()),
+                        Rule("b", re.compile("XYZ", re.IGNORECASE), ALL())])
+    text = Text(["xyz here"])
+    matches = rule_set.find_matches(text)
+    assert([len(x) for x in matches.values()] == [0, 1])
+    assert(rule_set.num_scans == 2)
+    assert(rule_set.num_skipped == 1)
+
+
+def test_only_all_rules():
+    rule_set = RuleSet([Rule("a", re.compile("a"), ALL()),
+                        Rule("b", re.compile("b"), INLINE("$"))])
+    assert([r.description for r in rule_set.all_rules] == ["a"])
+
+
+def test_same_as_per_rule_on_rule_tests():
+    for test in ALL_TESTS:
+        assert(engine_matches(test.text) == per_rule_matches(test.text))
+
+
+def test_same_as_per_rule_on_document():
+    lines = []
+    for test in ALL_TESTS:
+        lines.append(test.text.text_as_one_line)
+        lines.append("")
+    text = Text(lines * 3)
+    assert(engine_matches(text) == per_rule_matches(text))
+
+
+def test_inline_flags_not_combined():
+    rule = Rule("Inline flags", re.compile(r"(?i)abc"), ALL())
+    rule_set = RuleSet([rule])
+    assert(rule_set.individual_rules == [rule])
+    assert(len(rule_set.find_matches(Text(["ABC abc"]))[rule]) == 2)
+
+
+def test_case_folds_same_as_per_rule():
+    # Kelvin sign and long s are the same as k and s when ignoring case
+    rule_set = RuleSet([Rule("k", re.compile(r"kinematics", re.IGNORECASE), ALL()),
+                        Rule("s", re.compile(r"systematics", re.IGNORECASE), ALL()),
+                        Rule("scoped", re.compile(r"(?i:abc)d"), ALL())])
+    text = Text(["\u212ainematics and \u017fystematics", "ABCd"])
+    matches = rule_set.find_matches(text)
+    for rule in rule_set.all_rules:
+        assert([m.span() for m, _ in matches[rule]]
+               == [m.span() for m, _ in text.find_iter(rule.re_pattern)])
+        assert(len(matches[rule]) == 1)
+
+
+def test_compiled_patterns_bounded():
+    rules = [Rule(str(i), re.compile("a%db" % i), ALL()) for i in range(MAX_COMPILED + 5)]
+    rule_set = RuleSet(rules)
+    # each text only has some of the rules' literals, so gets its own combined pattern
+    for i in range(len(rules)):
+        text = Text(["a%db a%db" % (i, (i + 1) % len(rules))])
+        matches = rule_set.find_matches(text)
+        assert([len(x) for x in matches.values()].count(1) == 2)
+    assert(len(rule_set._compiled) == MAX_COMPILED)
+
+
+def test_watchdog_stops_slow_rule():
+    # catastrophic backtracking on a long run of "a" without a "b"
+    slow = Rule("Slow", re.compile(r"(a+)+b"), ALL())
+    fast = Rule("Fast", re.compile(r"xyz"), ALL())
+    rule_set = RuleSet([slow, fast])
+    rule_set.watchdog = Watchdog(0.1)
+    rule_set.watchdog.start_text()
+    text = Text(["xyz " + "a" * 40 + " xyz ab"])
+    with rule_set.watchdog.armed():
+        matches = rule_set.find_matches(text)
+    # the rest of the checks carry on
+    assert([m.span() for m, _ in matches[fast]] == [(0, 3), (45, 48)])
+    assert(rule_set.watchdog.timed_out[-1] == slow)
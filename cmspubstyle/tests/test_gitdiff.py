@@ -0,0 +1,32 @@
+from cmspubstyle.gitdiff import parse_diff
+
+
+DIFF = """diff --git a/intro.tex b/intro.tex
+index 1111111..2222222 100644
+--- a/intro.tex
++++ b/intro.tex
+@@ -3 +3 @@ Introduction
+-old
++new
+@@ -10,2 +10,0 @@
+-removed
+-removed
+@@ -20,0 +19,3 @@
++added
++++ not a header
++added
+@@ -30 +30,2 @@
+--- not a header either
++changed
++++ b/still not a header
+diff --git a/gone.tex b/gone.tex
+deleted file mode 100644
+--- a/gone.tex
++++ /dev/null
+@@ -1 +0,0 @@
+-gone
+"""
+
+
+def test_parse_diff():
+    assert(parse_diff(DIFF) == {"intro.tex": {3, 10, 11, 19, 20, 21, 30, 31}})
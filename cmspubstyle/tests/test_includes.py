@@ -0,0 +1,72 @@
+import os
+import pytest
+
+from cmspubstyle import includes, pubcheck
+from cmspubstyle.includes import FileStore, resolve_includes, find_includes
+from cmspubstyle.rules.classes import Text
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    """Make files from a dict of {name: contents}, and run from their directory"""
+    monkeypatch.chdir(tmp_path)
+
+    def make(contents):
+        for name, text in contents.items():
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text)
+    return make
+
+
+def test_find_includes():
+    text = Text([r"\input{a} \include{sec/b}\subfile{c.tex}",
+                 r"\input d % \input{e}",
+                 r"\includegraphics{fig} \inputencoding{utf8}",
+                 r"% \input{f}"])
+    assert(find_includes(text) == ["a", "sec/b", "c.tex", "d"])
+
+
+def test_resolve_nested(files):
+    files({"paper.tex": "\\input{intro}\n\\include{sec/method}\n\\input{intro}\n",
+           "intro.tex": "Intro\n\\input sec/detail\n",
+           "sec/method.tex": "Method\n",
+           "sec/detail.tex": "Detail\n"})
+    includes = {}
+    with FileStore() as store:
+        assert(resolve_includes("paper.tex", store, includes=includes) ==
+               ["paper.tex", "intro.tex", os.path.join("sec", "detail.tex"),
+                os.path.join("sec", "method.tex")])
+    assert(includes["paper.tex"] == ["intro", "sec/method", "intro"])
+    assert(includes["intro.tex"] == ["sec/detail"])
+
+
+def test_resolve_circular(files):
+    files({"paper.tex": "\\input{a}\n",
+           "a.tex": "\\input{b}\n",
+           "b.tex": "\\input{a}\n\\input{paper}\n"})
+    circular = []
+    with FileStore() as store:
+        assert(resolve_includes("paper.tex", store, circular) == ["paper.tex", "a.tex", "b.tex"])
+    assert(circular == [("a.tex", "b.tex"), ("paper.tex", "b.tex")])
+
+
+def test_resolve_missing(files):
+    files({"paper.tex": "\\input{missing}\n"})
+    with FileStore() as store:
+        assert(resolve_includes("paper.tex", store) == ["paper.tex", "missing.tex"])
+
+
+def test_files_read_once(files, monkeypatch, capsys):
+    files({"paper.tex": "\\title{A title}\n\\abstract{CMS LHC}\n\\input{a}\n\\input{a}\n",
+           "a.tex": "Some text.\n"})
+    read_files = []
+    read_file = includes.read_file
+
+    def counting_read_file(filename):
+        read_files.append(filename)
+        return read_file(filename)
+
+    monkeypatch.setattr(includes, "read_file", counting_read_file)
+    assert(pubcheck.main(["paper.tex"]) == 0)
+    assert(sorted(read_files) == ["a.tex", "paper.tex"])
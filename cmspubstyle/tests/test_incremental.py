@@ -0,0 +1,97 @@
+from cmspubstyle import pubcheck
+from cmspubstyle.incremental import IncrementalChecker, structure_change, MAX_OPEN_LINES
+from cmspubstyle.rules.classes import Text
+
+
+LINES = [
+    "\\section{Introduction}\n",
+    "We present a search, i.e. a test.\n",
+    "\n",
+    "The the end of\n",
+    "the the paragraph, \\textit{which\n",
+    "\n",
+    "spans} two paragraphs.\n",
+    "\n",
+    "\\begin{equation}\n",
+    "  a = sin(x)\n",
+    "\n",
+    "\\end{equation}\n",
+    "\n",
+    "Results from Ram et al show a large effect at 13 TeV.\n",
+]
+
+
+def summary(problems):
+    return [(p.rule, [line.line_num for line in p.lines], p.match.group(0)) for p in problems]
+
+
+def full_check(lines):
+    return summary(pubcheck.check_text(Text(lines), False))
+
+
+def test_structure_change():
+    assert(structure_change("\\textit{a} \\{ $x$ % {") == (0, 0, 0, 0))
+    assert(structure_change("\\begin{itemize}\n\\item \\( x") == (0, 1, 1, 0))
+    assert(structure_change("} $x") == (-1, 0, 0, 1))
+    assert(structure_change("\\begin{document}\n\\begin{figure}") == (0, 1, 0, 0))
+
+
+def test_blocks_keep_commands_whole():
+    checker = IncrementalChecker()
+    blocks = [(b.start, b.end) for b in checker.split_blocks(LINES)]
+    assert(blocks == [(0, 3), (3, 8), (8, 13), (13, 14)])
+
+
+def test_blocks_in_document():
+    # the document environment doesn't stop blocks ending
+    lines = ["\\documentclass{cmspaper}\n", "\\begin{document}\n", "\n"] + LINES + ["\\end{document}\n"]
+    checker = IncrementalChecker()
+    blocks = [(b.start, b.end) for b in checker.split_blocks(lines)]
+    assert(blocks == [(0, 3), (3, 6), (6, 11), (11, 16), (16, 18)])
+    assert(summary(checker.check(lines)) == full_check(lines))
+
+    # editing the end of the document only checks it & its neighbour again
+    lines[-2] = "Results from Ram et al show the the effect.\n"
+    assert(summary(checker.check(lines)) == full_check(lines))
+    assert(checker.num_checked == 2)
+
+
+def test_blocks_unclosed_brace():
+    # a brace that is never closed only keeps a block going for MAX_OPEN_LINES lines
+    lines = ["{\\bf Note\n", "\n"] + ["The the end, i.e. a test.\n", "\n"] * MAX_OPEN_LINES
+    checker = IncrementalChecker()
+    blocks = checker.split_blocks(lines)
+    assert(len(blocks) > 2)
+    assert(all(block.end - block.start <= MAX_OPEN_LINES for block in blocks))
+    assert(summary(checker.check(lines)) == full_check(lines))
+
+    lines[-2] = "The end.\n"
+    assert(summary(checker.check(lines)) == full_check(lines))
+    assert(checker.num_checked == 2)
+
+
+def test_same_as_full_check():
+    checker = IncrementalChecker()
+    lines = list(LINES)
+    assert(summary(checker.check(lines)) == full_check(lines))
+    assert(checker.num_checked == checker.num_blocks == 4)
+
+    # edit the last paragraph: only it & its neighbour are checked again
+    lines[13] = "Results from Ram et al show the the effect.\n"
+    assert(summary(checker.check(lines)) == full_check(lines))
+    assert(checker.num_checked == 2)
+
+    # insert lines at the start: nothing after the next block is checked again,
+    # but line numbers are moved
+    lines[0:0] = ["i.e. this\n", "\n"]
+    assert(summary(checker.check(lines)) == full_check(lines))
+    assert(checker.num_checked == 2)
+
+    # nothing changed
+    assert(summary(checker.check(lines)) == full_check(lines))
+    assert(checker.num_checked == 0)
+
+    # open a brace that is never closed
+    lines[2] = "\\section{Introduction\n"
+    assert(summary(checker.check(lines)) == full_check(lines))
+    assert(checker.check([]) == [])
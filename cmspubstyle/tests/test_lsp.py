@@ -0,0 +1,156 @@
+import io
+import os
+import sys
+import json
+import subprocess
+
+from cmspubstyle import lsp, pubcheck
+from cmspubstyle.rules.classes import Rule, TextLine, RuleBroken, SavedMatch, ALL
+
+
+URI = "file:///paper/intro.tex"
+
+
+def encode(messages):
+    """Encode list of messages as a client would send them"""
+    stream = io.BytesIO()
+    for message in messages:
+        message = dict(message, jsonrpc="2.0")
+        lsp.write_message(stream, message)
+    return stream.getvalue()
+
+
+def decode(data):
+    """Decode all messages sent by the server"""
+    stream = io.BytesIO(data)
+    messages = []
+    while True:
+        message = lsp.read_message(stream)
+        if message is None:
+            return messages
+        messages.append(message)
+
+
+def change(start_line, start_char, end_line, end_char, text):
+    return {'range': {'start': {'line': start_line, 'character': start_char},
+                      'end': {'line': end_line, 'character': end_char}},
+            'text': text}
+
+
+def session(edits):
+    """Messages for a client session that opens URI, makes edits, then exits"""
+    messages = [
+        {'id': 1, 'method': "initialize", 'params': {'capabilities': {}}},
+        {'method': "initialized", 'params': {}},
+        {'method': "textDocument/didOpen",
+         'params': {'textDocument': {'uri': URI, 'languageId': "latex", 'version': 1,
+                                     'text': "We present a search.\n\nThe the end.\n"}}},
+    ]
+    for version, changes in enumerate(edits, 2):
+        messages.append({'method': "textDocument/didChange",
+                         'params': {'textDocument': {'uri': URI, 'version': version},
+                                    'contentChanges': changes}})
+    messages.extend([
+        {'id': 2, 'method': "textDocument/hover", 'params': {}},
+        {'method': "textDocument/didClose", 'params': {'textDocument': {'uri': URI}}},
+        {'id': 3, 'method': "shutdown"},
+        {'method': "exit"},
+    ])
+    return messages
+
+
+def diagnostics(responses):
+    """Get list of (version, list of (range, message)) from publishDiagnostics"""
+    return [(r['params'].get('version'),
+             [((d['range']['start']['line'], d['range']['start']['character'],
+                d['range']['end']['line'], d['range']['end']['character']), d['message'])
+              for d in r['params']['diagnostics']])
+            for r in responses if r.get('method') == "textDocument/publishDiagnostics"]
+
+
+def test_apply_change():
+    lines = lsp.split_lines("ab\r\ncd\n")
+    lsp.apply_change(lines, change(0, 1, 1, 1, "X\nY"))
+    assert(lines == ["aX\n", "Yd\n"])
+    lsp.apply_change(lines, change(2, 0, 2, 0, "end"))
+    assert(lines == ["aX\n", "Yd\n", "end"])
+    # positions are in UTF-16 code units
+    lines = ["\U0001F600a\n"]
+    lsp.apply_change(lines, change(0, 2, 0, 3, "b"))
+    assert(lines == ["\U0001F600b\n"])
+    lsp.apply_change(lines, {'text': "new"})
+    assert(lines == ["new"])
+
+
+def test_range_in_line_as_written():
+    rule = Rule("Test", r"the  ?end", ALL())
+    # as checked, multiple spaces are collapsed
+    line = TextLine(line_num=1, char_num_start=1, text="\U0001F600 the end ")
+    broken_rule = RuleBroken(rule=rule, match=SavedMatch(2, 9, "the end"), lines=[line])
+    assert(lsp.make_range(broken_rule, ["\U0001F600  the   end\n"]) ==
+           {'start': {'line': 0, 'character': 4}, 'end': {'line': 0, 'character': 13}})
+
+
+def test_session():
+    out = io.BytesIO()
+    edits = [
+        # fix the problem
+        [change(2, 0, 2, 4, "")],
+        # add a paragraph with a problem over 2 lines
+        [change(3, 0, 3, 0, "\nWe look at the\nthe end, i.e. here.\n")],
+    ]
+    assert(lsp.serve(io.BytesIO(encode(session(edits))), out) == 0)
+    responses = decode(out.getvalue())
+
+    assert(responses[0]['id'] == 1)
+    assert(responses[0]['result']['capabilities']['textDocumentSync']['change'] == 2)
+    errors = [r for r in responses if r.get('id') == 2]
+    assert(errors[0]['error']['code'] == lsp.METHOD_NOT_FOUND)
+    assert(responses[-1] == {'id': 3, 'result': None, 'jsonrpc': "2.0"})
+
+    published = diagnostics(responses)
+    assert([version for version, _ in published] == [1, 2, 3, None])
+    assert(any(r[:2] == (2, 0) for r, _ in published[0][1]))
+    assert(not any(r[0] == 2 for r, _ in published[1][1]))
+    ranges = [r for r, _ in published[2][1]]
+    assert((4, 11, 5, 3) in ranges)
+    assert((5, 9, 5, 13) in ranges)
+    # cleared on close
+    assert(published[3][1] == [])
+
+
+def test_bad_messages(monkeypatch):
+    monkeypatch.setattr(pubcheck.RULE_SET, "watchdog", None)
+    messages = session([[change(2, 0, 2, 4, "")]])
+    # a request & a notification that can't be handled, as they have no textDocument
+    messages[1:1] = [{'id': 4, 'method': "textDocument/didOpen", 'params': {}},
+                     {'method': "textDocument/didOpen", 'params': {}}]
+    data = (b"Content-Length: x\r\n\r\n"
+            + b"Content-Length: 9\r\n\r\n{not json"
+            + encode(messages))
+    out = io.BytesIO()
+    # every rule times out
+    assert(lsp.serve(io.BytesIO(data), out, rule_timeout=1e-9) == 0)
+    responses = decode(out.getvalue())
+
+    assert([r['error']['code'] for r in responses[:2]] == [lsp.PARSE_ERROR] * 2)
+    assert(responses[2]['id'] == 1)
+    assert(responses[3]['id'] == 4)
+    assert(responses[3]['error']['code'] == lsp.INTERNAL_ERROR)
+    assert(responses[4]['method'] == "window/logMessage")
+    # carries on as normal
+    assert([version for version, _ in diagnostics(responses)] == [1, 2, None])
+    assert(responses[-1] == {'id': 3, 'result': None, 'jsonrpc': "2.0"})
+    assert(pubcheck.RULE_SET.watchdog.timeouts == [])
+
+
+def test_server_process():
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([package_dir, env.get('PYTHONPATH', '')])
+    script = os.path.join(package_dir, "cmspubstyle", "pubcheck.py")
+    result = subprocess.run([sys.executable, script, "--lsp"], input=encode(session([])),
+                            stdout=subprocess.PIPE, env=env, check=True)
+    responses = decode(result.stdout)
+    assert(json.dumps(responses[0]['result']['serverInfo']) == '{"name": "cmspubstyle"}')
+    assert(len(diagnostics(responses)) == 2)
@@ -0,0 +1,97 @@
+import io
+import json
+
+from cmspubstyle import pubcheck
+from cmspubstyle.output import NdjsonWriter, SarifWriter, make_record
+from cmspubstyle.rules.classes import Text
+
+
+def test_record_lines_columns():
+    text = Text(["We present a search,", "i.e. a test of the", "the top quark."])
+    problems = list(pubcheck.check_text(text, do_comments=False))
+    out = io.StringIO()
+    writer = NdjsonWriter(out, pubcheck.ALL_RULES)
+    writer.write_problems("x.tex", problems)
+    writer.close()
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert(len(records) == len(problems))
+    ie = [r for r in records if r['match'] == "i.e."][0]
+    assert((ie['line_start'], ie['line_end'], ie['column_start'], ie['column_end'])
+           == (2, 2, 1, 4))
+    assert(ie['file'] == "x.tex")
+    assert(pubcheck.ALL_RULES[ie['rule_index']].description == ie['rule'])
+    # matches over 2 lines
+    the_the = [r for r in records if r['match'].startswith("the")][0]
+    assert((the_the['line_start'], the_the['line_end']) == (2, 3))
+    assert((the_the['column_start'], the_the['column_end']) == (16, 3))
+
+
+def test_record_columns_in_scoped_region():
+    # columns count from the start of the line, not of the maths or the abstract
+    text = Text([r"Half of the events $\frac{1}{2}$ pass.", r"\abstract{We at CMS LHC in 2016.}"])
+    records = [make_record("x.tex", p, 0) for p in pubcheck.check_text(text, do_comments=False)]
+    frac = [r for r in records if r['match'] == "\\frac"][0]
+    assert((frac['line_start'], frac['column_start'], frac['column_end']) == (1, 21, 25))
+    cms = [r for r in records if r['match'] == "CMS LHC"][0]
+    assert((cms['line_start'], cms['column_start'], cms['column_end']) == (2, 17, 23))
+
+
+def test_record_columns_in_title(paper, capsys):
+    assert(pubcheck.main([paper, "--format", "ndjson", "--output", "out.ndjson"]) == 0)
+    with open("out.ndjson") as f:
+        records = [json.loads(line) for line in f]
+    title = [r for r in records if r.get('part') == "TITLE" and r['match'] == "TeV"][0]
+    # same as checking the whole file
+    with open(paper) as f:
+        whole = [make_record(paper, p, title['rule_index'])
+                 for p in pubcheck.check_text(Text(f.readlines()), do_comments=False)
+                 if p.rule.description == title['rule']]
+    assert([(r['line_start'], r['column_start'], r['column_end']) for r in whole]
+           == [(title['line_start'], title['column_start'], title['column_end'])] == [(3, 23, 25)])
+
+
+def test_ndjson(paper, run_main, capsys):
+    text_output = run_main([paper])
+    assert(pubcheck.main([paper, "--format", "ndjson"]) == 0)
+    captured = capsys.readouterr()
+    records = [json.loads(line) for line in captured.out.splitlines()]
+    assert(len(records) == text_output.count("  L"))
+    assert(set(r['file'] for r in records) == set(["paper.tex", "intro.tex", "method.tex"]))
+    assert(set(r.get('part') for r in records if r['file'] == "paper.tex")
+           == set([None, "ABSTRACT", "TITLE"]))
+    # normal output goes to stderr instead
+    assert("TOTAL:" in captured.err)
+
+
+def test_sarif_output_file(paper, run_main, capsys):
+    text_output = run_main([paper])
+    assert(pubcheck.main([paper, "--format", "sarif", "--output", "out.sarif"]) == 0)
+    assert("TOTAL:" in capsys.readouterr().out)
+    with open("out.sarif") as f:
+        sarif = json.load(f)
+    run = sarif['runs'][0]
+    assert(len(run['tool']['driver']['rules']) == len(pubcheck.ALL_RULES))
+    assert(len(run['results']) == text_output.count("  L"))
+    for result in run['results']:
+        rule = run['tool']['driver']['rules'][result['ruleIndex']]
+        assert(rule['id'] == result['ruleId'])
+
+
+def test_empty_sarif():
+    out = io.StringIO()
+    SarifWriter(out, pubcheck.ALL_RULES).close()
+    assert(json.loads(out.getvalue())['runs'][0]['results'] == [])
+
+
+def test_batch_ndjson(papers, run_main, capsys):
+    text_output = run_main([papers])
+    assert(pubcheck.main([papers, "--format", "ndjson", "--jobs", "2"]) == 0)
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert(len(records) == text_output.count("  L"))
+
+
+def test_stream_ndjson(paper, run_main, capsys):
+    text_output = run_main([paper, "--stream"])
+    assert(pubcheck.main([paper, "--stream", "--format", "ndjson"]) == 0)
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert(len(records) == text_output.count("  L"))
@@ -1,4 +1,5 @@
-from cmspubstyle.rules.classes import Text, TextLine
+from cmspubstyle.rules.classes import Text, TextLine, ALL, COMMAND, ENVIRONMENT, INLINE
+from cmspubstyle.rules.regions import SpanIndex
 
 doc = r"""\section{Corrections for $\PT > 50 \GeV$}
 
@@ -121,3 +122,98 @@ def test_find():
         # find_iter returns (match, [TextLine]) hence the [1][0]
         assert(e.line_num == m[1][0].line_num)
         assert(e.text == m[1][0].text)
+
+
+def test_find_line_with_char_num():
+    # char num 1 is the first char of line 1
+    assert(t.find_line_with_char_num(1).line_num == 1)
+    # check every char maps to the line that contains it
+    for line in t.text_contents:
+        for char_num in range(line.char_num_start, line.char_num_start + len(line.text)):
+            assert(t.find_line_with_char_num(char_num) == line)
+    assert(t.find_line_with_char_num(0) is None)
+
+
+def test_command_multiline_nested():
+    text = Text([r"\abstract{", r"A \textbf{bold} claim", r"over lines}", r"\abstract{second}"])
+    cmd_texts = list(text.iter_command("abstract"))
+    assert(len(cmd_texts) == 2)
+    # includes the space latex adds at the end of the first line
+    assert([l.line_num for l in cmd_texts[0].text_contents] == [1, 2, 3])
+    assert(cmd_texts[0].text_as_one_line == r" A \textbf{bold} claim over lines")
+    assert(cmd_texts[1].text_as_one_line == "second")
+    assert([x.text_as_one_line for x in text.iter_command("textbf")] == ["bold"])
+
+
+def test_sub_text_views():
+    text = Text([r"\abstract{A $x$", "", r"and $y$} end"])
+    abstract = next(text.iter_command("abstract"))
+    # shares the lines of the original, and only copies its text when used
+    assert(abstract._base is text and abstract._text is None)
+    assert(abstract.text_contents == [TextLine(line_num=1, char_num_start=1, text="A $x$"),
+                                      TextLine(line_num=2, char_num_start=6, text=" "),
+                                      TextLine(line_num=3, char_num_start=7, text="and $y$")])
+    # views of views refer to the original too
+    maths = list(abstract.iter_inline_delim("$"))
+    assert([x._base for x in maths] == [text, text])
+    assert([x.text_contents for x in maths] == [[TextLine(line_num=1, char_num_start=1, text="x")],
+                                                [TextLine(line_num=3, char_num_start=1, text="y")]])
+    match, lines = next(abstract.find_iter(re.compile("and")))
+    assert(lines == [abstract.text_contents[2]])
+
+
+def test_environment_same_line():
+    text = Text([r"a \begin{center}middle\end{center} b"])
+    env_texts = list(text.iter_environment("center"))
+    assert([x.text_as_one_line for x in env_texts] == ["middle"])
+    assert(list(text.iter_environment("table")) == [])
+
+
+def test_inline_maths_escapes_comments():
+    text = Text([r"costs \$5 and $x$ % not $maths$", r"then $$y$$ and \(z\)"])
+    assert([x.text_as_one_line for x in text.iter_inline_delim("$")] == ["x"])
+    assert([x.text_as_one_line for x in text.iter_inline_delim("$$")] == ["y"])
+    assert([x.text_as_one_line for x in text.iter_inline_delim("\\(")] == ["z"])
+
+
+def test_unclosed_regions():
+    text = Text([r"\section{oops", r"$a$ and \mbox{b}"])
+    assert(list(text.iter_command("section")) == [])
+    assert([x.text_as_one_line for x in text.iter_command("mbox")] == ["b"])
+    assert([x.text_as_one_line for x in text.iter_inline_delim("$")] == ["a"])
+
+
+def test_iter_location():
+    text = Text([r"\begin{itemize}\item a \begin{itemize}\item b\end{itemize}\end{itemize}"])
+    # nested environments are only given once, as part of the outer one
+    texts = list(text.iter_location(ENVIRONMENT("itemize")))
+    assert([x.text_as_one_line for x in texts] ==
+           [r"\item a \begin{itemize}\item b\end{itemize}"])
+    assert(list(text.iter_location(ALL())) == [text])
+    assert(list(text.iter_location(COMMAND("\\section"))) == [])
+
+
+def test_iter_location_shared():
+    text = Text([r"Some $x$ and $y$ maths"])
+    first = list(text.iter_location(INLINE("$")))
+    # an equal Location gives the same Texts, rather than making them again
+    second = list(text.iter_location(INLINE("$")))
+    assert([x.text_as_one_line for x in first] == ["x", "y"])
+    assert(all(a is b for a, b in zip(first, second)))
+
+
+def test_span_index_covers():
+    spans = SpanIndex([(2, 4), (6, 8), (7, 10)])
+    assert(spans.covers(6, 10))
+    assert(spans.covers(2, 2))
+    assert(not spans.covers(3, 7))
+    assert(not spans.covers(0, 1))
+    assert(not SpanIndex([]).covers(0, 5))
+
+
+def test_comments():
+    text = Text([r"5\% of a % comment", r"%whole line", r"no comment"])
+    contents = text.text_as_one_line
+    # touching comments are merged
+    assert([contents[s:e] for s, e in text.comments] == ["% comment %whole line "])
+    assert(not text.comments.contains(contents.index("\\%") + 1))
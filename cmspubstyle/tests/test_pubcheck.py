@@ -0,0 +1,345 @@
+import os
+import json
+import subprocess
+from collections import OrderedDict
+
+from cmspubstyle import pubcheck
+from cmspubstyle.rules.classes import Text, ALL
+from cmspubstyle.tests.conftest import ROOT, INTRO, METHOD
+
+
+def test_main(paper, run_main):
+    output = run_main([paper])
+    assert("Use \\ie macro" in output)
+    assert("TOTAL:" in output)
+
+
+def test_jobs_same_output(paper, run_main):
+    serial = run_main([paper])
+    parallel = run_main([paper, "--jobs", "2"])
+    assert(serial == parallel)
+
+
+def test_cache_reuses_unchanged_files(paper, run_main, capsys):
+    fresh = run_main([paper])
+    assert(pubcheck.main([paper]) == 0)
+    cached = capsys.readouterr().out
+    assert("Skipped 0 of 0 rule scans" in cached)
+    # only difference should be the comparison with the last run
+    assert(cached.count("[was ") == 5)
+
+    # changing a file means only that one is re-checked
+    with open("method.tex", "a") as f:
+        f.write("The the end.\n")
+    assert(pubcheck.main([paper]) == 0)
+    updated = capsys.readouterr().out
+    assert(updated.count("Duplicate words") == fresh.count("Duplicate words") + 1)
+    assert(updated.split("SUMMARY")[0] == run_main([paper]).split("SUMMARY")[0])
+
+
+def test_cache_depends_on_options(paper, run_main, capsys):
+    run_main([paper])
+    assert(pubcheck.main([paper, "--doComments"]) == 0)
+    output = capsys.readouterr().out
+    assert("Skipped 0 of 0 rule scans" not in output)
+
+
+def test_watch(paper, capsys):
+    args = pubcheck.create_arg_parser().parse_args([paper, "--watch"])
+    pubcheck.check_args(args)
+    file_cache = {}
+    pubcheck.watch(args, "checker_cache.json", file_cache, "key", max_checks=1)
+    output = capsys.readouterr().out
+    assert("intro.tex" in output)
+    assert("Watching 3 files for changes" in output)
+
+    # later checks only print out files that changed, plus the summary
+    with open("method.tex", "a") as f:
+        f.write("The the end.\n")
+    pubcheck.run_checks(args, "checker_cache.json", file_cache, "key", report_cached=False)
+    output = capsys.readouterr().out
+    summary_start = output.index("SUMMARY")
+    assert("method.tex" in output[:summary_start])
+    assert("intro.tex" not in output[:summary_start])
+    assert("intro.tex" in output[summary_start:])
+
+
+def test_watch_polls_without_reading(paper, capsys, monkeypatch):
+    args = pubcheck.create_arg_parser().parse_args([paper, "--watch"])
+    pubcheck.check_args(args)
+    reads = []
+    extract_input_files = pubcheck.extract_input_files
+    monkeypatch.setattr(pubcheck, "extract_input_files",
+                        lambda tex_file, file_store=None:
+                        reads.append(tex_file) or extract_input_files(tex_file, file_store))
+    sleeps = []
+
+    def sleep(duration):
+        sleeps.append(duration)
+        if len(sleeps) == 3:
+            with open("method.tex", "a") as f:
+                f.write("The the end.\n")
+        if len(sleeps) == 4:
+            with open("method.tex", "a") as f:
+                f.write("\\input{extra}\n")
+            with open("extra.tex", "w") as f:
+                f.write("More text.\n")
+    monkeypatch.setattr(pubcheck.time, "sleep", sleep)
+    pubcheck.watch(args, "checker_cache.json", {}, "key", max_checks=3)
+    # includes are only found again once an \input etc line changes
+    assert(len(sleeps) == 4)
+    assert(len(reads) == 2)
+    output = capsys.readouterr().out
+    assert(output.count("Watching 3 files for changes") == 2)
+    assert(output.count("Watching 4 files for changes") == 1)
+
+
+def test_cache_only_written_on_change(paper, run_main, monkeypatch):
+    run_main([paper])
+    with open("checker_cache.json") as f:
+        contents = f.read()
+    # compact, not indented
+    assert("\n" not in contents.strip())
+    writes = []
+    dump = pubcheck.json.dump
+    monkeypatch.setattr(pubcheck.json, "dump",
+                        lambda *args, **kwargs: writes.append(args) or dump(*args, **kwargs))
+    assert(pubcheck.main([paper]) == 0)
+    assert(writes == [])
+    with open("method.tex", "a") as f:
+        f.write("The the end.\n")
+    assert(pubcheck.main([paper]) == 0)
+    assert(len(writes) == 1)
+    with open("checker_cache.json") as f:
+        assert(json.load(f)['version'] == pubcheck.CACHE_VERSION)
+
+
+def test_watch_unclosed_abstract(paper, capsys):
+    # e.g. saved half-way through typing
+    with open(paper, "w") as f:
+        f.write(ROOT.replace("2016.\n}", "2016.\n"))
+    args = pubcheck.create_arg_parser().parse_args([paper, "--watch"])
+    pubcheck.check_args(args)
+    pubcheck.watch(args, "checker_cache.json", {}, "key", max_checks=1)
+    output = capsys.readouterr().out
+    assert("No complete \\abstract{...} found" in output)
+    assert("Watching 3 files for changes" in output)
+
+
+def test_summary_no_issues(capsys):
+    pubcheck.print_final_summary(OrderedDict([("intro.tex", []), ("method.tex", [])]),
+                                 {"intro.tex": 1})
+    output = capsys.readouterr().out
+    assert("No issues" in output)
+    assert("TOTAL: 0 issues across 0 files" in output)
+    pubcheck.print_final_summary(OrderedDict())
+    assert("No issues" in capsys.readouterr().out)
+
+
+def test_watch_incremental(paper, capsys):
+    args = pubcheck.create_arg_parser().parse_args([paper, "--watch"])
+    pubcheck.check_args(args)
+    with open("method.tex", "a") as f:
+        f.write("\nA second paragraph.\n\nThe end.\n")
+    checkers = {}
+    pubcheck.run_checks(args, "checker_cache.json", {}, "key", checkers=checkers)
+    assert(sorted(checkers) == ["intro.tex", "method.tex", "paper.tex"])
+
+    with open("method.tex", "w") as f:
+        f.write(METHOD + "\nA second paragraph.\n\nThe the end.\n")
+    capsys.readouterr()
+    pubcheck.run_checks(args, "checker_cache.json", {}, "key", checkers=checkers)
+    output = capsys.readouterr().out
+    # only the changed paragraph & the one before it are checked again
+    assert(checkers["method.tex"].num_blocks == 3)
+    assert(checkers["method.tex"].num_checked == 2)
+    assert("Duplicate words" in output)
+
+    # same problems as checking everything again
+    pubcheck.run_checks(args, "checker_cache.json", {}, "key")
+    assert(capsys.readouterr().out.split("SUMMARY")[0] == output.split("SUMMARY")[0])
+
+
+def test_check_text_in_line_order():
+    text = Text((INTRO + METHOD + ROOT + INTRO).splitlines())
+    problems = list(pubcheck.check_text(text, do_comments=False))
+    # should be the same as checking each rule in turn, then sorting by line
+    expected = []
+    for rule in pubcheck.ALL_RULES:
+        for location in pubcheck.get_locations(rule):
+            if isinstance(location, ALL):
+                expected.extend((rule, match.span())
+                                for match, lines in text.find_iter(rule.re_pattern, text.comments))
+            else:
+                for region_text in text.iter_location(location):
+                    # problems are given as positions in the whole text
+                    shift = region_text.offset
+                    expected.extend((rule, (match.start() + shift, match.end() + shift))
+                                    for match, lines in region_text.find_iter(rule.re_pattern,
+                                                                              region_text.comments))
+    line_nums = [p.lines[0].line_num for p in problems]
+    assert(line_nums == sorted(line_nums))
+    assert(len(problems) == len(expected))
+    assert(set((p.rule, p.match.span()) for p in problems) == set(expected))
+
+
+def test_command_environment_locations():
+    text = Text([r"\abstract{We did physics at CMS in 2016.}",
+                 r"No sin(x) here, only in", r"\begin{equation}", r"y = sin(x)", r"\end{equation}"])
+    problems = [(p.rule.description, p.lines[0].line_num, p.match.group(0))
+                for p in pubcheck.check_text(text, do_comments=False)]
+    assert(('Missing "LHC" in abstract', 1, "We did physics at CMS in 2016.") in problems)
+    assert(not any(p[0] == 'Missing "CMS" in abstract' for p in problems))
+    assert(("Use macro '\\sin'", 4, "sin(") in problems)
+    assert(not any(p[0] == "Use macro '\\sin'" and p[1] == 2 for p in problems))
+
+
+def test_comments_skipped():
+    text = Text([r"We use i.e. here. % but not i.e. here",
+                 r"% nor i.e. here",
+                 r"Errors of 5\% i.e. small, and $x % i.e. maths comment",
+                 r"= y$ too."])
+    problems = [(p.lines[0].line_num, p.match.group(0))
+                for p in pubcheck.check_text(text, do_comments=False)
+                if p.rule.description == "Use \\ie macro"]
+    assert(problems == [(1, "i.e."), (3, "i.e.")])
+    problems = [p for p in pubcheck.check_text(text, do_comments=True)
+                if p.rule.description == "Use \\ie macro"]
+    assert(len(problems) == 5)
+
+
+def test_comments_in_scoped_region():
+    # rules anchored to the start & end of the abstract still see all of it
+    def abstract_problems(lines):
+        return [p.rule.description for p in pubcheck.check_text(Text(lines), do_comments=False)
+                if "abstract" in p.rule.description]
+
+    problems = abstract_problems([r"\abstract{We at CMS % note", r"at the LHC in 2016.}"])
+    assert('Missing "LHC" in abstract' not in problems)
+    assert(not any("year" in p for p in problems))
+    problems = abstract_problems([r"\abstract{% note", r"We at CMS and ATLAS in 2016.}"])
+    assert('Missing "LHC" in abstract' in problems)
+
+
+def test_profile(paper, run_main, monkeypatch):
+    monkeypatch.setattr(pubcheck.RULE_SET, "profile", None)
+    plain = run_main([paper])
+    assert("PROFILE" not in plain)
+    for args in [[], ["--jobs", "2"]]:
+        profiled = run_main([paper, "--profileJson", "profile.json"] + args)
+        # same output, with the profile after it
+        assert(profiled.startswith(plain))
+        assert("Duplicate words" in profiled[len(plain):])
+        with open("profile.json") as f:
+            entries = json.load(f)
+        assert(set(x['file'] for x in entries) ==
+               {"paper.tex [ABSTRACT]", "paper.tex [TITLE]", "paper.tex", "intro.tex",
+                "method.tex"})
+        ie_matches = sum(x['matches'] for x in entries if x['rule'] == "Use \\ie macro")
+        assert(ie_matches == plain.count("[ Use \\ie macro ]"))
+
+
+def test_rule_timeout(paper, run_main, monkeypatch):
+    # put back the normal time limit afterwards
+    monkeypatch.setattr(pubcheck.RULE_SET, "watchdog", None)
+    # every rule goes over the time limit straight away
+    output = run_main([paper, "--ruleTimeout", "1e-9"])
+    assert("Rule timed out" in output)
+    assert("Timed out in intro.tex" in output)
+    assert("TOTAL:" in output)
+    # incomplete results aren't cached
+    assert(pubcheck.read_files_from_cache("checker_cache.json",
+                                          pubcheck.make_cache_key(False)) == {})
+
+
+def total_issues(output):
+    return int(output.split("TOTAL:")[1].split()[0])
+
+
+def test_batch(papers, run_main):
+    assert(pubcheck.find_documents([papers]) == [os.path.join(papers, "a", "paper.tex"),
+                                                 os.path.join(papers, "b", "paper.tex")])
+    singles = [total_issues(run_main([os.path.join(papers, x, "paper.tex")]))
+               for x in ["a", "b"]]
+
+    output = run_main([papers])
+    assert("Found 2 documents" in output)
+    assert(output.count("DOCUMENT: ") == 2)
+    assert(total_issues(output) == sum(singles))
+    # same as listing the files
+    assert(run_main([os.path.join(papers, x, "paper.tex") for x in ["a", "b"]])
+           .split("SUMMARY")[0] == output.split("SUMMARY")[0])
+
+
+def test_batch_jobs_same_output(papers, run_main, capsys):
+    serial = run_main([papers])
+    parallel = run_main([papers, "--jobs", "2"])
+    assert(serial == parallel)
+    # second run uses cached results
+    assert(pubcheck.main([papers, "--jobs", "2"]) == 0)
+    cached = capsys.readouterr().out
+    assert("Skipped 0 of 0 rule scans" in cached)
+    assert(cached.count("[was ") == 2)
+
+
+def test_batch_broken_document(papers, run_main):
+    good = run_main([papers])
+    # a document between the others that includes a missing file
+    os.makedirs(os.path.join(papers, "ab"))
+    with open(os.path.join(papers, "ab", "paper.tex"), "w") as f:
+        f.write(ROOT.replace("\\input{method}", "\\input{missing}"))
+    for jobs in ["1", "2"]:
+        output = run_main([papers, "--jobs", jobs])
+        assert(output.count("DOCUMENT: ") == 3)
+        broken = output.split("DOCUMENT: ")[2]
+        assert(broken.startswith(os.path.join(papers, "ab", "paper.tex")))
+        assert("Could not check document: FileNotFoundError" in broken)
+        # the other documents are checked as normal
+        assert(total_issues(output) == total_issues(good))
+        assert("Checked 2 documents" in output)
+        assert("Could not check 1 documents" in output)
+
+
+def git(*args):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] +
+                   list(args), check=True, stdout=subprocess.PIPE)
+
+
+def test_since(paper, run_main):
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-q", "-m", "First version")
+    assert(run_main([paper, "--since", "HEAD"]).count("Found 0 .tex files changed") == 1)
+
+    # a new problem in a changed paragraph, next to an existing one that isn't reported
+    with open("intro.tex", "w") as f:
+        f.write(INTRO.replace("Results from", "Results i.e. from"))
+    # new files only count if they are included
+    with open(paper, "w") as f:
+        f.write(ROOT.replace("\\input{method}", "\\input{method}\n\\input{new}"))
+    with open("new.tex", "w") as f:
+        f.write("The the end.\n")
+    with open("notes.tex", "w") as f:
+        f.write("The the notes.\n")
+    output = run_main([paper, "--since", "HEAD", "--format", "ndjson"])
+    records = [json.loads(line) for line in output.splitlines()]
+    # only problems on changed lines
+    assert(set((r['file'], r['line_start']) for r in records) ==
+           {("intro.tex", 4), ("new.tex", 1)})
+    assert(("intro.tex", "i.e.") in [(r['file'], r['match']) for r in records])
+    assert(("new.tex", "Duplicate words") in [(r['file'], r['rule']) for r in records])
+    assert(not os.path.exists("checker_cache.json"))
+
+
+def test_since_only_fixes(paper, run_main):
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-q", "-m", "First version")
+    # the diff settings of the user shouldn't matter
+    git("config", "diff.noprefix", "true")
+    with open("intro.tex", "w") as f:
+        f.write(INTRO.replace("The Standard Model is great, e.g. for the the top quark.",
+                              "We study the top quark."))
+    output = run_main([paper, "--since", "HEAD"])
+    assert("Found 1 .tex files changed" in output)
+    assert("No issues" in output)
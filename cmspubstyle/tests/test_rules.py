@@ -1,3 +1,5 @@
+import sys
+import subprocess
 import pytest
 from itertools import chain
 
@@ -24,6 +26,15 @@ def test_a_rule(test):
     assert(found != should_pass)
 
 
+def test_fixtures_lazy():
+    """Importing the checker shouldn't make the Texts for any TestRule"""
+    code = ("import cmspubstyle.pubcheck; "
+            "from cmspubstyle.rules import normal_text, latex; "
+            "print(sum(t._text is not None for t in normal_text.TESTS + latex.TESTS))")
+    output = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+    assert(output.strip() == "0")
+
+
 def run_all_rule_tests():
     for test in ALL_TESTS:
         test_a_rule(test)
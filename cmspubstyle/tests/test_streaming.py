@@ -0,0 +1,72 @@
+import io
+import pytest
+
+from cmspubstyle import pubcheck
+from cmspubstyle.streaming import iter_windows, iter_mmap_lines
+from cmspubstyle.rules.classes import Text
+
+
+PARAGRAPH = r"""The Standard Model is great, e.g. for the
+the top quark. Results from Ram et al show a $\frac{1}{2}$
+effect at 13 TeV. % a comment with i.e. inside
+We use Monte-Carlo samples, with errors of 5-10\%.
+
+"""
+
+LINES = (PARAGRAPH * 20).splitlines(True)
+
+
+def problem_keys(problems):
+    return [(p.rule.description, p.lines[0].line_num, p.match.group(0)) for p in problems]
+
+
+def check_windows(lines, window_lines, overlap_lines):
+    problems = []
+    for text, own_start, own_end in iter_windows(lines, window_lines, overlap_lines):
+        problems.extend(p for p in pubcheck.check_text(text, do_comments=False)
+                        if own_start <= p.lines[0].line_num < own_end)
+    return problems
+
+
+@pytest.mark.parametrize("window_lines", [1, 3, 7, 50, 1000])
+def test_windows_same_problems(window_lines):
+    expected = problem_keys(pubcheck.check_text(Text(LINES), do_comments=False))
+    assert(problem_keys(check_windows(iter(LINES), window_lines, 5)) == expected)
+
+
+def test_windows_own_all_lines():
+    owned = []
+    for text, own_start, own_end in iter_windows(iter(LINES), 7, 3):
+        line_nums = [x.line_num for x in text.text_contents]
+        # window has all the lines it owns, plus at most 3 either side
+        assert(line_nums[0] >= own_start - 3)
+        assert(len(line_nums) <= 7 + 6)
+        owned.extend(x for x in line_nums if own_start <= x < own_end)
+    assert(owned == list(range(1, len(LINES)+1)))
+
+
+def test_mmap_lines(tmp_path):
+    path = tmp_path / "big.tex"
+    path.write_text("".join(LINES))
+    assert(list(iter_mmap_lines(str(path))) == LINES)
+    empty = tmp_path / "empty.tex"
+    empty.write_text("")
+    assert(list(iter_mmap_lines(str(empty))) == [])
+
+
+def test_stream_stdin(monkeypatch, capsys):
+    monkeypatch.setattr("sys.stdin", io.StringIO("".join(LINES)))
+    assert(pubcheck.main(["-", "--windowLines", "4", "--windowOverlap", "2"]) == 0)
+    output = capsys.readouterr().out
+    assert("<stdin>" in output)
+    num_expected = len(list(pubcheck.check_text(Text(LINES), do_comments=False)))
+    assert(output.count("  L") == num_expected)
+    assert(("TOTAL: %d issues across 1 files" % num_expected) in output)
+
+
+def test_stream_clean_input(monkeypatch, capsys):
+    monkeypatch.setattr("sys.stdin", io.StringIO("Hello world.\n"))
+    assert(pubcheck.main(["-"]) == 0)
+    output = capsys.readouterr().out
+    assert("No issues" in output)
+    assert("TOTAL: 0 issues across 0 files" in output)
@@ -12,12 +12,16 @@ setuptools.setup(name='cmspubstyle',
                  url='https://github.com/raggleton/cmspubstyle',
                  packages=setuptools.find_packages(),
                  scripts=['cmspubstyle/pubcheck.py'],
+                 python_requires='>=3.7',
                  classifiers=(
                      "License :: OSI Approved :: MIT License ",
-                     "Programming Language :: Python :: 2.7",
-                     "Programming Language :: Python :: 3.5",
-                     "Programming Language :: Python :: 3.6",
+                     "Programming Language :: Python :: 3",
+                     "Programming Language :: Python :: 3 :: Only",
                      "Programming Language :: Python :: 3.7",
+                     "Programming Language :: Python :: 3.8",
+                     "Programming Language :: Python :: 3.9",
+                     "Programming Language :: Python :: 3.10",
+                     "Programming Language :: Python :: 3.11",
                      "Topic :: Scientific/Engineering :: Physics",
                      "Topic :: Text Processing"
                  )